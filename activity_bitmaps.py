@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Address Activity Bitmaps
+
+One compressed bitmap of active address ids per cached batch, for retention, churn and cohort analysis.
+
+The bitmaps are kept per period rather than as one bitmap of active periods per address: retention, churn and
+cohorts each compare whole periods, which takes one bitmap operation per period this way, and a new batch adds
+one bitmap instead of touching the bitmap of every address it saw. Per-address activity (first and last period,
+active count) is derived from them by first_last_seen.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+import address_dict
+import batch_cache
+
+ACTIVITY_FILE = "activity_bitmaps.npz"
+# Share of the batches since its first appearance an address must be active in to count as persistent
+PERSISTENT_SHARE = 0.5
+
+# Cached sections that feed the bitmaps: role -> (section, address field)
+ROLES = {
+    'senders': ('affected_addresses', 'from_address'),
+    'recipients': ('to_addresses', 'to_address'),
+}
+
+def make_bitmap(ids):
+    """Set of address ids: a roaring bitmap with pyroaring, else a sorted unique id array"""
+    ids = np.asarray(ids, dtype=np.uint32)
+    if BitMap is not None:
+        return BitMap(ids)
+    return np.unique(ids)
+
+def union(a, b):
+    """Ids in either set"""
+    return a | b if BitMap is not None else np.union1d(a, b)
+
+def intersection(a, b):
+    """Ids in both sets"""
+    return a & b if BitMap is not None else np.intersect1d(a, b, assume_unique=True)
+
+def difference(a, b):
+    """Ids in a but not in b"""
+    return a - b if BitMap is not None else np.setdiff1d(a, b, assume_unique=True)
+
+def bitmap_ids(bitmap):
+    """Ids of a set as a uint32 array"""
+    return np.array(bitmap.to_array() if BitMap is not None else bitmap, dtype=np.uint32)
+
+def build_activity(cache_dir, rebuild=False):
+    """Extend the per-batch activity bitmaps with the batches cached since the last build
+
+    Bitmaps of batches that are still selected and unchanged are kept; superseded or evicted ones are dropped.
+    """
+    addresses = address_dict.open_dictionary(cache_dir)
+    manifest = batch_cache.validate_cache(cache_dir)
+    ranges = batch_cache.range_index(manifest)
+    sections = [section for section, _ in ROLES.values()]
+    members = batch_cache.cached_members(manifest, ranges, sections)
+    previous = None if rebuild else load_activity(cache_dir)
+
+    kept = {}
+    if previous is not None and previous['members'] is not None:
+        for i, batch_range in enumerate(sorted(previous['members'])):
+            if members.get(batch_range) == previous['members'][batch_range]:
+                kept[batch_range] = {role: previous[role][i] for role in ROLES}
+        if len(kept) == len(previous['members']) == len(members):
+            return previous
+
+    added = [batch_range for batch_range in sorted(members) if batch_range not in kept]
+    for batch_range in added:
+        cached = {section: ranges[batch_range][section] for section in sections if section in ranges[batch_range]}
+        batch_data = batch_cache.load_batch(cache_dir, *batch_range, cached)
+        kept[batch_range] = {
+            role: make_bitmap(address_dict.encode_column(addresses, [r[field] for r in batch_data.get(section) or []]))
+            for role, (section, field) in ROLES.items()
+        }
+    batch_cache.flush_access(cache_dir)
+    if not kept:
+        return None
+    # Legacy batch files hold hex addresses, so ids may have been assigned above
+    address_dict.flush_dictionary(addresses)
+
+    ordered = sorted(kept)
+    bitmaps = {role: [kept[batch_range][role] for batch_range in ordered] for role in ROLES}
+    member_ranges, member_fingerprints = batch_cache.members_to_arrays({r: members[r] for r in ordered})
+    arrays = {'periods': member_ranges[:, 0], 'member_ranges': member_ranges,
+              'member_fingerprints': member_fingerprints,
+              'encoding': np.array('roaring' if BitMap is not None else 'ids')}
+    for role, role_bitmaps in bitmaps.items():
+        if BitMap is not None:
+            chunks = [np.frombuffer(bitmap.serialize(), dtype=np.uint8) for bitmap in role_bitmaps]
+        else:
+            chunks = role_bitmaps
+        arrays[f'{role}_data'] = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+        arrays[f'{role}_offsets'] = np.cumsum([0] + [len(chunk) for chunk in chunks]).astype(np.int64)
+
+    path = os.path.join(cache_dir, ACTIVITY_FILE)
+    batch_cache.atomic_savez(path, **arrays)
+
+    size = sum(arrays[f'{role}_data'].nbytes for role in ROLES)
+    print(f"Activity bitmaps: {len(added)} of {len(ordered)} batches read, {size / 1024:.0f} KB")
+    return {'periods': arrays['periods'], 'members': {r: members[r] for r in ordered}, **bitmaps}
+
+def load_activity(cache_dir):
+    """Load the persisted activity bitmaps, or None if they were never built or need pyroaring"""
+    path = os.path.join(cache_dir, ACTIVITY_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        roaring = str(data['encoding']) == 'roaring'
+        if roaring != (BitMap is not None):
+            # Written with the other backend; rebuilt by the next run
+            return None
+        members = batch_cache.stored_members(data)
+        activity = {'periods': data['periods'], 'members': members}
+        for role in ROLES:
+            blob, offsets = data[f'{role}_data'], data[f'{role}_offsets']
+            chunks = [blob[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            activity[role] = [BitMap.deserialize(chunk.tobytes()) for chunk in chunks] if roaring else chunks
+    return activity
+
+def select_periods(activity, start_block=None, end_block=None):
+    """Bitmaps per role of the batches starting inside a block window"""
+    periods = activity['periods']
+    lo = 0 if start_block is None else int(np.searchsorted(periods, start_block))
+    hi = len(periods) if end_block is None else int(np.searchsorted(periods, end_block))
+    return {'periods': periods[lo:hi], **{role: activity[role][lo:hi] for role in ROLES}}
+
+def first_last_seen(bitmaps):
+    """Active ids with the index of the first and last batch they appear in and their active batch count"""
+    ids = [bitmap_ids(bitmap) for bitmap in bitmaps]
+    if not ids or not sum(len(chunk) for chunk in ids):
+        empty = np.zeros(0, dtype=np.int64)
+        return {'ids': empty, 'first': empty, 'last': empty, 'active': empty}
+    all_ids = np.concatenate(ids)
+    period_index = np.repeat(np.arange(len(ids)), [len(chunk) for chunk in ids])
+    active_ids, inverse = np.unique(all_ids, return_inverse=True)
+    first = np.full(len(active_ids), len(ids), dtype=np.int64)
+    last = np.full(len(active_ids), -1, dtype=np.int64)
+    np.minimum.at(first, inverse, period_index)
+    np.maximum.at(last, inverse, period_index)
+    return {'ids': active_ids, 'first': first, 'last': last,
+            'active': np.bincount(inverse, minlength=len(active_ids))}
+
+def retention(bitmaps, lag=1):
+    """Share of each batch's active ids still active lag batches later"""
+    return [len(intersection(bitmaps[i], bitmaps[i + lag])) / len(bitmaps[i]) if len(bitmaps[i]) else 0.0
+            for i in range(len(bitmaps) - lag)]
+
+def churn(bitmaps):
+    """Per batch: ids never seen before, ids also active in the previous batch, ids active before but not now"""
+    rows = []
+    seen = make_bitmap([])
+    previous = make_bitmap([])
+    for bitmap in bitmaps:
+        rows.append({
+            'new': len(difference(bitmap, seen)),
+            'returning': len(intersection(bitmap, previous)),
+            'churned': len(difference(previous, bitmap)),
+        })
+        seen = union(seen, bitmap)
+        previous = bitmap
+    return rows
+
+def cohort_table(bitmaps, group=5):
+    """Active ids of each first-seen cohort in every later group of batches
+
+    Batches are grouped group at a time; row c holds the cohort first seen in group c, column k how many
+    of them were active in group c + k.
+    """
+    groups = []
+    for i in range(0, len(bitmaps), group):
+        merged = make_bitmap([])
+        for bitmap in bitmaps[i:i + group]:
+            merged = union(merged, bitmap)
+        groups.append(merged)
+
+    table = []
+    seen = make_bitmap([])
+    for c, members in enumerate(groups):
+        cohort = difference(members, seen)
+        table.append([len(intersection(cohort, later)) for later in groups[c:]])
+        seen = union(seen, members)
+    return table
+
+def activity_summary(activity, start_block=None, end_block=None):
+    """Persistence of the affected senders of a block window"""
+    window = select_periods(activity, start_block, end_block)
+    seen = first_last_seen(window['senders'])
+    count = len(seen['ids'])
+    if not count:
+        return None
+    span = len(window['periods']) - seen['first']
+    persistent = seen['active'] >= PERSISTENT_SHARE * span
+    return {
+        'senders': count,
+        'persistent_share': float(np.mean(persistent)),
+        'one_time_share': float(np.mean(seen['active'] == 1)),
+        'retention': float(np.mean(retention(window['senders']))) if len(window['periods']) > 1 else 0.0,
+    }
+
+def main():
+    """Print churn and cohort tables of the affected senders or recipients"""
+    parser = argparse.ArgumentParser(description='Retention, churn and cohorts of affected addresses in a batch cache')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--role', choices=list(ROLES), default='senders', help='Addresses to analyze')
+    parser.add_argument('--group', type=int, default=5, help='Batches per cohort')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the bitmaps from the cache first')
+    args = parser.parse_args()
+
+    activity = build_activity(args.cache_dir, rebuild=True) if args.rebuild else load_activity(args.cache_dir)
+    if activity is None:
+        print("No activity bitmaps built; run the analysis or pass --rebuild")
+        return
+
+    bitmaps = activity[args.role]
+    summary = first_last_seen(bitmaps)
+    print(f"{len(summary['ids']):,} {args.role} over {len(bitmaps)} batches; "
+          f"{np.mean(summary['active'] == 1):.1%} active in a single batch")
+
+    print(f"\n{'Batch start':>12} {'Active':>8} {'New':>8} {'Returning':>10} {'Churned':>8}")
+    for start_block, bitmap, row in zip(activity['periods'].tolist(), bitmaps, churn(bitmaps)):
+        print(f"{start_block:>12,} {len(bitmap):>8,} {row['new']:>8,} {row['returning']:>10,} {row['churned']:>8,}")
+
+    print(f"\nCohorts of {args.group} batches (ids first seen in a group still active in later groups):")
+    for c, row in enumerate(cohort_table(bitmaps, args.group)):
+        print(f"  {c:>3}: " + " ".join(f"{value:>6,}" for value in row))
+
+if __name__ == "__main__":
+    main()
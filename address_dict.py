@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Address Dictionary
+
+Persistent mapping of 20-byte addresses to dense int32 ids, shared by a cache directory.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+DICTIONARY_FILE = "addresses.bin"
+ADDRESS_BYTES = 20
+
+# One dictionary per directory; the rollup thread encodes concurrently with the main thread
+_dictionaries = {}
+_lock = threading.RLock()
+
+def open_dictionary(directory):
+    """Load (once per process) the address dictionary stored in a directory"""
+    path = os.path.join(directory, DICTIONARY_FILE)
+    with _lock:
+        if path in _dictionaries:
+            return _dictionaries[path]
+
+        data = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        # Ignore a partially appended record left by a crash
+        count = len(data) // ADDRESS_BYTES
+        keys = [data[i * ADDRESS_BYTES:(i + 1) * ADDRESS_BYTES] for i in range(count)]
+
+        dictionary = {
+            'path': path,
+            'keys': keys,
+            'ids': {key: address_id for address_id, key in enumerate(keys)},
+            'persisted': count
+        }
+        _dictionaries[path] = dictionary
+        return dictionary
+
+def encode(dictionary, address):
+    """Id of an address, assigning the next id to unseen addresses; ids pass through unchanged"""
+    if not isinstance(address, str):
+        return int(address)
+
+    key = bytes.fromhex(address[2:] if address.startswith('0x') else address)
+    address_id = dictionary['ids'].get(key)
+    if address_id is None:
+        with _lock:
+            address_id = dictionary['ids'].get(key)
+            if address_id is None:
+                address_id = len(dictionary['keys'])
+                dictionary['keys'].append(key)
+                dictionary['ids'][key] = address_id
+    return address_id
+
+def encode_column(dictionary, addresses):
+    """Encode a sequence of addresses as an int32 array
+
+    Hex strings and ids may be mixed, as when legacy batch files are folded with section files.
+    """
+    hex_rows = np.fromiter((isinstance(address, str) for address in addresses), dtype=bool, count=len(addresses))
+    if not hex_rows.any():
+        return np.asarray(addresses, dtype=np.int32)
+    encoded = np.zeros(len(addresses), dtype=np.int32)
+    encoded[~hex_rows] = [address for address in addresses if not isinstance(address, str)]
+    # Look each distinct address up once
+    unique, inverse = np.unique(np.array([address for address in addresses if isinstance(address, str)]),
+                                return_inverse=True)
+    ids = np.fromiter((encode(dictionary, address) for address in unique.tolist()), dtype=np.int32, count=len(unique))
+    encoded[hex_rows] = ids[inverse]
+    return encoded
+
+def decode(dictionary, address_id):
+    """Hex address of an id"""
+    return '0x' + dictionary['keys'][address_id].hex()
+
+def decode_column(dictionary, address_ids):
+    """Decode an array of ids to hex addresses"""
+    keys = dictionary['keys']
+    return ['0x' + keys[address_id].hex() for address_id in np.asarray(address_ids).tolist()]
+
+def flush_dictionary(dictionary):
+    """Append ids assigned since the last flush to the dictionary file"""
+    with _lock:
+        new_keys = dictionary['keys'][dictionary['persisted']:]
+        if not new_keys:
+            return 0
+
+        with open(dictionary['path'], 'ab') as f:
+            # Drop a torn record so appended ids stay aligned with their offsets
+            f.truncate(dictionary['persisted'] * ADDRESS_BYTES)
+            f.write(b''.join(new_keys))
+            f.flush()
+            os.fsync(f.fileno())
+        dictionary['persisted'] += len(new_keys)
+        return len(new_keys)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Sender-Recipient Graph
+
+Sparse matrices of affected transaction counts and excess gas from senders to recipients, over address ids.
+"""
+
+import argparse
+
+import numpy as np
+
+try:
+    from scipy import sparse
+    from scipy.sparse import csgraph
+except ImportError:
+    sparse = None
+
+import address_dict
+import batch_cache
+
+SECTION = 'address_pairs'
+# Matrix per pair measure: name -> section field
+PAIR_MEASURES = {
+    'transactions': 'transaction_count',
+    'excess_gas': 'total_excess_gas',
+}
+
+def pair_columns(batches, addresses):
+    """Concatenate the address pairs of several batches into id and measure arrays"""
+    records = [record for batch_data in batches for record in batch_data.get(SECTION) or []]
+    senders = address_dict.encode_column(addresses, [record['from_address'] for record in records])
+    recipients = address_dict.encode_column(addresses, [record['to_address'] for record in records])
+    measures = {name: np.array([record[field] for record in records], dtype=np.float64)
+                for name, field in PAIR_MEASURES.items()}
+    return senders, recipients, measures
+
+def build_graph(senders, recipients, measures, size):
+    """CSR matrices of size x size, rows senders and columns recipients; repeated pairs are summed"""
+    if sparse is None:
+        raise ImportError("The sender-recipient graph requires the 'scipy' package")
+    return {
+        name: sparse.csr_matrix((values, (senders, recipients)), shape=(size, size))
+        for name, values in measures.items()
+    }
+
+def window_graph(cache_dir, start_block=None, end_block=None):
+    """Sender-recipient matrices of the batches starting inside a block window
+
+    Returns the matrices and the number of selected batches without cached pairs.
+    """
+    addresses = address_dict.open_dictionary(cache_dir)
+    ranges = batch_cache.range_index(batch_cache.validate_cache(cache_dir))
+    batches = []
+    missing = 0
+    for batch_range in batch_cache.select_ranges(ranges, start_block, end_block):
+        info = ranges[batch_range].get(SECTION)
+        if info is None:
+            missing += 1
+            continue
+        batches.append(batch_cache.load_batch(cache_dir, *batch_range, {SECTION: info}))
+    batch_cache.flush_access(cache_dir)
+
+    senders, recipients, measures = pair_columns(batches, addresses)
+    return build_graph(senders, recipients, measures, len(addresses['keys'])), missing
+
+def senders_per_recipient(graph):
+    """Number of distinct senders of each recipient id"""
+    return graph['transactions'].getnnz(axis=0)
+
+def recipients_per_sender(graph):
+    """Number of distinct recipients of each sender id"""
+    return graph['transactions'].getnnz(axis=1)
+
+def shared_recipients(graph):
+    """Sender x sender matrix of the number of recipients two senders both sent to"""
+    linked = (graph['transactions'] > 0).astype(np.int32)
+    return linked @ linked.T
+
+def clusters(graph):
+    """Cluster label per address id: senders and recipients connected through shared recipients or senders
+
+    Ids without affected transactions get singleton labels.
+    """
+    _, labels = csgraph.connected_components(graph['transactions'], directed=False)
+    return labels
+
+def top_ids(values, top):
+    """Ids of the largest nonzero values, largest first"""
+    order = np.argsort(-values, kind='stable')[:top]
+    return order[values[order] > 0]
+
+def main():
+    """Print the most connected recipients, senders and clusters of a block window"""
+    parser = argparse.ArgumentParser(description='Sender-recipient structure of the affected transactions in a cache')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--start', type=int, default=None, help='First block (default: start of the cache)')
+    parser.add_argument('--end', type=int, default=None, help='End block, exclusive (default: end of the cache)')
+    parser.add_argument('--top', type=int, default=10, help='Entries to list per ranking')
+    args = parser.parse_args()
+
+    graph, missing = window_graph(args.cache_dir, args.start, args.end)
+    if missing:
+        print(f"{missing} batches have no cached address pairs; their transactions are not included")
+    addresses = address_dict.open_dictionary(args.cache_dir)
+    transactions = graph['transactions']
+    excess_gas = np.asarray(graph['excess_gas'].sum(axis=0)).ravel()
+    print(f"{transactions.nnz:,} sender-recipient pairs, {transactions.sum():,.0f} affected transactions")
+
+    per_recipient = senders_per_recipient(graph)
+    print("\nRecipients with the most distinct senders:")
+    for address_id in top_ids(per_recipient, args.top):
+        address = address_dict.decode_column(addresses, [address_id])[0]
+        print(f"  {address}: {per_recipient[address_id]:,} senders, {excess_gas[address_id]:,.0f} excess gas")
+
+    per_sender = recipients_per_sender(graph)
+    print("\nSenders reaching the most distinct recipients:")
+    for address_id in top_ids(per_sender, args.top):
+        address = address_dict.decode_column(addresses, [address_id])[0]
+        print(f"  {address}: {per_sender[address_id]:,} recipients")
+
+    labels = clusters(graph)
+    active = np.flatnonzero(per_sender + per_recipient)
+    sizes = np.bincount(labels[active])
+    print(f"\n{np.count_nonzero(sizes):,} clusters of senders and recipients; largest: "
+          f"{', '.join(str(size) for size in np.sort(sizes)[::-1][:args.top])} addresses")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Address Index
+
+Inverted index from address ids to the batches they appear in, as delta and varint coded postings.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import address_dict
+import batch_cache
+
+INDEX_DIR = "address_index"
+PARTITION_SIZE = 1000
+# Logs are folded into the postings once they reach this share of their size; lookups read both meanwhile
+COMPACT_RATIO = 0.25
+
+# Cached sections that feed the index: section -> (role, address field)
+INDEXED_SECTIONS = {
+    'affected_addresses': ('from', 'from_address'),
+    'to_addresses': ('to', 'to_address'),
+}
+
+def encode_varints(values):
+    """Encode non-negative integers as LEB128 varints"""
+    out = bytearray()
+    for value in values:
+        value = int(value)
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+def decode_varints(data, pos=0, count=None):
+    """Decode varints from data starting at pos; returns the values and the end position"""
+    values = []
+    end = len(data)
+    while pos < end and (count is None or len(values) < count):
+        value = 0
+        shift = 0
+        while True:
+            if pos >= end:
+                raise ValueError("truncated varint")
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(value)
+    if count is not None and len(values) < count:
+        raise ValueError("truncated varint sequence")
+    return values, pos
+
+def encode_postings(postings):
+    """Encode sorted (partition, count) pairs with partition deltas"""
+    values = []
+    previous = 0
+    for partition, count in postings:
+        values.extend((partition - previous, count))
+        previous = partition
+    return encode_varints(values)
+
+def decode_postings(data):
+    """Decode (partition, count) pairs written by encode_postings"""
+    values, _ = decode_varints(data)
+    postings = []
+    partition = 0
+    for i in range(0, len(values), 2):
+        partition += values[i]
+        postings.append((partition, values[i + 1]))
+    return postings
+
+def index_paths(cache_dir, role):
+    """Paths of the compacted index and the append log of one role"""
+    index_dir = os.path.join(cache_dir, INDEX_DIR)
+    return os.path.join(index_dir, f"{role}.index"), os.path.join(index_dir, f"{role}.log")
+
+def index_section(cache_dir, section, start_block, end_block, records, shared=None):
+    """Append the address counts of a freshly written batch section to the index log
+
+    shared holds the records of the blocks the batch shares with an overlapping one before it, which are
+    taken out so those blocks are counted once.
+    """
+    if section not in INDEXED_SECTIONS or not records:
+        return
+    role, address_field = INDEXED_SECTIONS[section]
+    addresses = address_dict.open_dictionary(cache_dir)
+
+    counts = {}
+    for record in records:
+        address_id = address_dict.encode(addresses, record[address_field])
+        counts[address_id] = counts.get(address_id, 0) + int(record['transaction_count'])
+    for record in shared or []:
+        address_id = address_dict.encode(addresses, record[address_field])
+        counts[address_id] = counts.get(address_id, 0) - int(record['transaction_count'])
+    counts = {address_id: count for address_id, count in counts.items() if count > 0}
+    address_dict.flush_dictionary(addresses)
+    append_batch(cache_dir, role, start_block, end_block, counts)
+
+def append_batch(cache_dir, role, start_block, end_block, counts):
+    """Append one batch record: partitions, entry count, then delta coded (id, count) pairs"""
+    _, log_path = index_paths(cache_dir, role)
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    values = [start_block // PARTITION_SIZE, end_block // PARTITION_SIZE, len(counts)]
+    previous = 0
+    for address_id in sorted(counts):
+        values.extend((address_id - previous, counts[address_id]))
+        previous = address_id
+
+    with open(log_path, 'ab') as f:
+        f.write(encode_varints(values))
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_log(log_path):
+    """Batch records of an append log; a torn final record is ignored"""
+    if not os.path.exists(log_path):
+        return {}
+    with open(log_path, 'rb') as f:
+        data = f.read()
+
+    batches = {}
+    pos = 0
+    while pos < len(data):
+        try:
+            (start_partition, _, entries), pos = decode_varints(data, pos, 3)
+            values, pos = decode_varints(data, pos, entries * 2)
+        except ValueError:
+            break
+        counts = {}
+        address_id = 0
+        for i in range(0, len(values), 2):
+            address_id += values[i]
+            counts[address_id] = values[i + 1]
+        # A rewritten batch replaces the earlier record for the same start
+        batches[start_partition] = counts
+    return batches
+
+def load_index(index_path):
+    """Memory-map the offsets of a compacted index; returns (offsets, postings start) or None"""
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'rb') as f:
+        id_count = int(np.frombuffer(f.read(8), dtype='<i8')[0])
+    offsets = np.memmap(index_path, dtype='<i8', mode='r', offset=8, shape=(id_count + 1,))
+    return offsets, 8 + 8 * (id_count + 1)
+
+def read_postings(index_path, address_id):
+    """Compacted postings of one address id"""
+    index = load_index(index_path)
+    if index is None:
+        return []
+    offsets, base = index
+    if address_id + 1 >= len(offsets):
+        return []
+    start, end = int(offsets[address_id]), int(offsets[address_id + 1])
+    if start == end:
+        return []
+    with open(index_path, 'rb') as f:
+        f.seek(base + start)
+        return decode_postings(f.read(end - start))
+
+def compact_index(cache_dir, force=False):
+    """Fold the append logs into the compacted postings files, once they have grown large enough unless forced
+
+    Rewriting the postings costs their full size, so deferring it until the log is a fixed share of them keeps
+    the amortized cost of each run proportional to the batches it added.
+    """
+    for role, _ in INDEXED_SECTIONS.values():
+        index_path, log_path = index_paths(cache_dir, role)
+        if (not force and os.path.exists(index_path) and os.path.exists(log_path)
+                and os.path.getsize(log_path) < COMPACT_RATIO * os.path.getsize(index_path)):
+            continue
+        batches = read_log(log_path)
+        if not batches:
+            continue
+
+        postings = {}
+        index = load_index(index_path)
+        if index is not None:
+            offsets, base = index
+            with open(index_path, 'rb') as f:
+                f.seek(base)
+                blob = f.read()
+            for address_id in range(len(offsets) - 1):
+                start, end = int(offsets[address_id]), int(offsets[address_id + 1])
+                kept = [p for p in decode_postings(blob[start:end]) if p[0] not in batches]
+                if kept:
+                    postings[address_id] = kept
+        for start_partition, counts in batches.items():
+            for address_id, count in counts.items():
+                postings.setdefault(address_id, []).append((start_partition, count))
+
+        id_count = max(postings) + 1 if postings else 0
+        offsets = np.zeros(id_count + 1, dtype='<i8')
+        chunks = []
+        size = 0
+        for address_id in range(id_count):
+            chunk = encode_postings(sorted(postings.get(address_id, [])))
+            chunks.append(chunk)
+            size += len(chunk)
+            offsets[address_id + 1] = size
+
+        header = np.array([id_count], dtype='<i8').tobytes()
+        batch_cache.atomic_write_bytes(index_path, header + offsets.tobytes() + b''.join(chunks))
+        os.remove(log_path)
+        print(f"Address index ({role}): {len(batches)} batches compacted, {len(postings):,} addresses")
+
+def address_history(cache_dir, address):
+    """Batches an address appeared in, per role, as (start_block, transaction_count) lists"""
+    addresses = address_dict.open_dictionary(cache_dir)
+    key = bytes.fromhex(address.lower()[2:] if address.startswith('0x') else address.lower())
+    address_id = addresses['ids'].get(key)
+
+    history = {}
+    for role, _ in INDEXED_SECTIONS.values():
+        if address_id is None:
+            history[role] = []
+            continue
+        index_path, log_path = index_paths(cache_dir, role)
+        merged = dict(read_postings(index_path, address_id))
+        for start_partition, counts in read_log(log_path).items():
+            merged.pop(start_partition, None)
+            if address_id in counts:
+                merged[start_partition] = counts[address_id]
+        history[role] = [(partition * PARTITION_SIZE, count) for partition, count in sorted(merged.items())]
+    return history
+
+def index_batch(cache_dir, ranges, batch_range, shared_range=None):
+    """Index the cached sections of one batch, less the blocks of shared_range it shares with the batch before"""
+    cached_sections = {section: info for section, info in ranges[batch_range].items() if section in INDEXED_SECTIONS}
+    batch_data = batch_cache.load_batch(cache_dir, *batch_range, cached_sections)
+    shared_data = batch_cache.load_batch(cache_dir, *shared_range, ranges[shared_range]) if shared_range else {}
+    for section in cached_sections:
+        index_section(cache_dir, section, *batch_range, batch_data.get(section), shared_data.get(section))
+
+def index_overlaps(cache_dir, shared_ranges):
+    """Index again the batches whose blocks shared with the batch before them were just cached on their own"""
+    ranges = batch_cache.range_index(batch_cache.load_manifest(cache_dir))
+    starts = {batch_range[0]: batch_range for batch_range in batch_cache.select_ranges(ranges)}
+    for shared_range in shared_ranges:
+        if shared_range in ranges and shared_range[0] in starts:
+            index_batch(cache_dir, ranges, starts[shared_range[0]], shared_range)
+
+def rebuild_index(cache_dir):
+    """Rebuild the index from every cached batch"""
+    for role, _ in INDEXED_SECTIONS.values():
+        for path in index_paths(cache_dir, role):
+            if os.path.exists(path):
+                os.remove(path)
+
+    ranges = batch_cache.range_index(batch_cache.validate_cache(cache_dir))
+    selected = batch_cache.select_ranges(ranges)
+    overlaps = {shared_range[0]: shared_range for shared_range in batch_cache.cached_overlaps(ranges, selected)}
+    for batch_range in selected:
+        index_batch(cache_dir, ranges, batch_range, overlaps.get(batch_range[0]))
+    compact_index(cache_dir, force=True)
+
+def main():
+    """Print per-batch histories of addresses, or rebuild the index"""
+    parser = argparse.ArgumentParser(description='Look up in which batches addresses were affected')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('addresses', nargs='*', help='0x-prefixed addresses to look up')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the cached batches first')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_index(args.cache_dir)
+    for address in args.addresses:
+        history = address_history(args.cache_dir, address)
+        for role, postings in history.items():
+            total = sum(count for _, count in postings)
+            print(f"{address} ({role}): {total:,} transactions in {len(postings)} batches")
+            for start_block, count in postings:
+                print(f"  block {start_block:,}: {count:,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Address Tables
+
+Fixed-width per-address result tables, sorted by address and memory-mapped on read.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+ADDRESS_BYTES = 20
+
+# Column layouts of the affected from-address and to-address tables
+ADDRESS_DTYPE = np.dtype([
+    ('address', f'S{ADDRESS_BYTES}'),
+    ('transaction_count', '<i8'),
+    ('avg_gas_limit', '<f8'),
+    ('max_gas_limit', '<f8'),
+    ('total_excess_gas', '<f8'),
+    ('additional_gas_cost', '<f8'),
+    ('total_additional_gas_cost', '<f8'),
+    ('additional_cost_eth', '<f8'),
+    ('total_additional_cost_eth', '<f8'),
+    ('splits_required', '<f8'),
+    ('total_splits_required', '<f8'),
+])
+
+TO_ADDRESS_DTYPE = np.dtype([
+    ('address', f'S{ADDRESS_BYTES}'),
+    ('transaction_count', '<i8'),
+    ('avg_gas_limit', '<f8'),
+    ('max_gas_limit', '<f8'),
+])
+
+def address_key(address):
+    """Encode a 0x-prefixed hex address as its 20 raw bytes"""
+    return bytes.fromhex(address[2:] if address.startswith('0x') else address)
+
+def address_hex(key):
+    """Decode 20 raw address bytes to a 0x-prefixed hex string"""
+    # numpy drops trailing zero bytes from fixed-width byte strings
+    return '0x' + bytes(key).ljust(ADDRESS_BYTES, b'\0').hex()
+
+def build_table(rows, dtype, address_field='address'):
+    """Pack result dictionaries into a structured array sorted by address"""
+    table = np.zeros(len(rows), dtype=dtype)
+    table['address'] = [address_key(row[address_field]) for row in rows]
+    for name in dtype.names[1:]:
+        table[name] = [row[name] for row in rows]
+    table.sort(order='address', kind='stable')
+    return table
+
+def write_table(path, table):
+    """Atomically write a structured array as a .npy file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, table)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+def write_address_tables(data_dir, results, timestamp):
+    """Write the from-address and to-address tables of an analysis run"""
+    paths = []
+    if results.get('all_addresses'):
+        table = build_table(results['all_addresses'], ADDRESS_DTYPE)
+        paths.append(write_table(os.path.join(data_dir, f"gas_cap_6month_all_addresses_{timestamp}.npy"), table))
+    if results.get('all_to_addresses'):
+        table = build_table(results['all_to_addresses'], TO_ADDRESS_DTYPE, address_field='to_address')
+        paths.append(write_table(os.path.join(data_dir, f"gas_cap_6month_to_addresses_{timestamp}.npy"), table))
+    return paths
+
+def open_table(path):
+    """Memory-map an address table read-only"""
+    return np.load(path, mmap_mode='r')
+
+def lookup(table, address):
+    """Return the row of an address, or None if it is not in the table"""
+    key = address_key(address.lower())
+    idx = np.searchsorted(table['address'], key)
+    if idx < len(table) and table['address'][idx] == key.rstrip(b'\0'):
+        return table[idx]
+    return None
+
+def to_dataframe(table, address_column='address'):
+    """Decode an address table into a DataFrame with hex addresses"""
+    df = pd.DataFrame({name: table[name] for name in table.dtype.names[1:]})
+    df.insert(0, address_column, [address_hex(key) for key in table['address']])
+    return df.sort_values('transaction_count', ascending=False, kind='stable').reset_index(drop=True)
+
+def main():
+    """Look up addresses in an address table"""
+    parser = argparse.ArgumentParser(description='Look up addresses in a memory-mapped address table')
+    parser.add_argument('table', help='Address table (.npy) written by the 6-month analysis')
+    parser.add_argument('addresses', nargs='+', help='0x-prefixed addresses to look up')
+    args = parser.parse_args()
+
+    table = open_table(args.table)
+    print(f"{args.table}: {len(table):,} addresses")
+    for address in args.addresses:
+        row = lookup(table, address)
+        if row is None:
+            print(f"{address}: not found")
+            continue
+        fields = ", ".join(f"{name}={row[name]:,}" for name in table.dtype.names[1:])
+        print(f"{address}: {fields}")
+
+if __name__ == "__main__":
+    main()
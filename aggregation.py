@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Batch Aggregation State
+
+Mergeable running aggregates over gas cap batch results, held in numpy structured arrays. Sums can be
+retracted when batches leave a window; maxima and minima are kept in windowed candidate tables.
+"""
+
+import numpy as np
+
+import address_dict
+
+KEY_FIELD = 'address'
+# Hex keys are used where no address dictionary applies, such as aggregates read from the store
+HEX_KEY_DTYPE = 'U42'
+
+# Per-address accumulators: field -> dtype; every field is summed unless listed in MAX_FIELDS
+ADDRESS_FIELDS = [
+    ('transaction_count', np.int64),
+    ('total_gas_limit', np.float64),
+    ('max_gas_limit', np.float64),
+    ('total_excess_gas', np.float64),
+    ('total_gas_price', np.float64),
+    ('batches_appeared', np.int64),
+]
+TO_ADDRESS_FIELDS = [
+    ('transaction_count', np.int64),
+    ('total_gas_limit', np.float64),
+    ('max_gas_limit', np.float64),
+]
+EFFICIENCY_DTYPE = np.dtype([
+    ('total_overprovision', np.int64),
+    ('unnecessary_high_limit', np.int64),
+    ('sum_gas_limit', np.float64),
+    ('sum_gas_used', np.float64),
+    ('count', np.int64),
+    ('min_gas_used', np.int64),
+    ('max_gas_used', np.int64),
+])
+MAX_FIELDS = {'max_gas_limit', 'max_gas_used'}
+MIN_FIELDS = {'min_gas_used'}
+# min_gas_used of a state without efficiency data
+NO_MIN_GAS = np.iinfo(np.int64).max
+
+# Windowed maxima: per key, the batches no later batch matches or beats, so the oldest left is the maximum
+MAXIMA_TABLES = {
+    'address_aggregates': 'address_maxima',
+    'to_address_aggregates': 'to_address_maxima',
+}
+# Per-batch gas used extremes, for recomputing the window minimum and maximum after a retraction
+EXTREMA_DTYPE = np.dtype([
+    ('batch_start', np.int64),
+    ('min_gas_used', np.int64),
+    ('max_gas_used', np.int64),
+])
+# Gas limits stay below 2**32, so key groups can be offset by multiples of it
+GAS_SPAN = 1 << 32
+
+SCALAR_KEYS = ('batch_count', 'total_transactions', 'total_affected', 'total_high_gas')
+AGGREGATE_FIELDS = {
+    'address_aggregates': ADDRESS_FIELDS,
+    'to_address_aggregates': TO_ADDRESS_FIELDS,
+}
+
+# Per-row inputs of the address folds: field -> dtype
+AFFECTED_INPUTS = {
+    'transaction_count': np.int64,
+    'avg_gas_limit': np.float64,
+    'max_gas_limit': np.float64,
+    'total_excess_gas': np.float64,
+    'avg_gas_price': np.float64,
+}
+TO_ADDRESS_INPUTS = {
+    'transaction_count': np.int64,
+    'avg_gas_limit': np.float64,
+    'max_gas_limit': np.float64,
+}
+
+def aggregate_dtype(fields, key_dtype=np.int64):
+    """Structured dtype of per-address aggregates: the address key, then the accumulators"""
+    return np.dtype([(KEY_FIELD, key_dtype)] + fields)
+
+def empty_aggregates(fields, key_dtype=np.int64):
+    """Per-address aggregates without any address"""
+    return np.zeros(0, dtype=aggregate_dtype(fields, key_dtype))
+
+def maxima_dtype(key_dtype=np.int64):
+    """Structured dtype of a windowed maxima table"""
+    return np.dtype([(KEY_FIELD, key_dtype), ('batch_start', np.int64), ('max_gas_limit', np.float64)])
+
+def empty_efficiency():
+    """Gas efficiency accumulators without any batch"""
+    stats = np.zeros((), dtype=EFFICIENCY_DTYPE)
+    stats['min_gas_used'] = NO_MIN_GAS
+    return stats
+
+def new_aggregate_state():
+    """Create an empty aggregate state"""
+    state = {key: 0 for key in SCALAR_KEYS}
+    for name, fields in AGGREGATE_FIELDS.items():
+        state[name] = empty_aggregates(fields)
+        state[MAXIMA_TABLES[name]] = np.zeros(0, dtype=maxima_dtype())
+    state['gas_efficiency_stats'] = empty_efficiency()
+    state['efficiency_extrema'] = np.zeros(0, dtype=EXTREMA_DTYPE)
+    return state
+
+def reduce_aggregates(rows):
+    """Combine rows with equal keys (maxima for max fields, sums otherwise); the result is sorted by key"""
+    keys, inverse = np.unique(rows[KEY_FIELD], return_inverse=True)
+    if len(keys) == len(rows):
+        return rows[np.argsort(rows[KEY_FIELD], kind='stable')]
+
+    reduced = np.zeros(len(keys), dtype=rows.dtype)
+    reduced[KEY_FIELD] = keys
+    for field in rows.dtype.names[1:]:
+        if field in MAX_FIELDS:
+            np.maximum.at(reduced[field], inverse, rows[field])
+        else:
+            reduced[field] = np.bincount(inverse, weights=rows[field], minlength=len(keys))
+    return reduced
+
+def merge_aggregates(aggregates, other):
+    """Merge two per-address aggregate arrays; associative and commutative"""
+    if not len(other):
+        return aggregates
+    if not len(aggregates):
+        return other
+    return reduce_aggregates(np.concatenate((aggregates, other)))
+
+def prune_maxima(maxima):
+    """Keep only the rows no later batch of the same key matches or beats: a monotonic deque per key
+
+    The result is sorted by key, then batch start, with strictly decreasing maxima within each key.
+    """
+    if len(maxima) < 2:
+        return maxima
+    rows = maxima[np.lexsort((maxima['batch_start'], maxima[KEY_FIELD]))]
+    first = np.r_[True, rows[KEY_FIELD][1:] != rows[KEY_FIELD][:-1]]
+    group = np.cumsum(first)
+    # Later groups get smaller offsets, so the reversed running maximum never carries into an earlier group
+    keyed = (group[-1] - group) * GAS_SPAN + rows['max_gas_limit'].astype(np.int64)
+    running = np.maximum.accumulate(keyed[::-1])[::-1]
+    later = np.full(len(rows), -1, dtype=np.int64)
+    later[:-1] = np.where(first[1:], -1, running[1:])
+    return rows[keyed > later]
+
+def merge_maxima(maxima, other):
+    """Merge two windowed maxima tables; associative and commutative"""
+    if not len(other):
+        return maxima
+    if not len(maxima):
+        return other
+    return prune_maxima(np.concatenate((maxima, other)))
+
+def window_maxima(maxima, keys):
+    """Maximum of each key over the batches left in a maxima table; keys must all be present"""
+    table_keys, inverse = np.unique(maxima[KEY_FIELD], return_inverse=True)
+    peaks = np.zeros(len(table_keys), dtype=np.float64)
+    np.maximum.at(peaks, inverse, maxima['max_gas_limit'])
+    return peaks[np.searchsorted(table_keys, keys)]
+
+def merge_efficiency(stats, other):
+    """Merge two gas efficiency accumulators; associative and commutative"""
+    merged = np.zeros((), dtype=EFFICIENCY_DTYPE)
+    for field in EFFICIENCY_DTYPE.names:
+        if field in MAX_FIELDS:
+            merged[field] = max(stats[field], other[field])
+        elif field in MIN_FIELDS:
+            merged[field] = min(stats[field], other[field])
+        else:
+            merged[field] = stats[field] + other[field]
+    return merged
+
+def merge_states(state, other):
+    """Merge another aggregate state into state; other is left unchanged"""
+    for key in SCALAR_KEYS:
+        state[key] += other[key]
+    for name in AGGREGATE_FIELDS:
+        state[name] = merge_aggregates(state[name], other[name])
+        table = MAXIMA_TABLES[name]
+        state[table] = merge_maxima(state[table], other[table])
+    state['gas_efficiency_stats'] = merge_efficiency(state['gas_efficiency_stats'], other['gas_efficiency_stats'])
+    state['efficiency_extrema'] = np.concatenate((state['efficiency_extrema'], other['efficiency_extrema']))
+    return state
+
+def subtract_aggregates(aggregates, retracted, maxima):
+    """Retract per-address sums; keys without transactions left are dropped and maxima are recomputed
+
+    A key whose only rows left maxima with a superseded batch gets a maximum of 0 until the superseding
+    batch is merged back in.
+    """
+    negated = retracted.copy()
+    for field in negated.dtype.names[1:]:
+        negated[field] = 0 if field in MAX_FIELDS else -negated[field]
+    rows = reduce_aggregates(np.concatenate((aggregates, negated)))
+    rows = rows[rows['transaction_count'] > 0]
+    present = np.isin(rows[KEY_FIELD], maxima[KEY_FIELD])
+    peaks = np.zeros(len(rows), dtype=np.float64)
+    peaks[present] = window_maxima(maxima, rows[KEY_FIELD][present])
+    rows['max_gas_limit'] = peaks
+    return rows
+
+def supersedes(newer, older):
+    """Whether every address of older is in newer with at least its transaction count and maximum
+
+    Holds when newer was folded from longer ranges with the same start blocks as older, so retracting older
+    and merging newer keeps the maxima tables exact.
+    """
+    for name in AGGREGATE_FIELDS:
+        old_rows, new_rows = older[name], newer[name]
+        if not len(old_rows):
+            continue
+        idx = np.searchsorted(new_rows[KEY_FIELD], old_rows[KEY_FIELD])
+        found = idx < len(new_rows)
+        if not found.all():
+            return False
+        matched = new_rows[idx]
+        if not (np.array_equal(matched[KEY_FIELD], old_rows[KEY_FIELD])
+                and np.all(matched['transaction_count'] >= old_rows['transaction_count'])
+                and np.all(matched['max_gas_limit'] >= old_rows['max_gas_limit'])):
+            return False
+    return True
+
+def retract_states(state, retracted, expired_starts):
+    """Remove batches that left the window from state
+
+    retracted is the folded state of exactly those batches, whose start blocks are expired_starts. Sums are
+    subtracted; maxima and minima are recomputed from the windowed tables, which stay exact as long as
+    batches expire oldest first or are replaced by a longer range with the same start that supersedes them
+    (see supersedes), merged in right after.
+    """
+    for key in SCALAR_KEYS:
+        state[key] -= retracted[key]
+    for name in AGGREGATE_FIELDS:
+        table = MAXIMA_TABLES[name]
+        maxima = state[table]
+        state[table] = maxima = maxima[~np.isin(maxima['batch_start'], expired_starts)]
+        state[name] = subtract_aggregates(state[name], retracted[name], maxima)
+
+    extrema = state['efficiency_extrema']
+    state['efficiency_extrema'] = extrema = extrema[~np.isin(extrema['batch_start'], expired_starts)]
+    stats = state['gas_efficiency_stats'].copy()
+    other = retracted['gas_efficiency_stats']
+    for field in EFFICIENCY_DTYPE.names:
+        if field not in MAX_FIELDS and field not in MIN_FIELDS:
+            stats[field] -= other[field]
+    stats['min_gas_used'] = extrema['min_gas_used'].min() if len(extrema) else NO_MIN_GAS
+    stats['max_gas_used'] = extrema['max_gas_used'].max() if len(extrema) else 0
+    state['gas_efficiency_stats'] = stats
+    return state
+
+def subtract_overlap(state, shared):
+    """Take blocks two overlapping batches of state both counted out of it once
+
+    shared is the folded state of exactly those blocks. Sums are subtracted; batch counts, maxima and minima
+    stay as they are, since the blocks still belong to the window.
+    """
+    for key in SCALAR_KEYS:
+        if key != 'batch_count':
+            state[key] -= shared[key]
+    for name in AGGREGATE_FIELDS:
+        negated = shared[name].copy()
+        for field in negated.dtype.names[1:]:
+            negated[field] = 0 if field in MAX_FIELDS or field == 'batches_appeared' else -negated[field]
+        rows = reduce_aggregates(np.concatenate((state[name], negated)))
+        state[name] = rows[rows['transaction_count'] > 0]
+
+    stats = state['gas_efficiency_stats'].copy()
+    other = shared['gas_efficiency_stats']
+    for field in EFFICIENCY_DTYPE.names:
+        if field not in MAX_FIELDS and field not in MIN_FIELDS:
+            stats[field] -= other[field]
+    state['gas_efficiency_stats'] = stats
+    return state
+
+def section_columns(batches, section, key_field, inputs, addresses=None):
+    """Concatenate one section of several batches into a key array and a typed array per field"""
+    records = [record for batch_data in batches for record in batch_data.get(section) or []]
+    keys = [record[key_field] for record in records]
+    if addresses is not None:
+        keys = address_dict.encode_column(addresses, keys)
+    else:
+        keys = np.array(keys, dtype=HEX_KEY_DTYPE)
+    columns = {field: np.array([record[field] for record in records], dtype=dtype) for field, dtype in inputs.items()}
+    columns['batch_start'] = np.repeat(np.array([batch_data['start_block'] for batch_data in batches], dtype=np.int64),
+                                       [len(batch_data.get(section) or []) for batch_data in batches])
+    return keys, columns
+
+def batch_maxima(keys, inputs):
+    """Windowed maxima table of freshly folded rows"""
+    maxima = np.zeros(len(keys), dtype=maxima_dtype(keys.dtype))
+    maxima[KEY_FIELD] = keys
+    maxima['batch_start'] = inputs['batch_start']
+    maxima['max_gas_limit'] = inputs['max_gas_limit']
+    return prune_maxima(maxima)
+
+def batch_efficiency(eff):
+    """Gas efficiency accumulators of one batch"""
+    stats = empty_efficiency()
+    if eff and eff.get('total_overprovision', 0) > 0:
+        stats['total_overprovision'] = eff.get('total_overprovision', 0)
+        stats['unnecessary_high_limit'] = eff.get('unnecessary_high_limit', 0)
+        stats['sum_gas_limit'] = eff.get('avg_gas_limit', 0) * eff.get('total_overprovision', 0)
+        stats['sum_gas_used'] = eff.get('avg_gas_used', 0) * eff.get('total_overprovision', 0)
+        stats['count'] = eff.get('total_overprovision', 0)
+        stats['min_gas_used'] = eff.get('min_gas_used', NO_MIN_GAS)
+        stats['max_gas_used'] = eff.get('max_gas_used', 0)
+    return stats
+
+def fold_batches(state, batches, addresses=None):
+    """Add batches to an aggregate state with one grouped reduction per measure
+
+    Addresses are keyed by dictionary id when a dictionary is given, else by hex string.
+    """
+    batches = list(batches)
+    state['batch_count'] += len(batches)
+
+    # Aggregate summaries
+    for batch_data in batches:
+        if batch_data.get('summary'):
+            state['total_transactions'] += batch_data['summary'].get('total_transactions', 0)
+            state['total_affected'] += batch_data['summary'].get('affected_transactions', 0)
+            state['total_high_gas'] += batch_data['summary'].get('high_gas_transactions', 0)
+
+    # Aggregate addresses
+    keys, inputs = section_columns(batches, 'affected_addresses', 'from_address', AFFECTED_INPUTS, addresses)
+    rows = np.zeros(len(keys), dtype=aggregate_dtype(ADDRESS_FIELDS, keys.dtype if addresses is None else np.int64))
+    rows[KEY_FIELD] = keys
+    rows['transaction_count'] = inputs['transaction_count']
+    rows['total_gas_limit'] = inputs['avg_gas_limit'] * inputs['transaction_count']
+    rows['max_gas_limit'] = inputs['max_gas_limit']
+    rows['total_excess_gas'] = inputs['total_excess_gas']
+    rows['total_gas_price'] = inputs['avg_gas_price'] * inputs['transaction_count']
+    rows['batches_appeared'] = 1
+    state['address_aggregates'] = merge_aggregates(state['address_aggregates'], reduce_aggregates(rows))
+    state['address_maxima'] = merge_maxima(state['address_maxima'], batch_maxima(keys, inputs))
+
+    # Aggregate to_addresses
+    keys, inputs = section_columns(batches, 'to_addresses', 'to_address', TO_ADDRESS_INPUTS, addresses)
+    rows = np.zeros(len(keys), dtype=aggregate_dtype(TO_ADDRESS_FIELDS, keys.dtype if addresses is None else np.int64))
+    rows[KEY_FIELD] = keys
+    rows['transaction_count'] = inputs['transaction_count']
+    rows['total_gas_limit'] = inputs['avg_gas_limit'] * inputs['transaction_count']
+    rows['max_gas_limit'] = inputs['max_gas_limit']
+    state['to_address_aggregates'] = merge_aggregates(state['to_address_aggregates'], reduce_aggregates(rows))
+    state['to_address_maxima'] = merge_maxima(state['to_address_maxima'], batch_maxima(keys, inputs))
+
+    # Aggregate gas efficiency
+    extrema = []
+    for batch_data in batches:
+        stats = batch_efficiency(batch_data.get('gas_efficiency'))
+        state['gas_efficiency_stats'] = merge_efficiency(state['gas_efficiency_stats'], stats)
+        if stats['count']:
+            extrema.append((batch_data['start_block'], stats['min_gas_used'], stats['max_gas_used']))
+    state['efficiency_extrema'] = np.concatenate((state['efficiency_extrema'], np.array(extrema, dtype=EXTREMA_DTYPE)))
+
+    return state
+
+def fold_batch(state, batch_data, addresses=None):
+    """Add one batch to an aggregate state, keyed by address id when a dictionary is given"""
+    return fold_batches(state, [batch_data], addresses)
+
+def aggregates_from_mapping(mapping, fields):
+    """Per-address aggregates from a {hex address: {field: value}} mapping"""
+    aggregates = np.zeros(len(mapping), dtype=aggregate_dtype(fields, HEX_KEY_DTYPE))
+    aggregates[KEY_FIELD] = list(mapping)
+    for field, _ in fields:
+        aggregates[field] = [agg[field] for agg in mapping.values()]
+    return reduce_aggregates(aggregates)
+
+def efficiency_from_mapping(mapping):
+    """Gas efficiency accumulators from a {field: value} mapping"""
+    stats = empty_efficiency()
+    for field in EFFICIENCY_DTYPE.names:
+        value = mapping[field]
+        stats[field] = NO_MIN_GAS if field in MIN_FIELDS and value == float('inf') else value
+    return stats
+
+def efficiency_values(stats):
+    """Gas efficiency accumulators as a dictionary of Python numbers"""
+    return dict(zip(EFFICIENCY_DTYPE.names, stats.item()))
+
+def dump_columns(array):
+    """JSON-ready form of a structured array: one list per field"""
+    return {field: array[field].tolist() for field in array.dtype.names}
+
+def load_columns(columns, dtype_for_keys):
+    """Restore a structured array written by dump_columns; dtype_for_keys maps the key dtype to the array dtype"""
+    keys = columns.get(KEY_FIELD)
+    key_dtype = HEX_KEY_DTYPE if keys and isinstance(keys[0], str) else np.int64
+    dtype = dtype_for_keys(key_dtype)
+    array = np.zeros(len(columns[dtype.names[0]]), dtype=dtype)
+    for field in dtype.names:
+        array[field] = columns[field]
+    return array
+
+def dump_state(state):
+    """JSON-ready form of a state: one list per array field"""
+    dumped = {key: state[key] for key in SCALAR_KEYS}
+    for name, table in MAXIMA_TABLES.items():
+        dumped[name] = dump_columns(state[name])
+        dumped[table] = dump_columns(state[table])
+    dumped['gas_efficiency_stats'] = efficiency_values(state['gas_efficiency_stats'])
+    dumped['efficiency_extrema'] = dump_columns(state['efficiency_extrema'])
+    return dumped
+
+def load_state(dumped):
+    """Restore a state written by dump_state"""
+    state = {key: dumped[key] for key in SCALAR_KEYS}
+    for name, fields in AGGREGATE_FIELDS.items():
+        state[name] = load_columns(dumped[name], lambda key_dtype: aggregate_dtype(fields, key_dtype))
+        state[MAXIMA_TABLES[name]] = load_columns(dumped[MAXIMA_TABLES[name]], maxima_dtype)
+    state['gas_efficiency_stats'] = efficiency_from_mapping(dumped['gas_efficiency_stats'])
+    state['efficiency_extrema'] = load_columns(dumped['efficiency_extrema'], lambda key_dtype: EXTREMA_DTYPE)
+    return state
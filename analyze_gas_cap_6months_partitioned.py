@@ -12,19 +12,46 @@ from datetime import datetime, timedelta
 import json
 import os
 import gc
+import threading
 from typing import Dict, List, Tuple
 import matplotlib.pyplot as plt
 import seaborn as sns
 import argparse
+import activity_bitmaps
+import address_dict
+import address_graph
+import address_index
+import aggregation
+import address_table
+import blob_store
+import cache_store
+import batch_cache
+import bloom_filters
+import heavy_hitters
+import compression
+import daily_series
+import distinct_counts
+import prefix_sums
+import quantile_sketches
+import rollups
 
 # Configuration
 PROPOSED_GAS_CAP = 16_777_216  # 2^24
+BASE_GAS_COST = 21000  # Intrinsic cost of each extra transaction a split needs
 BLOCKS_PER_DAY = 7200
 DAYS_TO_ANALYZE = 180
 PARTITION_SIZE = 1000
 BATCH_SIZE_PARTITIONS = 10
 DEFAULT_OUTPUT_DIR = "outputs"
 
+def split_gas_cost(avg_gas_limit):
+    """Extra gas per transaction of an address whose transactions average avg_gas_limit, split to fit the cap
+
+    The one cost model of the analysis: the report applies it per address over the window, the daily
+    series per address and day within each batch (see query_daily_summary).
+    """
+    return (np.ceil(avg_gas_limit / PROPOSED_GAS_CAP) - 1) * BASE_GAS_COST
+
 def initialize_xatu():
     """Initialize the PyXatu client"""
     return pyxatu.PyXatu()
@@ -53,43 +80,60 @@ def get_latest_block(xatu):
     
     return 22678052
 
-def process_partition_batch(xatu, start_block, end_block, batch_id, cache_dir):
-    """Process a batch of partitions"""
+def partition_range(start_block, end_block):
+    """Align a block range to partition boundaries"""
     start_partition = (start_block // PARTITION_SIZE) * PARTITION_SIZE
     end_partition = ((end_block - 1) // PARTITION_SIZE + 1) * PARTITION_SIZE
-    
-    print(f"\nProcessing batch {batch_id}: blocks {start_partition:,} to {end_partition:,}")
-    
-    summary_query = f"""
+    return start_partition, end_partition
+
+def query_block_totals(xatu, start_partition, end_partition):
+    """Query transaction totals per partition, day and affected sender in one scan of the batch
+
+    Transactions under the cap fall into one group per partition and day. The summary, partition summary
+    and daily summary sections are all summed from these rows.
+    """
+    totals_query = f"""
     SELECT 
+        intDiv(block_number, {PARTITION_SIZE}) as partition,
+        intDiv(block_number, {daily_series.BLOCKS_PER_DAY}) as day,
+        if(gas_limit > {PROPOSED_GAS_CAP}, from_address, '') as sender,
         COUNT(*) as total_transactions,
-        SUM(CASE WHEN gas_limit > {PROPOSED_GAS_CAP} THEN 1 ELSE 0 END) as affected_transactions,
-        SUM(CASE WHEN gas_limit > 1000000 THEN 1 ELSE 0 END) as high_gas_transactions
+        countIf(gas_limit > {PROPOSED_GAS_CAP}) as affected_transactions,
+        countIf(gas_limit > 1000000) as high_gas_transactions,
+        sumIf(gas_limit - {PROPOSED_GAS_CAP}, gas_limit > {PROPOSED_GAS_CAP}) as total_excess_gas,
+        sumIf(gas_limit, gas_limit > {PROPOSED_GAS_CAP}) as total_gas_limit
     FROM canonical_execution_transaction
     WHERE block_number >= {start_partition}
     AND block_number < {end_partition}
     AND meta_network_name = 'mainnet'
     AND gas_limit IS NOT NULL
+    GROUP BY partition, day, sender
     """
     
-    try:
-        summary_result = xatu.execute_query(
-            summary_query, 
-            columns="total_transactions,affected_transactions,high_gas_transactions"
-        )
-        
-        if summary_result is None or summary_result.empty:
-            print(f"  No data for batch {batch_id}")
-            return None
-            
-        summary_dict = summary_result.to_dict('records')[0]
-        print(f"  Transactions: {summary_dict['total_transactions']:,}")
-        print(f"  Affected: {summary_dict['affected_transactions']:,}")
-        
-    except Exception as e:
-        print(f"  Error getting summary: {e}")
+    totals_result = xatu.execute_query(
+        totals_query,
+        columns="partition,day,sender,total_transactions,affected_transactions,high_gas_transactions,"
+                "total_excess_gas,total_gas_limit"
+    )
+    
+    if totals_result is None:
+        return pd.DataFrame()
+    return totals_result
+
+def query_summary(xatu, start_partition, end_partition, totals=None):
+    """Transaction totals for a partition range, summed from its block totals (queried if not given)"""
+    totals = query_block_totals(xatu, start_partition, end_partition) if totals is None else totals
+    if totals.empty:
         return None
     
+    summary_dict = {field: int(totals[field].sum())
+                    for field in ('total_transactions', 'affected_transactions', 'high_gas_transactions')}
+    print(f"  Transactions: {summary_dict['total_transactions']:,}")
+    print(f"  Affected: {summary_dict['affected_transactions']:,}")
+    return summary_dict
+
+def query_affected_addresses(xatu, start_partition, end_partition):
+    """Query per-sender aggregates of affected transactions"""
     affected_query = f"""
     SELECT 
         from_address,
@@ -106,22 +150,20 @@ def process_partition_batch(xatu, start_block, end_block, batch_id, cache_dir):
     GROUP BY from_address
     """
     
-    try:
-        affected_result = xatu.execute_query(
-            affected_query,
-            columns="from_address,transaction_count,avg_gas_limit,max_gas_limit,total_excess_gas,avg_gas_price"
-        )
-        
-        if affected_result is not None and not affected_result.empty:
-            affected_addresses = affected_result.to_dict('records')
-            print(f"  Unique addresses affected: {len(affected_addresses)}")
-        else:
-            affected_addresses = []
-            
-    except Exception as e:
-        print(f"  Error getting affected addresses: {e}")
-        affected_addresses = []
+    affected_result = xatu.execute_query(
+        affected_query,
+        columns="from_address,transaction_count,avg_gas_limit,max_gas_limit,total_excess_gas,avg_gas_price"
+    )
     
+    if affected_result is not None and not affected_result.empty:
+        affected_addresses = affected_result.to_dict('records')
+        print(f"  Unique addresses affected: {len(affected_addresses)}")
+    else:
+        affected_addresses = []
+    return affected_addresses
+
+def query_to_addresses(xatu, start_partition, end_partition):
+    """Query per-recipient aggregates of affected transactions"""
     to_address_query = f"""
     SELECT 
         to_address,
@@ -137,24 +179,21 @@ def process_partition_batch(xatu, start_block, end_block, batch_id, cache_dir):
     GROUP BY to_address
     """
     
-    try:
-        to_address_result = xatu.execute_query(
-            to_address_query,
-            columns="to_address,transaction_count,avg_gas_limit,max_gas_limit"
-        )
-        
-        if to_address_result is not None and not to_address_result.empty:
-            to_addresses = to_address_result.to_dict('records')
-            print(f"  Unique to_addresses affected: {len(to_addresses)}")
-        else:
-            to_addresses = []
-            print(f"  No to_address data returned")
-            
-    except Exception as e:
-        print(f"  Error getting to_addresses: {e}")
-        print(f"  Query was: {to_address_query}")
-        to_addresses = []
+    to_address_result = xatu.execute_query(
+        to_address_query,
+        columns="to_address,transaction_count,avg_gas_limit,max_gas_limit"
+    )
     
+    if to_address_result is not None and not to_address_result.empty:
+        to_addresses = to_address_result.to_dict('records')
+        print(f"  Unique to_addresses affected: {len(to_addresses)}")
+    else:
+        to_addresses = []
+        print(f"  No to_address data returned")
+    return to_addresses
+
+def query_gas_efficiency(xatu, start_partition, end_partition):
+    """Query gas used versus gas limit of affected transactions"""
     gas_efficiency_query = f"""
     SELECT 
         COUNT(*) as total_overprovision,
@@ -173,167 +212,342 @@ def process_partition_batch(xatu, start_block, end_block, batch_id, cache_dir):
     AND gas_limit IS NOT NULL
     """
     
-    try:
-        gas_efficiency_result = xatu.execute_query(
-            gas_efficiency_query,
-            columns="total_overprovision,unnecessary_high_limit,avg_gas_limit,avg_gas_used,avg_gas_efficiency,min_gas_used,max_gas_used"
-        )
-        
-        if gas_efficiency_result is not None and not gas_efficiency_result.empty:
-            gas_efficiency = gas_efficiency_result.to_dict('records')[0]
-            if gas_efficiency['total_overprovision'] > 0:
-                print(f"  Gas efficiency: {gas_efficiency['avg_gas_efficiency']:.2%}")
-                print(f"  Unnecessarily high limits: {gas_efficiency['unnecessary_high_limit']:,} ({gas_efficiency['unnecessary_high_limit']/gas_efficiency['total_overprovision']*100:.1f}%)")
-        else:
-            gas_efficiency = {}
-            
-    except Exception as e:
-        print(f"  Error getting gas efficiency: {e}")
+    gas_efficiency_result = xatu.execute_query(
+        gas_efficiency_query,
+        columns="total_overprovision,unnecessary_high_limit,avg_gas_limit,avg_gas_used,avg_gas_efficiency,min_gas_used,max_gas_used"
+    )
+    
+    if gas_efficiency_result is not None and not gas_efficiency_result.empty:
+        gas_efficiency = gas_efficiency_result.to_dict('records')[0]
+        if gas_efficiency['total_overprovision'] > 0:
+            print(f"  Gas efficiency: {gas_efficiency['avg_gas_efficiency']:.2%}")
+            print(f"  Unnecessarily high limits: {gas_efficiency['unnecessary_high_limit']:,} ({gas_efficiency['unnecessary_high_limit']/gas_efficiency['total_overprovision']*100:.1f}%)")
+    else:
         gas_efficiency = {}
+    return gas_efficiency
+
+def query_partition_summary(xatu, start_partition, end_partition, totals=None):
+    """Transaction totals per 1000-block partition, summed from the block totals (queried if not given)"""
+    totals = query_block_totals(xatu, start_partition, end_partition) if totals is None else totals
+    if totals.empty:
+        return []
+    
+    fields = ['total_transactions', 'affected_transactions', 'high_gas_transactions', 'total_excess_gas']
+    partitions = totals.groupby('partition', as_index=False)[fields].sum().sort_values('partition')
+    return partitions.to_dict('records')
+
+def query_address_pairs(xatu, start_partition, end_partition):
+    """Query per sender-recipient pair aggregates of affected transactions"""
+    pair_query = f"""
+    SELECT 
+        from_address,
+        to_address,
+        COUNT(*) as transaction_count,
+        SUM(gas_limit - {PROPOSED_GAS_CAP}) as total_excess_gas
+    FROM canonical_execution_transaction
+    WHERE block_number >= {start_partition}
+    AND block_number < {end_partition}
+    AND meta_network_name = 'mainnet'
+    AND gas_limit > {PROPOSED_GAS_CAP}
+    AND to_address IS NOT NULL
+    GROUP BY from_address, to_address
+    """
+    
+    pair_result = xatu.execute_query(
+        pair_query,
+        columns="from_address,to_address,transaction_count,total_excess_gas"
+    )
+    
+    if pair_result is not None and not pair_result.empty:
+        return pair_result.to_dict('records')
+    return []
+
+def query_distinct_sketches(xatu, start_partition, end_partition):
+    """Query HyperLogLog register maxima of affected senders, affected recipients and high-gas senders
+
+    All three sketches come from one scan: each transaction is expanded into one row per sketch and the
+    rows outside a sketch's condition are dropped.
+    """
+    precision = distinct_counts.HLL_PRECISION
+    sketch_sources = [
+        ('affected_senders', 'from_address', f"gas_limit > {PROPOSED_GAS_CAP}"),
+        ('affected_recipients', 'to_address', f"gas_limit > {PROPOSED_GAS_CAP} AND to_address IS NOT NULL"),
+        ('high_gas_senders', 'from_address', "gas_limit > 1000000"),
+    ]
+    sources = ",\n            ".join(f"tuple('{name}', {column}, {condition})"
+                                       for name, column, condition in sketch_sources)
+    sketch_query = f"""
+    SELECT 
+        sketch,
+        bitAnd(h, {distinct_counts.REGISTERS - 1}) as register,
+        max(if(w = 0, {distinct_counts.HASH_BITS - precision + 1},
+               toUInt8(log2(bitAnd(w, bitNot(w) + 1))) + 1)) as rank
+    FROM (
+        SELECT source.1 as sketch, sipHash64(lower(source.2)) as h, bitShiftRight(h, {precision}) as w
+        FROM canonical_execution_transaction
+        ARRAY JOIN [
+            {sources}
+        ] as source
+        WHERE block_number >= {start_partition}
+        AND block_number < {end_partition}
+        AND meta_network_name = 'mainnet'
+        AND gas_limit > 1000000
+        AND source.3
+    )
+    GROUP BY sketch, register"""
+    
+    sketch_result = xatu.execute_query(sketch_query, columns="sketch,register,rank")
+    
+    if sketch_result is not None and not sketch_result.empty:
+        return sketch_result.to_dict('records')
+    return []
+
+def query_quantile_sketches(xatu, start_partition, end_partition):
+    """Query DDSketch log-bucket counts of gas limit, gas used, gas price and gas efficiency
+
+    All four measures come from one scan, expanded into one row per measure like the distinct sketches.
+    """
+    log_gamma = quantile_sketches.LOG_GAMMA
+    measure_sources = [
+        ('gas_limit', 'gas_limit', "gas_limit IS NOT NULL"),
+        ('gas_used', 'gas_used', "gas_used IS NOT NULL"),
+        ('gas_price', 'gas_price', "gas_price IS NOT NULL"),
+        ('gas_efficiency', 'gas_used / gas_limit', "gas_used IS NOT NULL AND gas_limit > 0"),
+    ]
+    sources = ",\n            ".join(f"tuple('{measure}', toFloat64({expression}), {condition})"
+                                       for measure, expression, condition in measure_sources)
+    sketch_query = f"""
+    SELECT 
+        measure,
+        if(value > 0, toInt32(ceil(log(value) / {log_gamma!r})), {quantile_sketches.ZERO_BUCKET}) as bucket,
+        COUNT(*) as count
+    FROM (
+        SELECT source.1 as measure, source.2 as value
+        FROM canonical_execution_transaction
+        ARRAY JOIN [
+            {sources}
+        ] as source
+        WHERE block_number >= {start_partition}
+        AND block_number < {end_partition}
+        AND meta_network_name = 'mainnet'
+        AND source.3
+    )
+    GROUP BY measure, bucket"""
+    
+    sketch_result = xatu.execute_query(sketch_query, columns="measure,bucket,count")
+    
+    if sketch_result is not None and not sketch_result.empty:
+        return sketch_result.to_dict('records')
+    return []
+
+def query_daily_summary(xatu, start_partition, end_partition, totals=None):
+    """Transaction totals and impact per day, summed from the block totals (queried if not given)
+
+    The additional gas cost follows the report's per-address model, applied per day and sender within the
+    batch: a sender's transactions on a day that two batches share are costed as two groups, one per batch.
+    """
+    totals = query_block_totals(xatu, start_partition, end_partition) if totals is None else totals
+    if totals.empty:
+        return []
+    
+    daily_result = totals.groupby(['day', 'sender'], as_index=False)[
+        ['total_transactions', 'affected_transactions', 'total_excess_gas', 'total_gas_limit']].sum()
+    affected = daily_result['affected_transactions'] > 0
+    daily_result['additional_gas_cost'] = 0
+    daily_result.loc[affected, 'additional_gas_cost'] = (
+        daily_result.loc[affected, 'affected_transactions'] * split_gas_cost(
+            daily_result.loc[affected, 'total_gas_limit'] / daily_result.loc[affected, 'affected_transactions'])
+    ).astype(np.int64)
+    daily = daily_result.groupby('day', as_index=False)[list(daily_series.FIELDS)].sum().sort_values('day')
+    return daily.to_dict('records')
+
+def query_daily_sketches(xatu, start_partition, end_partition):
+    """Query HyperLogLog register maxima of affected senders per day"""
+    precision = distinct_counts.HLL_PRECISION
+    sketch_query = f"""
+    SELECT 
+        day,
+        bitAnd(h, {distinct_counts.REGISTERS - 1}) as register,
+        max(if(w = 0, {distinct_counts.HASH_BITS - precision + 1},
+               toUInt8(log2(bitAnd(w, bitNot(w) + 1))) + 1)) as rank
+    FROM (
+        SELECT 
+            intDiv(block_number, {daily_series.BLOCKS_PER_DAY}) as day,
+            sipHash64(lower(from_address)) as h,
+            bitShiftRight(h, {precision}) as w
+        FROM canonical_execution_transaction
+        WHERE block_number >= {start_partition}
+        AND block_number < {end_partition}
+        AND meta_network_name = 'mainnet'
+        AND gas_limit > {PROPOSED_GAS_CAP}
+    )
+    GROUP BY day, register
+    """
+    
+    sketch_result = xatu.execute_query(sketch_query, columns="day,register,rank")
+    
+    if sketch_result is not None and not sketch_result.empty:
+        return sketch_result.to_dict('records')
+    return []
+
+# Each batch section is cached on its own; bump a version to refetch only that section.
+# The sections in BLOCK_TOTAL_SECTIONS are summed from one query_block_totals scan of all transactions of
+# the batch; quantile_sketches scans them all too, every other query only those above 1M gas or the cap.
+BATCH_SECTIONS = {
+    'summary': (query_summary, 1),
+    'affected_addresses': (query_affected_addresses, 1),
+    'to_addresses': (query_to_addresses, 1),
+    'gas_efficiency': (query_gas_efficiency, 1),
+    'partition_summary': (query_partition_summary, 1),
+    distinct_counts.SECTION: (query_distinct_sketches, 1),
+    address_graph.SECTION: (query_address_pairs, 1),
+    quantile_sketches.SECTION: (query_quantile_sketches, 1),
+    daily_series.SECTION: (query_daily_summary, 2),
+    daily_series.SKETCH_SECTION: (query_daily_sketches, 1),
+}
+SECTION_VERSIONS = {section: version for section, (_, version) in BATCH_SECTIONS.items()}
+BLOCK_TOTAL_SECTIONS = {'summary', 'partition_summary', daily_series.SECTION}
+
+def process_partition_batch(xatu, start_block, end_block, batch_id, cache_dir, store=None, sections=None,
+                            codec='none', derived=True):
+    """Process a batch of partitions
+
+    With derived off, the sections only go to the cache or store: the blocks two overlapping batches share
+    are fetched that way, to be subtracted rather than indexed or sketched.
+    """
+    start_partition, end_partition = partition_range(start_block, end_block)
+    if sections is None:
+        # The store keeps only the sections it aggregates
+        sections = list(cache_store.BATCH_DATASETS) if store is not None else list(BATCH_SECTIONS)
+    
+    print(f"\nProcessing batch {batch_id}: blocks {start_partition:,} to {end_partition:,}")
     
     batch_data = {
         'batch_id': batch_id,
         'start_block': start_partition,
-        'end_block': end_partition,
-        'summary': summary_dict if 'summary_dict' in locals() else {},
-        'affected_addresses': affected_addresses,
-        'to_addresses': to_addresses,
-        'gas_efficiency': gas_efficiency
+        'end_block': end_partition
     }
+    failed = []
+    totals = None
+    
+    for section in sections:
+        query_section, version = BATCH_SECTIONS[section]
+        try:
+            if section in BLOCK_TOTAL_SECTIONS:
+                if totals is None:
+                    totals = query_block_totals(xatu, start_partition, end_partition)
+                result = query_section(xatu, start_partition, end_partition, totals)
+            else:
+                result = query_section(xatu, start_partition, end_partition)
+        except Exception as e:
+            # Failed sections stay uncached so the next run retries only them
+            print(f"  Error getting {section}: {e}")
+            failed.append(section)
+            continue
+        
+        if section == 'summary' and result is None:
+            print(f"  No data for batch {batch_id}")
+            return None
+        
+        batch_data[section] = result
+        if store is None:
+            entry = batch_cache.write_section_file(cache_dir, start_partition, end_partition, section, version,
+                                                   result, codec)
+            if derived:
+                bloom_filters.filter_section(cache_dir, section, start_partition, end_partition, result, entry)
+                heavy_hitters.sketch_section(cache_dir, section, start_partition, end_partition, result, entry)
+                address_index.index_section(cache_dir, section, start_partition, end_partition, result)
+    
+    if store is not None:
+        if any(section in cache_store.BATCH_DATASETS for section in failed):
+            print(f"  Batch {batch_id} not stored; it is fetched again on the next run")
+        else:
+            cache_store.write_batch(store, batch_data)
     
-    cache_file = os.path.join(cache_dir, f"batch_{batch_id:05d}.json")
-    with open(cache_file, 'w') as f:
-        json.dump(batch_data, f)
-    
-        gc.collect()
+    gc.collect()
     
     return batch_data.get('summary', {})
 
-def aggregate_results(cache_dir):
-    """Aggregate all batch results"""
+def aggregate_results(cache_dir, start_block=None, end_block=None, workers=None, incremental=False):
+    """Aggregate the batch results starting inside a block window (all batches by default)
+
+    Incrementally, only batches added since the previous incremental aggregation are folded, and the
+    saved window state is replaced. Only the rolling window of the daily run aggregates incrementally, so
+    that an ad-hoc window never overwrites its state.
+    """
     print("\nAggregating results from all batches...")
     
-    total_transactions = 0
-    total_affected = 0
-    total_high_gas = 0
-    address_aggregates = {}
-    to_address_aggregates = {}
-    gas_efficiency_stats = {
-        'total_overprovision': 0,
-        'unnecessary_high_limit': 0,
-        'sum_gas_limit': 0,
-        'sum_gas_used': 0,
-        'count': 0,
-        'min_gas_used': float('inf'),
-        'max_gas_used': 0
-    }
-    
-    batch_files = sorted([f for f in os.listdir(cache_dir) if f.startswith('batch_')])
-    print(f"Found {len(batch_files)} batch files to aggregate")
-    
-    for batch_file in batch_files:
-        with open(os.path.join(cache_dir, batch_file), 'r') as f:
-            batch_data = json.load(f)
-        
-        # Aggregate summary
-        if batch_data.get('summary'):
-            total_transactions += batch_data['summary'].get('total_transactions', 0)
-            total_affected += batch_data['summary'].get('affected_transactions', 0)
-            total_high_gas += batch_data['summary'].get('high_gas_transactions', 0)
-        
-        # Aggregate addresses
-        for addr_data in batch_data.get('affected_addresses', []):
-            addr = addr_data['from_address']
-            
-            if addr not in address_aggregates:
-                address_aggregates[addr] = {
-                    'transaction_count': 0,
-                    'total_gas_limit': 0,
-                    'max_gas_limit': 0,
-                    'total_excess_gas': 0,
-                    'total_gas_price': 0,
-                    'batches_appeared': 0
-                }
-            
-            agg = address_aggregates[addr]
-            agg['transaction_count'] += int(addr_data['transaction_count'])
-            agg['total_gas_limit'] += float(addr_data['avg_gas_limit']) * int(addr_data['transaction_count'])
-            agg['max_gas_limit'] = max(agg['max_gas_limit'], float(addr_data['max_gas_limit']))
-            agg['total_excess_gas'] += float(addr_data['total_excess_gas'])
-            agg['total_gas_price'] += float(addr_data['avg_gas_price']) * int(addr_data['transaction_count'])
-            agg['batches_appeared'] += 1
-        
-        # Aggregate to_addresses
-        for to_addr_data in batch_data.get('to_addresses', []):
-            addr = to_addr_data['to_address']
-            
-            if addr not in to_address_aggregates:
-                to_address_aggregates[addr] = {
-                    'transaction_count': 0,
-                    'total_gas_limit': 0,
-                    'max_gas_limit': 0
-                }
-            
-            agg = to_address_aggregates[addr]
-            agg['transaction_count'] += int(to_addr_data['transaction_count'])
-            agg['total_gas_limit'] += float(to_addr_data['avg_gas_limit']) * int(to_addr_data['transaction_count'])
-            agg['max_gas_limit'] = max(agg['max_gas_limit'], float(to_addr_data['max_gas_limit']))
-        
-        # Aggregate gas efficiency
-        if batch_data.get('gas_efficiency'):
-            eff = batch_data['gas_efficiency']
-            if eff.get('total_overprovision', 0) > 0:
-                gas_efficiency_stats['total_overprovision'] += eff.get('total_overprovision', 0)
-                gas_efficiency_stats['unnecessary_high_limit'] += eff.get('unnecessary_high_limit', 0)
-                gas_efficiency_stats['sum_gas_limit'] += eff.get('avg_gas_limit', 0) * eff.get('total_overprovision', 0)
-                gas_efficiency_stats['sum_gas_used'] += eff.get('avg_gas_used', 0) * eff.get('total_overprovision', 0)
-                gas_efficiency_stats['count'] += eff.get('total_overprovision', 0)
-                gas_efficiency_stats['min_gas_used'] = min(gas_efficiency_stats['min_gas_used'], eff.get('min_gas_used', float('inf')))
-                gas_efficiency_stats['max_gas_used'] = max(gas_efficiency_stats['max_gas_used'], eff.get('max_gas_used', 0))
+    state = rollups.window_state(cache_dir, start_block, end_block, workers, incremental)
+    print(f"Aggregated {state['batch_count']} cached batches")
+    
+    results = finalize_results(state, address_dict.open_dictionary(cache_dir))
+    results['distinct_estimates'] = distinct_counts.window_estimates(cache_dir, start_block, end_block)
+    results['gas_quantiles'] = quantile_sketches.window_quantiles(cache_dir, start_block, end_block)
+    series = daily_series.load_daily_series(cache_dir)
+    results['daily_trends'] = daily_series.trends(series, start_block, end_block) if series is not None else None
+    activity = activity_bitmaps.load_activity(cache_dir)
+    results['address_activity'] = (activity_bitmaps.activity_summary(activity, start_block, end_block)
+                                   if activity is not None else None)
+    return results
+
+def aggregate_results_from_store(store, start_block=None, end_block=None):
+    """Aggregate batch results held in the single-file store"""
+    print("\nAggregating results from store...")
+    
+    summary = cache_store.aggregate_summary(store, start_block, end_block)
+    print(f"Found {summary['batch_count']} stored batches to aggregate")
+    
+    return finalize_results({
+        'batch_count': summary['batch_count'],
+        'total_transactions': summary['total_transactions'],
+        'total_affected': summary['total_affected'],
+        'total_high_gas': summary['total_high_gas'],
+        'address_aggregates': aggregation.aggregates_from_mapping(
+            cache_store.aggregate_addresses(store, start_block, end_block), aggregation.ADDRESS_FIELDS),
+        'to_address_aggregates': aggregation.aggregates_from_mapping(
+            cache_store.aggregate_to_addresses(store, start_block, end_block), aggregation.TO_ADDRESS_FIELDS),
+        'gas_efficiency_stats': aggregation.efficiency_from_mapping(
+            cache_store.aggregate_gas_efficiency(store, start_block, end_block))
+    })
+
+def finalize_results(state, addresses=None):
+    """Turn a merged aggregate state into the final result dictionary, decoding address ids if given"""
+    total_transactions = state['total_transactions']
+    total_affected = state['total_affected']
+    gas_efficiency_stats = aggregation.efficiency_values(state['gas_efficiency_stats'])
     
     # Calculate final statistics
-    final_addresses = []
-    for addr, agg in address_aggregates.items():
-        if agg['transaction_count'] > 0:
-            avg_gas_limit = agg['total_gas_limit'] / agg['transaction_count']
-            avg_gas_price = agg['total_gas_price'] / agg['transaction_count']
-            print(avg_gas_price/1e9)
-            # Calculate costs
-            BASE_GAS_COST = 21000
-            splits_required = np.ceil(avg_gas_limit / PROPOSED_GAS_CAP)
-            additional_gas_cost = (splits_required - 1) * BASE_GAS_COST
-            additional_cost_eth = additional_gas_cost * avg_gas_price / 1e18
-            
-            final_addresses.append({
-                'address': addr,
-                'transaction_count': agg['transaction_count'],
-                'avg_gas_limit': avg_gas_limit,
-                'max_gas_limit': agg['max_gas_limit'],
-                'total_excess_gas': agg['total_excess_gas'],
-                'additional_gas_cost': additional_gas_cost,
-                'total_additional_gas_cost': additional_gas_cost * agg['transaction_count'],
-                'additional_cost_eth': additional_cost_eth,
-                'total_additional_cost_eth': additional_cost_eth * agg['transaction_count'],
-                'splits_required': splits_required,
-                'total_splits_required': splits_required * agg['transaction_count']
-                
-            })
+    keys, columns = aggregate_columns(state['address_aggregates'],
+                                      ('total_gas_limit', 'max_gas_limit', 'total_excess_gas', 'total_gas_price'))
+    tx_counts = columns['transaction_count']
+    avg_gas_limit = columns['total_gas_limit'] / tx_counts
+    avg_gas_price = columns['total_gas_price'] / tx_counts
+    
+    # Calculate costs
+    splits_required = np.ceil(avg_gas_limit / PROPOSED_GAS_CAP)
+    additional_gas_cost = split_gas_cost(avg_gas_limit)
+    additional_cost_eth = additional_gas_cost * avg_gas_price / 1e18
+    
+    final_addresses = result_rows('address', keys, addresses, {
+        'transaction_count': tx_counts,
+        'avg_gas_limit': avg_gas_limit,
+        'max_gas_limit': columns['max_gas_limit'],
+        'total_excess_gas': columns['total_excess_gas'],
+        'additional_gas_cost': additional_gas_cost,
+        'total_additional_gas_cost': additional_gas_cost * tx_counts,
+        'additional_cost_eth': additional_cost_eth,
+        'total_additional_cost_eth': additional_cost_eth * tx_counts,
+        'splits_required': splits_required,
+        'total_splits_required': splits_required * tx_counts
+    })
     
     # Process to_addresses
-    final_to_addresses = []
-    for addr, agg in to_address_aggregates.items():
-        if agg['transaction_count'] > 0:
-            avg_gas_limit = agg['total_gas_limit'] / agg['transaction_count']
-            final_to_addresses.append({
-                'to_address': addr,
-                'transaction_count': agg['transaction_count'],
-                'avg_gas_limit': avg_gas_limit,
-                'max_gas_limit': agg['max_gas_limit']
-            })
-    
-    # Sort by transaction count
-    final_addresses.sort(key=lambda x: x['transaction_count'], reverse=True)
-    final_to_addresses.sort(key=lambda x: x['transaction_count'], reverse=True)
+    to_keys, to_columns = aggregate_columns(state['to_address_aggregates'], ('total_gas_limit', 'max_gas_limit'))
+    final_to_addresses = result_rows('to_address', to_keys, addresses, {
+        'transaction_count': to_columns['transaction_count'],
+        'avg_gas_limit': to_columns['total_gas_limit'] / to_columns['transaction_count'],
+        'max_gas_limit': to_columns['max_gas_limit']
+    })
     
     # Calculate gas efficiency final stats
     gas_efficiency_final = {}
@@ -349,29 +563,80 @@ def aggregate_results(cache_dir):
             'max_gas_used': gas_efficiency_stats['max_gas_used']
         }
     
+    # The top lists are cut from the exact tables, which the totals and the all-address CSVs need anyway;
+    # the heavy-hitter sketches serve lookups that do not aggregate the window (see heavy_hitters)
     return {
+        'batch_count': state['batch_count'],
         'total_transactions': total_transactions,
         'total_affected': total_affected,
-        'total_high_gas': total_high_gas,
+        'total_high_gas': state['total_high_gas'],
         'affected_percentage': (total_affected / total_transactions * 100) if total_transactions > 0 else 0,
         'unique_addresses': len(final_addresses),
         'top_addresses': final_addresses[:50],
         'all_addresses': final_addresses,
-        'total_additional_gas_cost': sum(
-            addr['additional_gas_cost'] * addr['transaction_count'] 
-            for addr in final_addresses
-        ),
-        'total_additional_cost_eth': sum(
-            addr['additional_cost_eth'] * addr['transaction_count'] 
-            for addr in final_addresses
-        ),
+        'total_additional_gas_cost': float(np.sum(additional_gas_cost * tx_counts)),
+        'total_additional_cost_eth': float(np.sum(additional_cost_eth * tx_counts)),
         'unique_to_addresses': len(final_to_addresses),
         'top_to_addresses': final_to_addresses[:50],
         'all_to_addresses': final_to_addresses,
         'gas_efficiency': gas_efficiency_final
     }
 
-def generate_6month_report(results, output_dir, cache_dir):
+def aggregate_columns(aggregates, fields):
+    """Keys and columns of the per-address aggregates with transactions"""
+    kept = aggregates[aggregates['transaction_count'] > 0]
+    columns = {'transaction_count': kept['transaction_count']}
+    for field in fields:
+        columns[field] = kept[field]
+    return kept[aggregation.KEY_FIELD], columns
+
+def result_rows(key_field, keys, addresses, columns):
+    """Result records sorted by transaction count, decoding address ids if a dictionary is given"""
+    order = np.argsort(-columns['transaction_count'], kind='stable')
+    keys = keys[order].tolist()
+    if addresses is not None:
+        keys = address_dict.decode_column(addresses, keys)
+    fields = [key_field] + list(columns)
+    values = [keys] + [column[order].tolist() for column in columns.values()]
+    return [dict(zip(fields, row)) for row in zip(*values)]
+
+def distinct_summary(results):
+    """Report line with the estimated number of high-gas senders, if sketches cover the window"""
+    estimates = results.get('distinct_estimates')
+    if not estimates:
+        return ""
+    return (f"\n- **Unique High Gas Senders (>1M)**: ~{estimates['high_gas_senders']:,.0f} "
+            f"(HyperLogLog estimate, ±{distinct_counts.standard_error():.1%})")
+
+def quantile_summary(results):
+    """Report section with gas quantiles of all transactions, if sketches cover the window"""
+    quantiles = results.get('gas_quantiles')
+    if not quantiles:
+        return ""
+    levels = quantile_sketches.DEFAULT_QUANTILES
+    lines = [
+        "### 5. Gas Distribution (All Transactions)",
+        "| Measure | " + " | ".join(f"p{q * 100:g}" for q in levels) + " |",
+        "|---------|" + "|".join("------" for _ in levels) + "|",
+    ]
+    for measure, values in quantiles.items():
+        cells = ["n/a" if values[q] is None else
+                 f"{values[q]:.1%}" if measure == 'gas_efficiency' else f"{values[q]:,.0f}" for q in levels]
+        lines.append(f"| {measure} | " + " | ".join(cells) + " |")
+    lines.append(f"\nQuantiles from per-batch DDSketches, within {quantile_sketches.RELATIVE_ACCURACY:.0%} of the exact values.")
+    return "\n" + "\n".join(lines) + "\n"
+
+def persistence_summary(results):
+    """Report line on how persistently affected senders recur, measured from the activity bitmaps if built"""
+    activity = results.get('address_activity')
+    if not activity:
+        return "- Most affected addresses show persistent high-gas usage"
+    return (f"- {activity['persistent_share']:.1%} of affected senders were active in at least "
+            f"{activity_bitmaps.PERSISTENT_SHARE:.0%} of the batches since they first appeared; "
+            f"{activity['one_time_share']:.1%} appeared in a single batch, and on average "
+            f"{activity['retention']:.1%} of a batch's senders were active again in the next")
+
+def generate_6month_report(results, output_dir, cache_dir, output_codec='none'):
     """Generate comprehensive 6-month report"""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
@@ -387,7 +652,7 @@ This report presents a comprehensive 6-month empirical analysis of EIP-7983, whi
 - **Total Transactions Analyzed**: {results['total_transactions']:,}
 - **Affected Transactions**: {results['total_affected']:,} ({results['affected_percentage']:.4f}%)
 - **Unique Addresses Affected**: {results['unique_addresses']:,}
-- **High Gas Transactions (>1M)**: {results['total_high_gas']:,}
+- **High Gas Transactions (>1M)**: {results['total_high_gas']:,}{distinct_summary(results)}
 
 ### 2. Economic Impact
 - **Total Additional Gas Cost**: {results['total_additional_gas_cost']:,.0f} gas units
@@ -409,6 +674,7 @@ This report presents a comprehensive 6-month empirical analysis of EIP-7983, whi
 {f"- **Average Gas Efficiency**: {results['gas_efficiency']['avg_efficiency']:.1%}" if results.get('gas_efficiency') else ""}
 {f"- **Average Gas Used**: {results['gas_efficiency']['avg_gas_used']:,.0f}" if results.get('gas_efficiency') else ""}
 {f"- **Min/Max Gas Used**: {results['gas_efficiency']['min_gas_used']:,} / {results['gas_efficiency']['max_gas_used']:,}" if results.get('gas_efficiency') else ""}
+{quantile_summary(results)}
 
 ## Top 50 Most Affected Addresses (6-Month Period)
 
@@ -439,7 +705,7 @@ This report presents a comprehensive 6-month empirical analysis of EIP-7983, whi
 - **Analysis Period**: 180 days (6 months)
 - **Processing Method**: Partition-aligned queries (1000-block partitions)
 - **Batch Size**: {BATCH_SIZE_PARTITIONS * PARTITION_SIZE:,} blocks per batch
-- **Total Batches Processed**: {len([f for f in os.listdir(cache_dir) if f.startswith('batch_')])}
+- **Total Batches Processed**: {results['batch_count']}
 
 ### Partition-Aware Optimization
 1. Queries aligned to 1000-block partition boundaries
@@ -455,7 +721,7 @@ This report presents a comprehensive 6-month empirical analysis of EIP-7983, whi
 - Consistent impact rate: {results['affected_percentage']:.4f}%
 
 ### Address Analysis
-- Most affected addresses show persistent high-gas usage
+{persistence_summary(results)}
 - Top 50 addresses account for significant portion of impact
 - Address concentration enables targeted migration support
 - To-address concentration shows centralization around key contracts
@@ -494,22 +760,24 @@ The 6-month analysis confirms minimal and manageable impact:
     
     # Save report
     report_file = os.path.join(reports_dir, f"gas_cap_6month_report_{timestamp}.md")
-    with open(report_file, 'w') as f:
+    with blob_store.replacing(report_file) as tmp_path, open(tmp_path, 'w') as f:
         f.write(report)
     
     print(f"\n6-month report saved to: {report_file}")
+    saved_files = [report_file]
     
     # Ensure data directory exists
     data_dir = os.path.join(output_dir, '6month_analysis', 'data')
     os.makedirs(data_dir, exist_ok=True)
+    data_suffix = compression.CODEC_SUFFIXES[output_codec]
     
     # Save all addresses as CSV
     if results['all_addresses']:
         import csv
         
         # Top 50
-        csv_file = os.path.join(data_dir, f"gas_cap_6month_top50_{timestamp}.csv")
-        with open(csv_file, 'w', newline='') as f:
+        csv_file = os.path.join(data_dir, f"gas_cap_6month_top50_{timestamp}.csv{data_suffix}")
+        with blob_store.replacing(csv_file) as tmp_path, compression.open_text(tmp_path, 'w', newline='') as f:
             fieldnames = ['rank', 'address', 'transaction_count', 'avg_gas_limit', 
                          'max_gas_limit', 'total_excess_gas', 'additional_gas_cost', 
                          'total_additional_gas_cost', 'additional_cost_eth']
@@ -530,10 +798,11 @@ The 6-month analysis confirms minimal and manageable impact:
                 })
         
         print(f"Top 50 addresses saved to: {csv_file}")
+        saved_files.append(csv_file)
         
         # All addresses
-        all_csv_file = os.path.join(data_dir, f"gas_cap_6month_all_addresses_{timestamp}.csv")
-        with open(all_csv_file, 'w', newline='') as f:
+        all_csv_file = os.path.join(data_dir, f"gas_cap_6month_all_addresses_{timestamp}.csv{data_suffix}")
+        with blob_store.replacing(all_csv_file) as tmp_path, compression.open_text(tmp_path, 'w', newline='') as f:
             # Ensure all required fields are included
             if results['all_addresses']:
                 # Get fieldnames from first row but ensure gas cost fields are included
@@ -550,28 +819,48 @@ The 6-month analysis confirms minimal and manageable impact:
             writer.writerows(results['all_addresses'])
         
         print(f"All affected addresses saved to: {all_csv_file}")
+        saved_files.append(all_csv_file)
     
     # Save to-address analysis
     if results.get('all_to_addresses'):
-        to_csv_file = os.path.join(data_dir, f"gas_cap_6month_to_addresses_{timestamp}.csv")
-        with open(to_csv_file, 'w', newline='') as f:
+        to_csv_file = os.path.join(data_dir, f"gas_cap_6month_to_addresses_{timestamp}.csv{data_suffix}")
+        with blob_store.replacing(to_csv_file) as tmp_path, compression.open_text(tmp_path, 'w', newline='') as f:
             fieldnames = list(results['all_to_addresses'][0].keys())
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
             writer.writerows(results['all_to_addresses'])
         
         print(f"To-address analysis saved to: {to_csv_file}")
+        saved_files.append(to_csv_file)
+    
+    # Save memory-mappable address tables for fast reloading and lookups
+    for table_file in address_table.write_address_tables(data_dir, results, timestamp):
+        print(f"Address table saved to: {table_file}")
+        saved_files.append(table_file)
     
     # Save gas efficiency analysis
     if results.get('gas_efficiency'):
-        efficiency_file = os.path.join(data_dir, f"gas_cap_6month_efficiency_{timestamp}.json")
-        with open(efficiency_file, 'w') as f:
+        efficiency_file = os.path.join(data_dir, f"gas_cap_6month_efficiency_{timestamp}.json{data_suffix}")
+        with blob_store.replacing(efficiency_file) as tmp_path, compression.open_text(tmp_path, 'w') as f:
             json.dump(results['gas_efficiency'], f, indent=2)
         
         print(f"Gas efficiency analysis saved to: {efficiency_file}")
+        saved_files.append(efficiency_file)
     
+    store_outputs(saved_files, output_dir)
     return report_file
 
+def save_chart(path, **kwargs):
+    """Save the current figure, replacing any earlier file linked to a stored blob"""
+    with blob_store.replacing(path) as tmp_path:
+        plt.savefig(tmp_path, **kwargs)
+
+def store_outputs(paths, output_dir):
+    """Keep one copy of each distinct output; unchanged results only add a hard link"""
+    deduplicated = blob_store.store_outputs(paths, os.path.join(output_dir, blob_store.BLOB_DIR))
+    if deduplicated:
+        print(f"{deduplicated} outputs identical to an earlier run, linked to the stored copy")
+
 def create_visualizations(results, timestamp, output_dir):
     """Create visualization charts for the analysis results"""
     # Set up the plot style
@@ -741,11 +1030,12 @@ def create_visualizations(results, timestamp, output_dir):
     
     # Save the figure
     chart_file = os.path.join(viz_dir, f"gas_cap_6month_analysis_charts_{timestamp}.png")
-    plt.savefig(chart_file, dpi=300, bbox_inches='tight')
+    save_chart(chart_file, dpi=300, bbox_inches='tight')
     print(f"Visualization charts saved to: {chart_file}")
     
     # Also save individual charts
-    save_individual_charts(results, timestamp, output_dir)
+    charts_dir = save_individual_charts(results, timestamp, output_dir)
+    store_outputs([chart_file, charts_dir], output_dir)
     
     return chart_file
 
@@ -767,7 +1057,7 @@ def save_individual_charts(results, timestamp, output_dir):
         plt.title('Top 20 Recipient Addresses', fontsize=16, fontweight='bold')
         plt.grid(True, alpha=0.3, axis='x')
         plt.tight_layout()
-        plt.savefig(os.path.join(charts_dir, 'to_address_concentration.png'), dpi=300)
+        save_chart(os.path.join(charts_dir, 'to_address_concentration.png'), dpi=300)
         plt.close()
     
     # 2. Gas Efficiency Pie Chart
@@ -787,10 +1077,30 @@ def save_individual_charts(results, timestamp, output_dir):
         plt.text(0, -1.3, f"Average Efficiency: {eff['avg_efficiency']:.1%}", 
                 ha='center', fontsize=14, transform=plt.gca().transAxes)
         plt.tight_layout()
-        plt.savefig(os.path.join(charts_dir, 'gas_efficiency_analysis.png'), dpi=300)
+        save_chart(os.path.join(charts_dir, 'gas_efficiency_analysis.png'), dpi=300)
+        plt.close()
+    
+    # 3. Daily Trend Chart
+    if results.get('daily_trends'):
+        plt.figure(figsize=(14, 7))
+        trend = results['daily_trends']
+        days = np.arange(len(trend['affected_transactions']))
+        
+        plt.bar(days, trend['affected_transactions'], color='#c7d2fe', label='Affected transactions per day')
+        for window, color in zip(daily_series.ROLLING_WINDOWS, ['#4f46e5', '#dc2626']):
+            plt.plot(days, trend[f'affected_{window}d_average'], color=color, linewidth=2,
+                     label=f'{window}-day average')
+        plt.xlabel(f"Day (from block {trend['first_block'][0]:,})" if trend['first_block'] else 'Day', fontsize=14)
+        plt.ylabel('Transactions', fontsize=14)
+        plt.title('Daily Affected Transactions', fontsize=16, fontweight='bold')
+        plt.legend()
+        plt.grid(True, alpha=0.3, axis='y')
+        plt.tight_layout()
+        save_chart(os.path.join(charts_dir, 'daily_trends.png'), dpi=300)
         plt.close()
     
     print(f"Individual charts saved to: {charts_dir}/")
+    return charts_dir
 
 def main():
     """Main function for 6-month analysis"""
@@ -800,15 +1110,51 @@ def main():
                         type=str, 
                         default=DEFAULT_OUTPUT_DIR,
                         help=f'Output directory for results (default: {DEFAULT_OUTPUT_DIR})')
+    parser.add_argument('--store', '-s',
+                        type=str,
+                        default=None,
+                        help='Keep batch results in a single-file SQLite store instead of JSON cache files')
+    parser.add_argument('--verify-cache',
+                        action='store_true',
+                        help='Verify cache file checksums on startup instead of only sizes')
+    parser.add_argument('--cache-compression',
+                        choices=compression.available_codecs(),
+                        default=compression.default_codec(),
+                        help=f'Compression for new cache files (default: {compression.default_codec()})')
+    parser.add_argument('--output-compression',
+                        choices=compression.available_codecs(),
+                        default='none',
+                        help='Compression for CSV and JSON data outputs (default: none)')
+    parser.add_argument('--cache-budget',
+                        type=str,
+                        default=None,
+                        help='Evict least recently used cache files beyond this size after the run (e.g. 2GB)')
+    parser.add_argument('--workers', '-j',
+                        type=int,
+                        default=None,
+                        help='Worker processes for aggregating cached batches (default: aggregate in this process)')
+    parser.add_argument('--full-aggregation',
+                        action='store_true',
+                        help='Aggregate the window from rollups and batches instead of updating the saved window state')
+    parser.add_argument('--memory-cache',
+                        type=str,
+                        default=None,
+                        help='Size of the in-memory cache of decoded batch and rollup files (default: 256MB, 0 disables)')
     
     args = parser.parse_args()
     output_dir = args.output_dir
+    if args.memory_cache is not None:
+        batch_cache.set_decoded_cache_size(batch_cache.parse_size(args.memory_cache))
     
     print(f"Using output directory: {output_dir}")
+    if args.store:
+        print(f"Using batch store: {args.store}")
     
     try:
         # Setup
         cache_dir = ensure_cache_dir(output_dir)
+        store = cache_store.open_store(args.store) if args.store else None
+        cached_ranges = batch_cache.range_index(batch_cache.validate_cache(cache_dir, verify_checksums=args.verify_cache))
         print("Initializing PyXatu client...")
         xatu = initialize_xatu()
         
@@ -823,36 +1169,61 @@ def main():
         print(f"\nAnalyzing 6 months: blocks {start_block:,} to {latest_block:,}")
         print(f"Total blocks: {total_blocks:,}")
         
-        # Process in batches aligned to partitions
+        # Cover the window with the cached ranges, whatever grid they were written on, and fetch the gaps
+        # between them on a fixed block grid so new ranges are reused across runs
         batch_size = BATCH_SIZE_PARTITIONS * PARTITION_SIZE
-        num_batches = (total_blocks + batch_size - 1) // batch_size
+        first_batch_start = (start_block // batch_size) * batch_size
+        window_end = partition_range(first_batch_start, latest_block)[1]
+        if store is not None:
+            cached_ranges = {(batch['start_block'], batch['end_block']): {} for batch in cache_store.list_batches(store)}
+        gaps, shared = batch_cache.plan_window(cached_ranges, first_batch_start, window_end, batch_size)
         
-        print(f"Processing in {num_batches} batches of {batch_size:,} blocks each")
+        work = [(batch_range, None, True) for batch_range in gaps]
+        if store is None:
+            # Cached ranges missing sections fetch only those, unless fetched again in full
+            refetched = {batch_range[0] for batch_range in gaps}
+            for batch_range in batch_cache.select_ranges(cached_ranges, first_batch_start, window_end):
+                sections = batch_cache.missing_sections(cached_ranges[batch_range], SECTION_VERSIONS)
+                if sections and batch_range[0] not in refetched:
+                    work.append((batch_range, sections, True))
+        work.extend((batch_range, list(cache_store.BATCH_DATASETS), False) for batch_range in shared)
+        work.sort()
+        
+        print(f"Processing {len(gaps)} new batches and {len(work) - len(gaps)} cached ranges or shared blocks "
+              f"(batches of up to {batch_size:,} blocks)")
         
         # Process batches
-        for batch_id in range(num_batches):
-            batch_start = start_block + (batch_id * batch_size)
-            batch_end = min(batch_start + batch_size, latest_block)
-            
-            # Check if already processed
-            cache_file = os.path.join(cache_dir, f"batch_{batch_id:05d}.json")
-            if os.path.exists(cache_file):
-                print(f"\nBatch {batch_id} already processed, skipping...")
-                continue
-            
-            # Process batch
-            process_partition_batch(xatu, batch_start, batch_end, batch_id, cache_dir)
+        for batch_id, ((batch_start, batch_end), sections, derived) in enumerate(work):
+            process_partition_batch(xatu, batch_start, batch_end, batch_id, cache_dir, store, sections,
+                                    args.cache_compression, derived)
             
             # Progress
-            progress = (batch_id + 1) / num_batches * 100
+            progress = (batch_id + 1) / len(work) * 100
             print(f"Progress: {progress:.1f}%")
         
+        if store is None:
+            if shared:
+                address_index.index_overlaps(cache_dir, shared)
+            address_index.compact_index(cache_dir)
+            prefix_sums.build_prefix_sums(cache_dir)
+            daily_series.build_daily_series(cache_dir)
+            activity_bitmaps.build_activity(cache_dir)
+        
         # Aggregate results
-        final_results = aggregate_results(cache_dir)
+        compaction = None
+        if store is not None:
+            final_results = aggregate_results_from_store(store, first_batch_start, window_end)
+        else:
+            # Roll the batches up in the background for later window queries
+            compaction = threading.Thread(target=rollups.compact_rollups, args=(cache_dir,), daemon=True)
+            compaction.start()
+            # The rolling window is the one whose state is kept between runs
+            final_results = aggregate_results(cache_dir, first_batch_start, window_end, args.workers,
+                                              incremental=not args.full_aggregation)
         
         # Generate report
         print("\nGenerating 6-month report...")
-        report_file = generate_6month_report(final_results, output_dir, cache_dir)
+        report_file = generate_6month_report(final_results, output_dir, cache_dir, args.output_compression)
         
         # Generate visualizations
         print("\nCreating visualization charts...")
@@ -883,6 +1254,14 @@ def main():
             print(f"Average gas efficiency: {final_results['gas_efficiency']['avg_efficiency']:.1%}")
             print(f"Average gas used: {final_results['gas_efficiency']['avg_gas_used']:,.0f}")
         
+        if compaction is not None:
+            compaction.join()
+        
+        # Keep the batches and rollups of the current window; evict the oldest reads first
+        if args.cache_budget and store is None:
+            batch_cache.enforce_budget(cache_dir, batch_cache.parse_size(args.cache_budget),
+                                       (first_batch_start, window_end))
+        
         print("\nAnalysis completed successfully!")
         
     except Exception as e:
@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+"""
+Batch Cache Files
+
+Crash-safe batch cache writes with a checksummed manifest.
+"""
+
+import argparse
+import bisect
+import collections
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import address_dict
+import compression
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 2
+RANGE_FIELDS = ('batch_id', 'start_block', 'end_block')
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+# Bound on the JSON text size of decoded files kept in memory; the objects take a few times more
+DECODED_CACHE_BYTES = 256 << 20
+
+# Manifests are updated from the aggregation and the background rollup thread
+_manifest_lock = threading.RLock()
+_pending_access = {}
+
+# Decoded cache files, least recently used first: path -> (file signature, content, JSON size)
+_decoded = collections.OrderedDict()
+_decoded_lock = threading.Lock()
+_decoded_stats = {'limit': DECODED_CACHE_BYTES, 'bytes': 0, 'hits': 0, 'misses': 0}
+
+def atomic_write_bytes(path, data):
+    """Write data to path through a temp file and rename"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # Persist the rename itself
+    try:
+        dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+def atomic_savez(path, **arrays):
+    """Save numpy arrays to an .npz file atomically"""
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    atomic_write_bytes(path, buffer.getvalue())
+
+def atomic_write_json(path, obj, indent=None):
+    """Serialize obj, compress it per the path's extension and write it atomically"""
+    data = json.dumps(obj, indent=indent).encode('utf-8')
+    data = compression.compress_bytes(data, compression.codec_for_path(path))
+    atomic_write_bytes(path, data)
+    return data
+
+def read_json(path):
+    """Read a possibly compressed JSON file, decompressing as a stream"""
+    with compression.open_text(path) as f:
+        return json.load(f)
+
+def file_signature(path):
+    """Identity of a file's content; an atomic replace or rewrite changes it"""
+    info = os.stat(path)
+    return info.st_ino, info.st_size, info.st_mtime_ns
+
+def set_decoded_cache_size(max_bytes):
+    """Resize the in-memory cache of decoded files; 0 disables it"""
+    with _decoded_lock:
+        _decoded_stats['limit'] = max_bytes
+        _evict_decoded()
+
+def _evict_decoded():
+    """Drop least recently used decoded files until the cache fits its limit"""
+    while _decoded and _decoded_stats['bytes'] > _decoded_stats['limit']:
+        _, (_, _, size) = _decoded.popitem(last=False)
+        _decoded_stats['bytes'] -= size
+
+def decoded_cache_stats():
+    """Hits, misses and size of the in-memory cache of decoded files"""
+    with _decoded_lock:
+        return dict(_decoded_stats, files=len(_decoded))
+
+def read_cached(path, decode=None):
+    """Read a JSON cache file through the in-memory LRU; decode runs once, before the content is kept
+
+    The content is shared between callers and must not be modified.
+    """
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    with _decoded_lock:
+        cached = _decoded.get(path)
+        if cached is not None and cached[0] == signature:
+            _decoded.move_to_end(path)
+            _decoded_stats['hits'] += 1
+            return cached[1]
+
+    # Decompressed as a stream like read_json; only the JSON text is measured against the bound
+    with compression.open_text(path) as f:
+        text = f.read()
+    size = len(text)
+    content = json.loads(text)
+    del text
+    if decode is not None:
+        content = decode(content)
+
+    with _decoded_lock:
+        _decoded_stats['misses'] += 1
+        previous = _decoded.pop(path, None)
+        if previous is not None:
+            _decoded_stats['bytes'] -= previous[2]
+        if size <= _decoded_stats['limit']:
+            _decoded[path] = (signature, content, size)
+            _decoded_stats['bytes'] += size
+            _evict_decoded()
+    return content
+
+def records_to_columns(records, addresses=None):
+    """Store a list of records as one list per field, with address fields as dictionary ids"""
+    columns = {}
+    for record in records:
+        for key in record:
+            columns.setdefault(key, [])
+    for key, values in columns.items():
+        values.extend(record.get(key) for record in records)
+
+    encoded = {'columns': columns, 'length': len(records)}
+    if addresses is not None:
+        encoded['address_columns'] = [key for key in columns if key.endswith('address')]
+        for key in encoded['address_columns']:
+            columns[key] = address_dict.encode_column(addresses, columns[key]).tolist()
+    return encoded
+
+def decode_records(content):
+    """Expand the column encoding of a section file into records"""
+    if content.get('encoding') != 'columns':
+        return content
+    content = dict(content, data=columns_to_records(content['data']))
+    del content['encoding']
+    return content
+
+def columns_to_records(encoded):
+    """Rebuild the list of records stored by records_to_columns"""
+    columns = encoded['columns']
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+
+def sha256_file(path):
+    """Compute the SHA-256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(cache_dir):
+    """Load the cache manifest, or an empty one if none exists"""
+    manifest_file = os.path.join(cache_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except (ValueError, OSError) as e:
+            print(f"  Ignoring unreadable manifest {manifest_file}: {e}")
+
+    return {'version': MANIFEST_VERSION, 'entries': {}}
+
+def save_manifest(cache_dir, manifest):
+    """Atomically replace the cache manifest"""
+    atomic_write_json(os.path.join(cache_dir, MANIFEST_FILE), manifest, indent=1)
+
+def update_manifest(cache_dir, update):
+    """Apply update to the manifest under the manifest lock and save it"""
+    with _manifest_lock:
+        manifest = load_manifest(cache_dir)
+        update(manifest['entries'])
+        save_manifest(cache_dir, manifest)
+        return manifest
+
+def manifest_entry(batch_data, data, sections=None):
+    """Describe a cache file by its range, sections, row counts and hash"""
+    if sections is None:
+        # Whole-batch files hold every section at version 1
+        sections = {key: 1 for key in batch_data if key not in RANGE_FIELDS}
+    if 'section' in batch_data:
+        if batch_data.get('encoding') == 'columns':
+            rows = {batch_data['section']: batch_data['data']['length']}
+        else:
+            rows = {batch_data['section']: len(batch_data['data'])} if isinstance(batch_data['data'], list) else {}
+    else:
+        rows = {key: len(value) for key, value in batch_data.items() if isinstance(value, list)}
+
+    return {
+        'start_block': batch_data.get('start_block'),
+        'end_block': batch_data.get('end_block'),
+        'sections': sections,
+        'rows': rows,
+        'size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'last_access': time.time()
+    }
+
+def section_filename(start_block, end_block, section, codec='none'):
+    """Name of the cache file holding one section of a block range"""
+    return f"batch_{start_block:09d}_{end_block:09d}.{section}.json{compression.CODEC_SUFFIXES[codec]}"
+
+def write_section_file(cache_dir, start_block, end_block, section, version, data, codec='none'):
+    """Write one section of a block range atomically and record it in the manifest"""
+    filename = section_filename(start_block, end_block, section, codec)
+    payload = {
+        'start_block': start_block,
+        'end_block': end_block,
+        'section': section,
+        'version': version,
+        'data': data
+    }
+    if isinstance(data, list):
+        # Column lists avoid repeating every key name on every record
+        addresses = address_dict.open_dictionary(cache_dir)
+        payload['data'] = records_to_columns(data, addresses)
+        payload['encoding'] = 'columns'
+        # New ids must be durable before a file refers to them
+        address_dict.flush_dictionary(addresses)
+    raw = atomic_write_json(os.path.join(cache_dir, filename), payload)
+
+    entry = manifest_entry(payload, raw, sections={section: version})
+    update_manifest(cache_dir, lambda entries: entries.__setitem__(filename, entry))
+    return entry
+
+def write_batch_file(cache_dir, filename, batch_data, codec='none', sections=None):
+    """Write one batch cache file atomically and record it in the manifest
+
+    Rollups, filters and sketches are written with it into their own directories as well, so that each has
+    a manifest the cache budget can size and evict them by.
+    """
+    filename = filename + compression.CODEC_SUFFIXES[codec]
+    data = atomic_write_json(os.path.join(cache_dir, filename), batch_data)
+
+    entry = manifest_entry(batch_data, data, sections)
+    update_manifest(cache_dir, lambda entries: entries.__setitem__(filename, entry))
+    return entry
+
+def validate_cache(cache_dir, verify_checksums=False):
+    """Reconcile the manifest with the cache directory and drop damaged files"""
+    with _manifest_lock:
+        return _validate_cache(cache_dir, verify_checksums)
+
+def _read_entry(path, sections=None):
+    """Manifest entry of a cache file read back from disk, or None if it is truncated or corrupt
+
+    Raises ImportError when the package of the file's codec is missing.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        batch_data = json.loads(compression.decompress_bytes(data, compression.codec_for_path(path)))
+    except compression.DECODE_ERRORS:
+        return None
+    if 'section' in batch_data:
+        return manifest_entry(batch_data, data, sections={batch_data['section']: batch_data['version']})
+    return manifest_entry(batch_data, data, sections)
+
+def _validate_cache(cache_dir, verify_checksums):
+    """Body of validate_cache, run under the manifest lock"""
+    manifest = load_manifest(cache_dir)
+    entries = manifest['entries']
+    changed = False
+
+    for filename, entry in list(entries.items()):
+        path = os.path.join(cache_dir, filename)
+        if not os.path.exists(path):
+            print(f"  Cache file {filename} missing, dropping manifest entry")
+            del entries[filename]
+            changed = True
+            continue
+
+        damaged = os.path.getsize(path) != entry['size']
+        if not damaged and verify_checksums:
+            damaged = sha256_file(path) != entry['sha256']
+        if not damaged:
+            continue
+
+        # A crash between renaming a new file into place and saving the manifest leaves the old entry
+        changed = True
+        try:
+            entries[filename] = _read_entry(path, entry['sections'])
+        except ImportError as e:
+            print(f"  Cache file {filename} does not match manifest and cannot be read ({e}), skipping it")
+            del entries[filename]
+            continue
+        if entries[filename] is None:
+            print(f"  Cache file {filename} does not match manifest, removing")
+            os.remove(path)
+            del entries[filename]
+        else:
+            print(f"  Cache file {filename} was replaced after the manifest was saved, adopting it")
+
+    for filename in sorted(os.listdir(cache_dir)):
+        path = os.path.join(cache_dir, filename)
+        if filename.endswith('.tmp'):
+            os.remove(path)
+            continue
+        if not filename.startswith('batch_') or filename in entries:
+            continue
+
+        # Files without an entry predate the manifest or were renamed just before a crash
+        try:
+            entry = _read_entry(path)
+        except ImportError as e:
+            print(f"  Cache file {filename} cannot be read ({e}), skipping it")
+            continue
+        if entry is None:
+            print(f"  Cache file {filename} is truncated or corrupt, removing")
+            os.remove(path)
+            continue
+        entries[filename] = entry
+        changed = True
+
+    if changed:
+        save_manifest(cache_dir, manifest)
+
+    return manifest
+
+def list_batch_files(manifest):
+    """List the batch files recorded in a manifest"""
+    return sorted(f for f in manifest['entries'] if f.startswith('batch_'))
+
+def find_batch_file(manifest, filename):
+    """Find the cached variant of a batch file under any compression"""
+    for suffix in compression.CODEC_SUFFIXES.values():
+        if filename + suffix in manifest['entries']:
+            return filename + suffix
+    return None
+
+def range_index(manifest):
+    """Map each cached block range to the file and version of each of its sections"""
+    ranges = {}
+    # Whole-batch files first so that section files written later take precedence
+    for filename in sorted(manifest['entries'], key=lambda f: len(manifest['entries'][f].get('sections', {})) == 1):
+        entry = manifest['entries'][filename]
+        sections = ranges.setdefault((entry['start_block'], entry['end_block']), {})
+        for section, version in entry.get('sections', {}).items():
+            sections[section] = {'version': version, 'file': filename}
+    return ranges
+
+def missing_sections(cached_sections, section_versions):
+    """List sections that are absent or cached at an outdated version"""
+    return [
+        section for section, version in section_versions.items()
+        if cached_sections.get(section, {}).get('version') != version
+    ]
+
+def load_batch(cache_dir, start_block, end_block, cached_sections):
+    """Assemble a batch dictionary from the files holding its sections; addresses may be dictionary ids
+
+    Section records come from the in-memory cache and are shared, so callers only read them.
+    """
+    batch_data = {'start_block': start_block, 'end_block': end_block}
+    loaded = {}
+
+    for section, info in cached_sections.items():
+        filename = info['file']
+        if filename not in loaded:
+            loaded[filename] = read_cached(os.path.join(cache_dir, filename), decode_records)
+            note_access(cache_dir, filename)
+        content = loaded[filename]
+
+        if 'section' in content:
+            batch_data[section] = content['data']
+        else:
+            batch_data[section] = content.get(section)
+            batch_data.setdefault('batch_id', content.get('batch_id'))
+
+    return batch_data
+
+def covering_ranges(ranges):
+    """Pick the block ranges covering the most blocks, sorted by start
+
+    Ranges cached on an older batch grid overlap their neighbours by a partition; they are all picked and the
+    blocks two of them share are taken out again (see shared_blocks). Among covers of the same blocks the one
+    sharing the fewest blocks, then using the fewest ranges, wins, so a superseded open batch or a range
+    inside others is never picked, and grid ranges retire the legacy ranges they cover.
+    """
+    ranges = sorted(set(ranges), key=lambda batch_range: (batch_range[1], batch_range[0]))
+    ends = [range_end for _, range_end in ranges]
+    # chain[i]: best (blocks covered, -blocks shared, -ranges used) of covers ending with range i, and the
+    # range before it; prefix[i]: best chain among the first i ranges
+    chain = []
+    prefix = [((0, 0, 0), None)]
+    for i, (range_start, range_end) in enumerate(ranges):
+        before = bisect.bisect_right(ends, range_start, 0, i)
+        covered, shared, used = prefix[before][0]
+        best = ((covered + range_end - range_start, shared, used - 1), prefix[before][1])
+        # A range overlapping the last one of a chain only adds the blocks past its end
+        for j in range(before, i):
+            previous_start, previous_end = ranges[j]
+            if previous_start < range_start and previous_end < range_end:
+                covered, shared, used = chain[j][0]
+                candidate = (covered + range_end - previous_end, shared - (previous_end - range_start), used - 1)
+                if candidate > best[0]:
+                    best = (candidate, j)
+        chain.append(best)
+        prefix.append(max(prefix[i], (best[0], i), key=lambda entry: entry[0]))
+
+    picked = []
+    i = prefix[-1][1]
+    while i is not None:
+        picked.append(ranges[i])
+        i = chain[i][1]
+    return picked[::-1]
+
+def shared_blocks(selected):
+    """Block ranges two consecutive ranges picked by covering_ranges both cover"""
+    return [(range_start, previous_end) for (_, previous_end), (range_start, _) in zip(selected, selected[1:])
+            if range_start < previous_end]
+
+def cached_overlaps(ranges, selected):
+    """Shared blocks of the selected ranges that are cached as ranges of their own, to be subtracted once
+
+    Shared blocks without a cached range of their own are counted twice, which is reported.
+    """
+    shared = shared_blocks(selected)
+    cached = [batch_range for batch_range in shared if batch_range in ranges]
+    if len(cached) < len(shared):
+        print(f"Warning: {len(shared) - len(cached)} block ranges shared by overlapping batches are not cached "
+              f"on their own; their blocks are counted twice")
+    return cached
+
+def select_ranges(ranges, start_block=None, end_block=None):
+    """Pick the cached ranges inside a block window covering it (see covering_ranges)"""
+    inside = [
+        (range_start, range_end) for range_start, range_end in ranges
+        if (start_block is None or range_start >= start_block) and (end_block is None or range_end <= end_block)
+    ]
+    return covering_ranges(inside)
+
+def grid_ranges(start_block, end_block, batch_size):
+    """Split a block range at the multiples of batch_size"""
+    pieces = []
+    while start_block < end_block:
+        piece_end = min((start_block // batch_size + 1) * batch_size, end_block)
+        pieces.append((start_block, piece_end))
+        start_block = piece_end
+    return pieces
+
+def plan_window(ranges, start_block, end_block, batch_size):
+    """Block ranges to fetch so the cached ranges cover a window: (gaps, shared blocks)
+
+    Cached ranges are reused whatever batch grid they were written on, and only the gaps between them are
+    fetched, split on the grid. A grid range cached while its batch was still open is fetched again from its
+    start, so the longer range supersedes it. Shared blocks of overlapping ranges that are not cached on their
+    own are returned as well, to be fetched and subtracted once (see cached_overlaps).
+    """
+    selected = select_ranges(ranges, start_block, end_block)
+    gaps = []
+    position = start_block
+    previous = None
+    for range_start, range_end in selected + [(end_block, end_block)]:
+        if range_start > position:
+            gap_start = position
+            if previous is not None and previous[0] % batch_size == 0 and previous[1] % batch_size:
+                gap_start = previous[0]
+            gaps.extend(grid_ranges(gap_start, range_start, batch_size))
+        if range_end > position:
+            position = range_end
+            previous = (range_start, range_end)
+    return gaps, [batch_range for batch_range in shared_blocks(selected) if batch_range not in ranges]
+
+def sections_fingerprint(manifest, cached_sections):
+    """Identify the cached content of some sections of a range by the hashes of their files"""
+    files = sorted({info['file'] for info in cached_sections.values()})
+    return ",".join(manifest['entries'][f]['sha256'] for f in files)
+
+def range_fingerprint(manifest, ranges, batch_range, sections):
+    """Fingerprint of the given sections of a cached range, or None if it holds none of them"""
+    cached = {section: info for section, info in ranges.get(batch_range, {}).items() if section in sections}
+    return sections_fingerprint(manifest, cached) if cached else None
+
+def cached_members(manifest, ranges, sections):
+    """Fingerprint of the given sections per selected range holding any of them
+
+    Files derived from those sections keep it to find the batches added or changed since they were built.
+    """
+    members = {}
+    for batch_range in select_ranges(ranges):
+        fingerprint = range_fingerprint(manifest, ranges, batch_range, sections)
+        if fingerprint is not None:
+            members[batch_range] = fingerprint
+    return members
+
+def extension_plan(previous, members):
+    """Ranges a derived file must read to catch up with members, the ranges to take out, and whether the
+    file can be extended rather than rebuilt
+
+    It can when every range that left members was superseded by a longer one with the same start; else
+    every member is read. previous is None for a file never built or built without member tracking.
+    """
+    if previous is not None:
+        added = sorted(batch_range for batch_range, fingerprint in members.items()
+                       if previous.get(batch_range) != fingerprint)
+        removed = sorted(batch_range for batch_range, fingerprint in previous.items()
+                         if members.get(batch_range) != fingerprint)
+        added_ends = dict(added)
+        if all(added_ends.get(range_start, range_end) > range_end for range_start, range_end in removed):
+            return added, removed, True
+    return sorted(members), [], False
+
+def members_to_arrays(members):
+    """Ranges and fingerprints of members as arrays, to be stored with a derived file"""
+    ordered = sorted(members)
+    return (np.array(ordered, dtype=np.int64).reshape(len(ordered), 2),
+            np.array([members[batch_range] for batch_range in ordered], dtype=str))
+
+def members_from_arrays(member_ranges, member_fingerprints):
+    """Restore the members stored by members_to_arrays"""
+    return {(int(start_block), int(end_block)): str(fingerprint)
+            for (start_block, end_block), fingerprint in zip(member_ranges.tolist(), member_fingerprints.tolist())}
+
+def stored_members(data):
+    """Members of a derived .npz file, or None for a file written before member tracking
+
+    extension_plan rebuilds such a file from every member.
+    """
+    if 'member_ranges' not in data.files:
+        return None
+    return members_from_arrays(data['member_ranges'], data['member_fingerprints'])
+
+def recompress_cache(cache_dir, codec):
+    """Rewrite every cache file of a directory with the given codec"""
+    manifest = validate_cache(cache_dir)
+    before = sum(entry['size'] for entry in manifest['entries'].values())
+    rewritten = 0
+
+    for filename in sorted(manifest['entries']):
+        if compression.codec_for_path(filename) == codec:
+            continue
+
+        path = os.path.join(cache_dir, filename)
+        content = read_json(path)
+        if 'section' in content:
+            data = content['data']
+            if content.get('encoding') == 'columns':
+                data = columns_to_records(data)
+            write_section_file(cache_dir, content['start_block'], content['end_block'],
+                               content['section'], content['version'], data, codec)
+        else:
+            write_batch_file(cache_dir, compression.strip_suffix(filename), content, codec)
+
+        os.remove(path)
+        update_manifest(cache_dir, lambda entries: entries.pop(filename, None))
+        rewritten += 1
+
+    after = sum(entry['size'] for entry in load_manifest(cache_dir)['entries'].values())
+    print(f"Rewrote {rewritten} cache files with {codec}: {before:,} -> {after:,} bytes")
+    return rewritten
+
+def note_access(cache_dir, filename):
+    """Remember that a cache file was read; flush_access persists it"""
+    _pending_access.setdefault(cache_dir, set()).add(filename)
+
+def take_access(cache_dir):
+    """Remove and return the files read since the last flush, to hand them to another process"""
+    return sorted(_pending_access.pop(cache_dir, set()))
+
+def flush_access(cache_dir):
+    """Write pending access times to the manifest in a single update"""
+    filenames = _pending_access.pop(cache_dir, set())
+    if not filenames or not os.path.exists(os.path.join(cache_dir, MANIFEST_FILE)):
+        return
+
+    now = time.time()
+    def touch(entries):
+        for filename in filenames:
+            if filename in entries:
+                entries[filename]['last_access'] = now
+    update_manifest(cache_dir, touch)
+
+def parse_size(text):
+    """Parse a byte size such as 500M or 2GB"""
+    value = text.strip().upper().rstrip('B')
+    unit = value[-1] if value and value[-1] in SIZE_UNITS else ''
+    number = value[:-1] if unit else value
+    return int(float(number) * SIZE_UNITS[unit])
+
+def namespace_dirs(cache_dir):
+    """Directories with a manifest that belong to one cache namespace"""
+    dirs = [cache_dir]
+    for name in sorted(os.listdir(cache_dir)):
+        if os.path.exists(os.path.join(cache_dir, name, MANIFEST_FILE)):
+            dirs.append(os.path.join(cache_dir, name))
+    return dirs
+
+def enforce_budget(cache_dir, max_bytes, pinned_window=None):
+    """Evict least recently used cache entries until the namespace fits max_bytes"""
+    groups = {}
+    total = 0
+    with _manifest_lock:
+        manifests = {directory: load_manifest(directory) for directory in namespace_dirs(cache_dir)}
+
+    # The sections of one block range are evicted together so no batch is left partial
+    for directory, manifest in manifests.items():
+        for filename, entry in manifest['entries'].items():
+            key = (directory, entry['start_block'], entry['end_block'])
+            group = groups.setdefault(key, {'files': [], 'size': 0, 'last_access': 0})
+            group['files'].append(filename)
+            group['size'] += entry['size']
+            group['last_access'] = max(group['last_access'], entry.get('last_access', 0))
+            total += entry['size']
+
+    if total <= max_bytes:
+        return 0
+
+    evicted = {}
+    freed = 0
+    for (directory, start_block, end_block), group in sorted(groups.items(), key=lambda item: item[1]['last_access']):
+        if total - freed <= max_bytes:
+            break
+        if pinned_window is not None and start_block is not None:
+            if start_block < pinned_window[1] and end_block > pinned_window[0]:
+                continue
+        for filename in group['files']:
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                os.remove(path)
+            evicted.setdefault(directory, []).append(filename)
+        freed += group['size']
+
+    for directory, filenames in evicted.items():
+        update_manifest(directory, lambda entries: [entries.pop(f, None) for f in filenames])
+
+    print(f"Cache {cache_dir}: evicted {sum(len(f) for f in evicted.values())} files, "
+          f"{freed:,} bytes freed, {total - freed:,} of {max_bytes:,} bytes used")
+    return freed
+
+def main():
+    """Recompress or prune existing cache directories"""
+    parser = argparse.ArgumentParser(description='Rewrite batch cache directories with compression or prune them to a budget')
+    parser.add_argument('cache_dirs', nargs='+', help='Cache directories containing batch files and manifest.json')
+    parser.add_argument('--codec', choices=compression.available_codecs(), default=None,
+                        help='Rewrite every cache file with this compression codec')
+    parser.add_argument('--budget', type=str, default=None,
+                        help='Evict least recently used entries until each cache fits this size (e.g. 2GB)')
+    args = parser.parse_args()
+    if args.codec is None and args.budget is None:
+        parser.error('nothing to do: pass --codec and/or --budget')
+
+    for cache_dir in args.cache_dirs:
+        if args.codec is not None:
+            recompress_cache(cache_dir, args.codec)
+        if args.budget is not None:
+            enforce_budget(cache_dir, parse_size(args.budget))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Output Store
+
+Stores each distinct output file once, keyed by its sha256, and hard-links timestamped names to it.
+"""
+
+import argparse
+import hashlib
+import os
+from contextlib import contextmanager
+
+BLOB_DIR = "blobs"
+CHUNK_SIZE = 1 << 20
+
+def hash_file(path):
+    """sha256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def blob_path(blob_dir, digest):
+    """Path of the blob holding content with the given sha256"""
+    return os.path.join(blob_dir, digest[:2], digest)
+
+def store_file(path, blob_dir):
+    """Move a freshly written file into the blob store, or link it to an existing identical blob
+
+    Returns the sha256 and whether the file was replaced by a link to an identical blob.
+    """
+    digest = hash_file(path)
+    blob = blob_path(blob_dir, digest)
+    if os.path.exists(blob):
+        if os.path.samefile(path, blob):
+            return digest, False
+        # Link to a temp name first so the output path is never missing
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            # No hard links across devices or on this filesystem; keep the private copy
+            return digest, False
+        os.replace(tmp_path, path)
+        return digest, True
+
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        # Another run stored the same content meanwhile
+        return store_file(path, blob_dir)
+    except OSError:
+        return digest, False
+    return digest, False
+
+@contextmanager
+def replacing(path):
+    """Temp path to write a new version of an output to; it replaces path once written
+
+    Output names may be hard links to a blob shared with other names, so they are replaced rather than
+    written in place. The temp name keeps the extension, which picks the codec or image format.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def store_outputs(paths, blob_dir):
+    """Store output files and directories of output files; returns the number of deduplicated files"""
+    deduplicated = 0
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(root, name) for root, dirs, names in os.walk(path) for name in sorted(names)]
+        else:
+            files = [path]
+        for file_path in files:
+            if os.path.abspath(file_path).startswith(os.path.abspath(blob_dir) + os.sep):
+                continue
+            _, existed = store_file(file_path, blob_dir)
+            deduplicated += existed
+    return deduplicated
+
+def collect_garbage(blob_dir):
+    """Remove blobs no output name links to any more; returns the bytes freed"""
+    freed = 0
+    for root, _, names in os.walk(blob_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            info = os.stat(path)
+            if info.st_nlink == 1:
+                os.remove(path)
+                freed += info.st_size
+    return freed
+
+def main():
+    """Deduplicate existing output directories"""
+    parser = argparse.ArgumentParser(description='Store identical output files once and hard-link their names to it')
+    parser.add_argument('paths', nargs='*', help='Output files or directories to deduplicate')
+    parser.add_argument('--blob-dir', type=str, required=True,
+                        help='Blob directory; must be on the same filesystem as the outputs')
+    parser.add_argument('--gc', action='store_true', help='Remove blobs whose outputs were all deleted')
+    args = parser.parse_args()
+
+    if args.paths:
+        deduplicated = store_outputs(args.paths, args.blob_dir)
+        print(f"{deduplicated} files linked to an identical stored blob")
+    if args.gc:
+        freed = collect_garbage(args.blob_dir)
+        print(f"Freed {freed / 1024 / 1024:.1f} MB of unreferenced blobs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Batch Bloom Filters
+
+Per-batch Bloom filters of affected from- and to-addresses, used to probe large address lists.
+"""
+
+import argparse
+import base64
+import math
+import os
+
+import numpy as np
+
+import address_dict
+import batch_cache
+import compression
+
+BLOOM_DIR = "bloom"
+# Sized for million-address probes: about 0.1 false candidates per filter, ~34 bits per key
+FALSE_POSITIVE_RATE = 1e-7
+
+# Cached sections that get a filter: section -> address field
+FILTERED_SECTIONS = {
+    'affected_addresses': 'from_address',
+    'to_addresses': 'to_address',
+}
+
+def mix64(x):
+    """SplitMix64 finalizer over a uint64 array"""
+    with np.errstate(over='ignore'):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+def address_hashes(addresses):
+    """Two 64-bit hashes per address, mixed from all 20 bytes (vanity and low addresses are not random)"""
+    keys = b''.join(bytes.fromhex(address[2:] if address.startswith('0x') else address) for address in addresses)
+    rows = np.frombuffer(keys, dtype=np.uint8).reshape(len(addresses), 20)
+    w0 = rows[:, 0:8].copy().view('<u8').ravel()
+    w1 = rows[:, 8:16].copy().view('<u8').ravel()
+    w2 = rows[:, 16:20].copy().view('<u4').ravel().astype(np.uint64)
+    h1 = mix64(w0 ^ mix64(w2))
+    h2 = mix64(w1 ^ mix64(w2 ^ np.uint64(0x9e3779b97f4a7c15))) | np.uint64(1)
+    return h1, h2
+
+def filter_size(count):
+    """Bit count and hash count for a filter holding count keys"""
+    count = max(count, 1)
+    bits = math.ceil(-count * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+    bits = (bits + 7) // 8 * 8
+    return bits, max(1, round(bits / count * math.log(2)))
+
+def bit_positions(h1, h2, i, bits):
+    """Bit positions of hash i (double hashing)"""
+    with np.errstate(over='ignore'):
+        return (h1 + np.uint64(i) * h2) % np.uint64(bits)
+
+def build_filter(addresses):
+    """Build a Bloom filter over hex addresses"""
+    bits, hashes = filter_size(len(addresses))
+    array = np.zeros(bits // 8, dtype=np.uint8)
+    h1, h2 = address_hashes(addresses)
+    for i in range(hashes):
+        positions = bit_positions(h1, h2, i, bits)
+        np.bitwise_or.at(array, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+    return {'bits': bits, 'hashes': hashes, 'array': array}
+
+def filter_candidates(bloom, h1, h2):
+    """Indexes of the probe hashes that may be in the filter"""
+    # One byte per bit; filters are small, and direct indexing beats shifting and masking
+    bitmap = np.unpackbits(bloom['array'], bitorder='little').view(bool)
+    candidates = np.arange(len(h1))
+    # Each round drops about half of the non-members, so later rounds touch few probes
+    for i in range(bloom['hashes']):
+        if not len(candidates):
+            break
+        if i == 0:
+            positions = bit_positions(h1, h2, i, bloom['bits'])
+        else:
+            positions = bit_positions(h1[candidates], h2[candidates], i, bloom['bits'])
+        candidates = candidates[bitmap[positions.astype(np.intp)]]
+    return candidates
+
+def filter_path(cache_dir, start_block, end_block, section):
+    """Path of the filter file for one cached section"""
+    return os.path.join(cache_dir, BLOOM_DIR, batch_cache.section_filename(start_block, end_block, section))
+
+def hex_addresses(cache_dir, values):
+    """Hex form of addresses that may be stored as dictionary ids"""
+    if values and not isinstance(values[0], str):
+        return address_dict.decode_column(address_dict.open_dictionary(cache_dir), values)
+    return [value.lower() for value in values]
+
+def write_filter(cache_dir, start_block, end_block, section, records, source_sha256):
+    """Build and store the filter of one cached section"""
+    field = FILTERED_SECTIONS[section]
+    bloom = build_filter(hex_addresses(cache_dir, [record[field] for record in records]))
+    path = filter_path(cache_dir, start_block, end_block, section)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    batch_cache.write_batch_file(os.path.dirname(path), os.path.basename(path), {
+        'start_block': start_block,
+        'end_block': end_block,
+        'source_section': section,
+        'source_sha256': source_sha256,
+        'bits': bloom['bits'],
+        'hashes': bloom['hashes'],
+        'array': base64.b64encode(bloom['array'].tobytes()).decode('ascii')
+    }, sections={})
+
+def filter_section(cache_dir, section, start_block, end_block, records, entry):
+    """Store the filter of a freshly written section; entry is its manifest entry"""
+    if section in FILTERED_SECTIONS and records is not None:
+        write_filter(cache_dir, start_block, end_block, section, records, entry['sha256'])
+
+def load_filter(cache_dir, start_block, end_block, section, source_sha256):
+    """Load a filter if it was built from the given section file content"""
+    path = filter_path(cache_dir, start_block, end_block, section)
+    if not os.path.exists(path):
+        return None
+    try:
+        bloom = batch_cache.read_cached(path, decode_filter)
+    except compression.DECODE_ERRORS:
+        return None
+    if bloom['source_sha256'] != source_sha256:
+        return None
+    batch_cache.note_access(os.path.dirname(path), os.path.basename(path))
+    return bloom
+
+def decode_filter(stored):
+    """Turn a stored filter into its bit array"""
+    return {
+        'source_sha256': stored['source_sha256'],
+        'bits': stored['bits'],
+        'hashes': stored['hashes'],
+        'array': np.frombuffer(base64.b64decode(stored['array']), dtype=np.uint8)
+    }
+
+def find_affected(cache_dir, addresses, start_block=None, end_block=None):
+    """Batches each probed address appeared in, per section, opening only batches whose filter matches"""
+    manifest = batch_cache.validate_cache(cache_dir)
+    ranges = batch_cache.range_index(manifest)
+    probes = [address.lower() for address in addresses]
+    h1, h2 = address_hashes(probes)
+
+    found = {section: {} for section in FILTERED_SECTIONS}
+    opened = 0
+    checked = 0
+    for batch_range in batch_cache.select_ranges(ranges, start_block, end_block):
+        for section, field in FILTERED_SECTIONS.items():
+            info = ranges[batch_range].get(section)
+            if info is None:
+                continue
+            checked += 1
+            bloom = load_filter(cache_dir, *batch_range, section, manifest['entries'][info['file']]['sha256'])
+            if bloom is not None:
+                candidates = filter_candidates(bloom, h1, h2)
+                if not len(candidates):
+                    continue
+            else:
+                candidates = np.arange(len(probes))
+
+            # Confirm candidates against the batch itself; Bloom filters give false positives
+            opened += 1
+            batch_data = batch_cache.load_batch(cache_dir, *batch_range, {section: info})
+            records = batch_data.get(section) or []
+            members = {}
+            for address, record in zip(hex_addresses(cache_dir, [record[field] for record in records]), records):
+                members[address] = members.get(address, 0) + int(record['transaction_count'])
+            for idx in candidates.tolist():
+                count = members.get(probes[idx])
+                if count is not None:
+                    found[section].setdefault(probes[idx], []).append((batch_range[0], count))
+
+    batch_cache.flush_access(cache_dir)
+    batch_cache.flush_access(os.path.join(cache_dir, BLOOM_DIR))
+    print(f"Probed {len(probes):,} addresses against {checked} cached sections, opened {opened}")
+    return found
+
+def rebuild_filters(cache_dir):
+    """Build filters for every cached section that lacks a current one"""
+    manifest = batch_cache.validate_cache(cache_dir)
+    ranges = batch_cache.range_index(manifest)
+    built = 0
+    for batch_range in batch_cache.select_ranges(ranges):
+        for section in FILTERED_SECTIONS:
+            info = ranges[batch_range].get(section)
+            if info is None:
+                continue
+            source_sha256 = manifest['entries'][info['file']]['sha256']
+            if load_filter(cache_dir, *batch_range, section, source_sha256) is not None:
+                continue
+            batch_data = batch_cache.load_batch(cache_dir, *batch_range, {section: info})
+            write_filter(cache_dir, *batch_range, section, batch_data.get(section) or [], source_sha256)
+            built += 1
+    print(f"Built {built} Bloom filters")
+    return built
+
+def main():
+    """Check which addresses in a list were affected"""
+    parser = argparse.ArgumentParser(description='Find which addresses of a list appear in the cached batches')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('address_file', nargs='?', help='File with one 0x-prefixed address per line')
+    parser.add_argument('--rebuild', action='store_true', help='Build missing filters for the cached batches first')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_filters(args.cache_dir)
+    if args.address_file:
+        with open(args.address_file, 'r') as f:
+            addresses = [line.strip() for line in f if line.strip()]
+        found = find_affected(args.cache_dir, addresses)
+        for section, hits in found.items():
+            print(f"{section}: {len(hits):,} of {len(addresses):,} addresses found")
+            for address, postings in sorted(hits.items()):
+                total = sum(count for _, count in postings)
+                print(f"  {address}: {total:,} transactions in {len(postings)} batches")
+
+if __name__ == "__main__":
+    main()
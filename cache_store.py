@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Batch Result Store
+
+Single-file SQLite store for the batch results of the gas cap and CDF analyses.
+"""
+
+import sqlite3
+import json
+import os
+import argparse
+
+import batch_cache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    batch_id INTEGER,
+    total_transactions INTEGER,
+    affected_transactions INTEGER,
+    high_gas_transactions INTEGER,
+    PRIMARY KEY (start_block, end_block)
+);
+
+CREATE TABLE IF NOT EXISTS affected_addresses (
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    from_address TEXT NOT NULL,
+    transaction_count INTEGER,
+    avg_gas_limit REAL,
+    max_gas_limit REAL,
+    total_excess_gas REAL,
+    avg_gas_price REAL,
+    PRIMARY KEY (start_block, end_block, from_address)
+);
+CREATE INDEX IF NOT EXISTS idx_affected_addresses_address ON affected_addresses (from_address);
+
+CREATE TABLE IF NOT EXISTS to_addresses (
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    to_address TEXT NOT NULL,
+    transaction_count INTEGER,
+    avg_gas_limit REAL,
+    max_gas_limit REAL,
+    PRIMARY KEY (start_block, end_block, to_address)
+);
+CREATE INDEX IF NOT EXISTS idx_to_addresses_address ON to_addresses (to_address);
+
+CREATE TABLE IF NOT EXISTS gas_efficiency (
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    total_overprovision INTEGER,
+    unnecessary_high_limit INTEGER,
+    avg_gas_limit REAL,
+    avg_gas_used REAL,
+    avg_gas_efficiency REAL,
+    min_gas_used INTEGER,
+    max_gas_used INTEGER,
+    PRIMARY KEY (start_block, end_block)
+);
+
+CREATE TABLE IF NOT EXISTS gas_distribution (
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    batch_id INTEGER,
+    gas_bucket INTEGER NOT NULL,
+    transaction_count INTEGER,
+    min_gas INTEGER,
+    max_gas INTEGER,
+    avg_gas REAL,
+    PRIMARY KEY (start_block, end_block, gas_bucket)
+);
+
+CREATE TABLE IF NOT EXISTS sources (
+    source_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    run_timestamp TEXT,
+    start_block INTEGER,
+    end_block INTEGER,
+    sha256 TEXT NOT NULL,
+    size INTEGER,
+    summary TEXT,
+    imported_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS provenance (
+    dataset TEXT NOT NULL,
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    source_id INTEGER NOT NULL,
+    PRIMARY KEY (dataset, start_block, end_block)
+);
+
+CREATE TABLE IF NOT EXISTS run_rows (
+    source_id INTEGER NOT NULL,
+    row_number INTEGER NOT NULL,
+    address TEXT,
+    transaction_count INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (source_id, row_number)
+);
+CREATE INDEX IF NOT EXISTS idx_run_rows_address ON run_rows (address);
+"""
+
+AFFECTED_COLUMNS = ['from_address', 'transaction_count', 'avg_gas_limit', 'max_gas_limit',
+                    'total_excess_gas', 'avg_gas_price']
+TO_ADDRESS_COLUMNS = ['to_address', 'transaction_count', 'avg_gas_limit', 'max_gas_limit']
+EFFICIENCY_COLUMNS = ['total_overprovision', 'unnecessary_high_limit', 'avg_gas_limit', 'avg_gas_used',
+                      'avg_gas_efficiency', 'min_gas_used', 'max_gas_used']
+# Batch sections kept in the store; the names double as provenance datasets
+BATCH_DATASETS = ('summary', 'affected_addresses', 'to_addresses', 'gas_efficiency')
+BATCH_TABLES = ('batches', 'affected_addresses', 'to_addresses', 'gas_efficiency')
+DISTRIBUTION_COLUMNS = ['gas_bucket', 'transaction_count', 'min_gas', 'max_gas', 'avg_gas']
+
+def open_store(path):
+    """Open (and create if needed) the store at path"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _range_filter(start_block, end_block):
+    """Build the WHERE clause selecting batches inside a block window"""
+    clauses = []
+    params = []
+    if start_block is not None:
+        clauses.append("start_block >= ?")
+        params.append(start_block)
+    if end_block is not None:
+        clauses.append("end_block <= ?")
+        params.append(end_block)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+def _selection_filter(conn, table, start_block=None, end_block=None):
+    """Build the JOIN weighting the stored ranges of table inside a block window so each block is summed once
+
+    Uses the same rule as the JSON cache (batch_cache.covering_ranges): a superseded open batch is left out,
+    ranges imported from an older batch grid are all kept, and the blocks two of them share are subtracted
+    through a weight of -1 where they are stored as a range of their own. Sums are weighted; maxima, minima
+    and batch counts only read the rows of weight 1.
+    """
+    where, params = _range_filter(start_block, end_block)
+    stored = {tuple(row) for row in conn.execute(f"SELECT DISTINCT start_block, end_block FROM {table} {where}", params)}
+    selected = batch_cache.covering_ranges(stored)
+    weights = [(*batch_range, 1) for batch_range in selected]
+    weights += [(*batch_range, -1) for batch_range in batch_cache.cached_overlaps(stored, selected)]
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS selected_ranges "
+                     "(start_block INTEGER, end_block INTEGER, weight INTEGER, PRIMARY KEY (start_block, end_block))")
+        conn.execute("DELETE FROM selected_ranges")
+        conn.executemany("INSERT INTO selected_ranges VALUES (?, ?, ?)", weights)
+    return "JOIN selected_ranges USING (start_block, end_block)", []
+
+def _delete_superseded(conn, tables, start_block, end_block, datasets):
+    """Delete the rows and provenance of shorter ranges with the same start, cached while the batch was open"""
+    for table in tables:
+        conn.execute(f"DELETE FROM {table} WHERE start_block = ? AND end_block < ?", (start_block, end_block))
+    conn.executemany("DELETE FROM provenance WHERE dataset = ? AND start_block = ? AND end_block < ?",
+                     [(dataset, start_block, end_block) for dataset in datasets])
+
+def _insert_records(conn, table, start_block, end_block, columns, records, extra=None):
+    """Insert records for one block range into table"""
+    extra = extra or {}
+    names = ['start_block', 'end_block'] + list(extra) + columns
+    placeholders = ", ".join("?" for _ in names)
+    rows = [
+        [start_block, end_block] + list(extra.values()) + [record.get(col) for col in columns]
+        for record in records
+    ]
+    conn.executemany(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({placeholders})", rows)
+
+def has_batch(conn, start_block, end_block):
+    """Check whether a batch range is already stored"""
+    row = conn.execute(
+        "SELECT 1 FROM batches WHERE start_block = ? AND end_block = ?",
+        (start_block, end_block)
+    ).fetchone()
+    return row is not None
+
+def write_batch(conn, batch_data):
+    """Store one gas cap batch, replacing any previous result for its range"""
+    start_block = batch_data['start_block']
+    end_block = batch_data['end_block']
+    summary = batch_data.get('summary') or {}
+
+    with conn:
+        for table in BATCH_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE start_block = ? AND end_block = ?",
+                         (start_block, end_block))
+        _delete_superseded(conn, BATCH_TABLES, start_block, end_block, BATCH_DATASETS)
+
+        conn.execute(
+            "INSERT INTO batches VALUES (?, ?, ?, ?, ?, ?)",
+            (start_block, end_block, batch_data.get('batch_id'),
+             summary.get('total_transactions', 0),
+             summary.get('affected_transactions', 0),
+             summary.get('high_gas_transactions', 0))
+        )
+        _insert_records(conn, 'affected_addresses', start_block, end_block,
+                        AFFECTED_COLUMNS, batch_data.get('affected_addresses', []))
+        _insert_records(conn, 'to_addresses', start_block, end_block,
+                        TO_ADDRESS_COLUMNS, batch_data.get('to_addresses', []))
+        if batch_data.get('gas_efficiency'):
+            _insert_records(conn, 'gas_efficiency', start_block, end_block,
+                            EFFICIENCY_COLUMNS, [batch_data['gas_efficiency']])
+
+def load_batch(conn, start_block, end_block):
+    """Load one gas cap batch in the same shape as a JSON cache file"""
+    row = conn.execute(
+        "SELECT * FROM batches WHERE start_block = ? AND end_block = ?",
+        (start_block, end_block)
+    ).fetchone()
+    if row is None:
+        return None
+
+    params = (start_block, end_block)
+    where = "WHERE start_block = ? AND end_block = ?"
+    efficiency = conn.execute(f"SELECT {', '.join(EFFICIENCY_COLUMNS)} FROM gas_efficiency {where}", params).fetchone()
+
+    return {
+        'batch_id': row['batch_id'],
+        'start_block': start_block,
+        'end_block': end_block,
+        'summary': {
+            'total_transactions': row['total_transactions'],
+            'affected_transactions': row['affected_transactions'],
+            'high_gas_transactions': row['high_gas_transactions']
+        },
+        'affected_addresses': [
+            dict(r) for r in conn.execute(f"SELECT {', '.join(AFFECTED_COLUMNS)} FROM affected_addresses {where}", params)
+        ],
+        'to_addresses': [
+            dict(r) for r in conn.execute(f"SELECT {', '.join(TO_ADDRESS_COLUMNS)} FROM to_addresses {where}", params)
+        ],
+        'gas_efficiency': dict(efficiency) if efficiency is not None else {}
+    }
+
+def list_batches(conn, start_block=None, end_block=None):
+    """List stored gas cap batch ranges ordered by block"""
+    where, params = _range_filter(start_block, end_block)
+    rows = conn.execute(f"SELECT start_block, end_block, batch_id FROM batches {where} ORDER BY start_block", params)
+    return [dict(r) for r in rows]
+
+def aggregate_summary(conn, start_block=None, end_block=None):
+    """Sum batch summaries over a block window"""
+    where, params = _selection_filter(conn, 'batches', start_block, end_block)
+    row = conn.execute(f"""
+        SELECT COALESCE(SUM(weight > 0), 0) AS batch_count,
+               COALESCE(SUM(total_transactions * weight), 0) AS total_transactions,
+               COALESCE(SUM(affected_transactions * weight), 0) AS total_affected,
+               COALESCE(SUM(high_gas_transactions * weight), 0) AS total_high_gas
+        FROM batches {where}
+    """, params).fetchone()
+    return dict(row)
+
+def aggregate_addresses(conn, start_block=None, end_block=None):
+    """Aggregate affected from-addresses over a block window in one grouped query"""
+    where, params = _selection_filter(conn, 'batches', start_block, end_block)
+    rows = conn.execute(f"""
+        SELECT from_address,
+               SUM(transaction_count * weight) AS transaction_count,
+               SUM(avg_gas_limit * transaction_count * weight) AS total_gas_limit,
+               MAX(max_gas_limit) AS max_gas_limit,
+               SUM(total_excess_gas * weight) AS total_excess_gas,
+               SUM(avg_gas_price * transaction_count * weight) AS total_gas_price,
+               SUM(weight > 0) AS batches_appeared
+        FROM affected_addresses {where}
+        GROUP BY from_address
+        HAVING SUM(transaction_count * weight) > 0
+    """, params)
+    return {r['from_address']: dict(r) for r in rows}
+
+def aggregate_to_addresses(conn, start_block=None, end_block=None):
+    """Aggregate affected to-addresses over a block window in one grouped query"""
+    where, params = _selection_filter(conn, 'batches', start_block, end_block)
+    rows = conn.execute(f"""
+        SELECT to_address,
+               SUM(transaction_count * weight) AS transaction_count,
+               SUM(avg_gas_limit * transaction_count * weight) AS total_gas_limit,
+               MAX(max_gas_limit) AS max_gas_limit
+        FROM to_addresses {where}
+        GROUP BY to_address
+        HAVING SUM(transaction_count * weight) > 0
+    """, params)
+    return {r['to_address']: dict(r) for r in rows}
+
+def aggregate_gas_efficiency(conn, start_block=None, end_block=None):
+    """Combine per-batch gas efficiency rows over a block window"""
+    where, params = _selection_filter(conn, 'batches', start_block, end_block)
+    where = f"{where} WHERE total_overprovision > 0"
+    row = conn.execute(f"""
+        SELECT COALESCE(SUM(total_overprovision * weight), 0) AS total_overprovision,
+               COALESCE(SUM(unnecessary_high_limit * weight), 0) AS unnecessary_high_limit,
+               COALESCE(SUM(avg_gas_limit * total_overprovision * weight), 0) AS sum_gas_limit,
+               COALESCE(SUM(avg_gas_used * total_overprovision * weight), 0) AS sum_gas_used,
+               COALESCE(SUM(total_overprovision * weight), 0) AS count,
+               MIN(min_gas_used) AS min_gas_used,
+               COALESCE(MAX(max_gas_used), 0) AS max_gas_used
+        FROM gas_efficiency {where}
+    """, params).fetchone()
+    stats = dict(row)
+    if stats['min_gas_used'] is None:
+        stats['min_gas_used'] = float('inf')
+    return stats
+
+def has_distribution_batch(conn, start_block, end_block):
+    """Check whether a gas distribution batch range is already stored"""
+    row = conn.execute(
+        "SELECT 1 FROM gas_distribution WHERE start_block = ? AND end_block = ? LIMIT 1",
+        (start_block, end_block)
+    ).fetchone()
+    return row is not None
+
+def write_distribution_batch(conn, batch_data):
+    """Store one gas limit distribution batch, replacing any previous result for its range"""
+    start_block = batch_data['start_block']
+    end_block = batch_data['end_block']
+
+    with conn:
+        conn.execute("DELETE FROM gas_distribution WHERE start_block = ? AND end_block = ?",
+                     (start_block, end_block))
+        _delete_superseded(conn, ['gas_distribution'], start_block, end_block, ['distribution'])
+        _insert_records(conn, 'gas_distribution', start_block, end_block,
+                        DISTRIBUTION_COLUMNS, batch_data.get('distribution', []),
+                        extra={'batch_id': batch_data.get('batch_id')})
+
+def aggregate_distribution(conn, start_block=None, end_block=None):
+    """Aggregate gas limit buckets over a block window"""
+    where, params = _selection_filter(conn, 'gas_distribution', start_block, end_block)
+    rows = conn.execute(f"""
+        SELECT gas_bucket,
+               SUM(transaction_count * weight) AS count,
+               MIN(min_gas) AS min_gas,
+               MAX(max_gas) AS max_gas,
+               SUM(avg_gas * transaction_count * weight) AS sum_gas
+        FROM gas_distribution {where}
+        GROUP BY gas_bucket
+        HAVING SUM(transaction_count * weight) > 0
+        ORDER BY gas_bucket
+    """, params)
+    return {r['gas_bucket']: dict(r) for r in rows}
+
+def source_imported(conn, path, sha256):
+    """Check whether a file was already imported with the same content"""
+    row = conn.execute("SELECT sha256 FROM sources WHERE path = ?", (path,)).fetchone()
+    return row is not None and row['sha256'] == sha256
+
+def record_source(conn, path, kind, sha256, size, run_timestamp=None, start_block=None, end_block=None,
+                  summary=None, rows=None):
+    """Record an imported file, replacing its previous import, with optional per-row records"""
+    with conn:
+        previous = conn.execute("SELECT source_id FROM sources WHERE path = ?", (path,)).fetchone()
+        if previous is not None:
+            conn.execute("DELETE FROM run_rows WHERE source_id = ?", (previous['source_id'],))
+            conn.execute("DELETE FROM sources WHERE source_id = ?", (previous['source_id'],))
+
+        cursor = conn.execute(
+            "INSERT INTO sources (path, kind, run_timestamp, start_block, end_block, sha256, size, summary, imported_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+            (path, kind, run_timestamp, start_block, end_block, sha256, size,
+             json.dumps(summary) if summary is not None else None)
+        )
+        source_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT INTO run_rows (source_id, row_number, address, transaction_count, data) VALUES (?, ?, ?, ?, ?)",
+            [(source_id, i, row.get('address'), row.get('transaction_count'), json.dumps(row['data']))
+             for i, row in enumerate(rows or [])]
+        )
+    return source_id
+
+def record_provenance(conn, datasets, start_block, end_block, source_id):
+    """Point the stored datasets of a block range at the file they were imported from"""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO provenance (dataset, start_block, end_block, source_id) VALUES (?, ?, ?, ?)",
+            [(dataset, start_block, end_block, source_id) for dataset in datasets]
+        )
+
+def list_sources(conn, kind=None):
+    """List imported files, oldest run first"""
+    where, params = ("WHERE kind = ?", [kind]) if kind else ("", [])
+    rows = conn.execute(f"""
+        SELECT source_id, path, kind, run_timestamp, start_block, end_block, sha256, size, imported_at
+        FROM sources {where}
+        ORDER BY run_timestamp, path
+    """, params)
+    return [dict(r) for r in rows]
+
+def import_cache_dir(conn, cache_dir):
+    """Import the batch files of a cache directory into the store"""
+    import importer
+    return importer.import_paths(conn, [cache_dir])
+
+def main():
+    """Import existing caches and archived outputs into a store"""
+    import importer
+    importer.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Compressed File I/O
+
+Transparent zstd, LZ4 and gzip compression selected by file extension.
+"""
+
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODEC_SUFFIXES = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+}
+ZSTD_LEVEL = 10
+# Raised when decoding a truncated or corrupt file; gzip raises OSError or EOFError and LZ4 RuntimeError
+DECODE_ERRORS = (ValueError, EOFError, OSError, RuntimeError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+def available_codecs():
+    """Codecs usable with the installed packages"""
+    codecs = ['none', 'gzip']
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4 is not None:
+        codecs.append('lz4')
+    return codecs
+
+def default_codec():
+    """Best codec available for cache files"""
+    if zstandard is not None:
+        return 'zstd'
+    if lz4 is not None:
+        return 'lz4'
+    return 'gzip'
+
+def codec_for_path(path):
+    """Infer the codec of a file from its extension"""
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return codec
+    return 'none'
+
+def strip_suffix(path):
+    """Remove a compression extension from a path"""
+    suffix = CODEC_SUFFIXES[codec_for_path(path)]
+    return path[:-len(suffix)] if suffix else path
+
+def _require(codec):
+    """Fail clearly when a codec's package is missing"""
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("zstd compression requires the 'zstandard' package")
+    if codec == 'lz4' and lz4 is None:
+        raise ImportError("LZ4 compression requires the 'lz4' package")
+
+def compress_bytes(data, codec):
+    """Compress a whole buffer"""
+    _require(codec)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == 'lz4':
+        return lz4.frame.compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data, mtime=0)
+    return data
+
+def decompress_bytes(data, codec):
+    """Decompress a whole buffer"""
+    _require(codec)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if codec == 'lz4':
+        return lz4.frame.decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    return data
+
+def open_text(path, mode='r', newline=None):
+    """Open a possibly compressed text file; reads decode as a stream"""
+    codec = codec_for_path(path)
+    _require(codec)
+    if codec == 'zstd':
+        return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL),
+                              encoding='utf-8', newline=newline)
+    if codec == 'lz4':
+        return lz4.frame.open(path, mode + 't', encoding='utf-8', newline=newline)
+    if codec == 'gzip':
+        if mode == 'r':
+            return gzip.open(path, 'rt', encoding='utf-8', newline=newline)
+        # No file name or time in the header, so equal content compresses to equal bytes
+        raw = open(path, mode + 'b')
+        stream = gzip.GzipFile(filename='', mode=mode + 'b', fileobj=raw, mtime=0)
+        stream.myfileobj = raw
+        return io.TextIOWrapper(stream, encoding='utf-8', newline=newline)
+    return open(path, mode, encoding='utf-8', newline=newline)
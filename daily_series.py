@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Daily Time Series
+
+Dense per-day impact metrics of the batch cache, for rolling statistics and trend charts.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import batch_cache
+import distinct_counts
+
+SERIES_FILE = "daily_series.npz"
+SECTION = 'daily_summary'
+SKETCH_SECTION = 'daily_sketches'
+# Days are 7200-block spans (12-second slots), so batches split across days by block number alone
+BLOCKS_PER_DAY = 7200
+ROLLING_WINDOWS = (7, 30)
+
+# Summed per day over the batches that cover it; additional_gas_cost is costed per sender within each batch
+FIELDS = ('total_transactions', 'affected_transactions', 'total_excess_gas', 'additional_gas_cost')
+
+def section_rows(cache_dir, ranges, batch_ranges):
+    """Daily rows and register rows of some cached batches"""
+    rows = []
+    sketch_rows = []
+    for batch_range in batch_ranges:
+        cached = {section: ranges[batch_range][section] for section in (SECTION, SKETCH_SECTION)
+                  if section in ranges[batch_range]}
+        if SECTION in cached:
+            batch_data = batch_cache.load_batch(cache_dir, *batch_range, cached)
+            rows.extend(batch_data.get(SECTION) or [])
+            sketch_rows.extend(batch_data.get(SKETCH_SECTION) or [])
+    return rows, sketch_rows
+
+def build_daily_series(cache_dir, rebuild=False):
+    """Extend the daily arrays with the daily sections of batches cached since the last build
+
+    The totals of a superseded batch are subtracted before its replacement is added; its registers are
+    covered by the replacement's. Everything is reread when asked, or when a batch left the cache otherwise.
+    """
+    manifest = batch_cache.validate_cache(cache_dir)
+    ranges = batch_cache.range_index(manifest)
+    members = batch_cache.cached_members(manifest, ranges, (SECTION, SKETCH_SECTION))
+    previous = None if rebuild else load_daily_series(cache_dir)
+    added, removed, extend = batch_cache.extension_plan(previous and previous['members'], members)
+    # Superseded batches are read back to subtract them, so they must still be cached as they were
+    if extend and any(batch_cache.range_fingerprint(manifest, ranges, batch_range, (SECTION, SKETCH_SECTION))
+                      != previous['members'][batch_range] for batch_range in removed):
+        added, removed, extend = batch_cache.extension_plan(None, members)
+    if not extend:
+        previous = None
+    elif not added and not removed:
+        return previous
+
+    rows, sketch_rows = section_rows(cache_dir, ranges, added)
+    retracted, _ = section_rows(cache_dir, ranges, removed)
+    batch_cache.flush_access(cache_dir)
+
+    if not rows and previous is None:
+        return None
+
+    days = np.array([int(row['day']) for row in rows], dtype=np.int64)
+    retracted_days = np.array([int(row['day']) for row in retracted], dtype=np.int64)
+    if previous is not None:
+        counts = np.diff(previous['cumulative'], axis=0)
+        registers = previous['registers']
+        first = previous['first_day']
+    else:
+        counts = np.zeros((0, len(FIELDS)), dtype=np.int64)
+        registers = np.zeros((0, distinct_counts.REGISTERS), dtype=np.uint8)
+        first = int(days.min())
+    touched = np.concatenate((days, retracted_days))
+    if len(touched):
+        # Grow the dense arrays to the days of the new rows
+        lo = min(first, int(touched.min()))
+        hi = max(first + len(counts), int(touched.max()) + 1)
+        padding = ((first - lo, hi - first - len(counts)), (0, 0))
+        counts = np.pad(counts, padding)
+        registers = np.pad(registers, padding)
+        first = lo
+    for column, field in enumerate(FIELDS):
+        # Accumulation, not assignment: a day is split across the batches that cover it
+        np.add.at(counts[:, column], days - first, [int(row[field]) for row in rows])
+        np.subtract.at(counts[:, column], retracted_days - first, [int(row[field]) for row in retracted])
+
+    cumulative = np.zeros((len(counts) + 1, len(FIELDS)), dtype=np.int64)
+    np.cumsum(counts, axis=0, out=cumulative[1:])
+
+    sketch_rows = [row for row in sketch_rows if first <= int(row['day']) < first + len(counts)]
+    if sketch_rows:
+        np.maximum.at(registers,
+                      (np.array([int(row['day']) - first for row in sketch_rows], dtype=np.intp),
+                       np.array([int(row['register']) for row in sketch_rows], dtype=np.intp)),
+                      np.array([int(row['rank']) for row in sketch_rows], dtype=np.uint8))
+    member_ranges, member_fingerprints = batch_cache.members_to_arrays(members)
+
+    path = os.path.join(cache_dir, SERIES_FILE)
+    batch_cache.atomic_savez(path, first_day=np.int64(first), cumulative=cumulative, registers=registers,
+                             member_ranges=member_ranges, member_fingerprints=member_fingerprints)
+
+    print(f"Daily series {'updated' if previous is not None else 'rebuilt'} from {len(added)} batches: "
+          f"{len(counts):,} days from block {first * BLOCKS_PER_DAY:,}")
+    return {'first_day': first, 'cumulative': cumulative, 'registers': registers, 'members': members}
+
+def load_daily_series(cache_dir):
+    """Load the persisted daily arrays, or None if they were never built"""
+    path = os.path.join(cache_dir, SERIES_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        members = batch_cache.stored_members(data)
+        return {'first_day': int(data['first_day']), 'cumulative': data['cumulative'],
+                'registers': data['registers'], 'members': members}
+
+def day_range(series, start_block=None, end_block=None):
+    """Indexes of the first and past-the-last day of the series inside a block window"""
+    days = len(series['cumulative']) - 1
+    lo = 0 if start_block is None else min(max(start_block // BLOCKS_PER_DAY - series['first_day'], 0), days)
+    hi = days if end_block is None else min(max(-(-end_block // BLOCKS_PER_DAY) - series['first_day'], lo), days)
+    return lo, hi
+
+def daily_values(series, lo, hi):
+    """Per-day totals of days lo to hi, one column per field"""
+    return np.diff(series['cumulative'][lo:hi + 1], axis=0)
+
+def rolling_sums(series, lo, hi, window):
+    """Trailing window totals ending on each day lo to hi, one prefix difference per day"""
+    cumulative = series['cumulative']
+    ends = np.arange(lo + 1, hi + 1)
+    return cumulative[ends] - cumulative[np.maximum(ends - window, 0)]
+
+def rolling_unique(series, lo, hi, window):
+    """Estimated distinct affected senders over the trailing window ending on each day lo to hi"""
+    registers = series['registers']
+    return np.array([
+        distinct_counts.estimate_distinct(registers[max(day - window + 1, 0):day + 1].max(axis=0))
+        for day in range(lo, hi)
+    ])
+
+def trends(series, start_block=None, end_block=None):
+    """Daily and rolling affected-transaction trends of a block window, as lists"""
+    lo, hi = day_range(series, start_block, end_block)
+    affected = FIELDS.index('affected_transactions')
+    trend = {
+        'first_block': [(series['first_day'] + day) * BLOCKS_PER_DAY for day in range(lo, hi)],
+        'affected_transactions': daily_values(series, lo, hi)[:, affected].tolist(),
+        'unique_senders': rolling_unique(series, lo, hi, 1).tolist(),
+    }
+    # The first days of the series average over the days available so far
+    covered = np.arange(lo + 1, hi + 1)
+    for window in ROLLING_WINDOWS:
+        trend[f'affected_{window}d_average'] = (
+            rolling_sums(series, lo, hi, window)[:, affected] / np.minimum(covered, window)).tolist()
+    return trend
+
+def main():
+    """Print daily and rolling totals for the last days of the cache"""
+    parser = argparse.ArgumentParser(description='Daily impact metrics and rolling totals of a batch cache')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--days', type=int, default=30, help='Number of most recent days to print')
+    parser.add_argument('--window', type=int, default=7, help='Rolling window in days')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the daily arrays from the cache first')
+    args = parser.parse_args()
+
+    series = build_daily_series(args.cache_dir, rebuild=True) if args.rebuild else load_daily_series(args.cache_dir)
+    if series is None:
+        print("No daily summaries cached; run the analysis or pass --rebuild")
+        return
+
+    hi = len(series['cumulative']) - 1
+    lo = max(hi - args.days, 0)
+    values = daily_values(series, lo, hi)
+    rolling = rolling_sums(series, lo, hi, args.window)
+    unique = rolling_unique(series, lo, hi, args.window)
+    print(f"{'Day start block':>16} {'Transactions':>14} {'Affected':>10} {'Excess gas':>18} "
+          f"{f'Affected {args.window}d':>14} {f'Senders {args.window}d':>12}")
+    for i, day in enumerate(range(lo, hi)):
+        row = dict(zip(FIELDS, values[i]))
+        print(f"{(series['first_day'] + day) * BLOCKS_PER_DAY:>16,} {row['total_transactions']:>14,} "
+              f"{row['affected_transactions']:>10,} {row['total_excess_gas']:>18,} "
+              f"{rolling[i, FIELDS.index('affected_transactions')]:>14,} {unique[i]:>12,.0f}")
+
+if __name__ == "__main__":
+    main()
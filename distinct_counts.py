@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Distinct Address Counts
+
+HyperLogLog registers per cached batch for affected senders, affected recipients and high-gas senders.
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+import batch_cache
+
+SECTION = 'distinct_sketches'
+# 2**14 registers: about 0.8% standard error at 16 KB per merged sketch
+HLL_PRECISION = 14
+REGISTERS = 1 << HLL_PRECISION
+# Register maxima are computed by the query: the low HLL_PRECISION bits of a 64-bit hash pick the
+# register, and the trailing zeros of the remaining bits plus one give the rank
+HASH_BITS = 64
+
+SKETCHES = ('affected_senders', 'affected_recipients', 'high_gas_senders')
+
+def empty_registers():
+    """Registers of an empty set"""
+    return np.zeros(REGISTERS, dtype=np.uint8)
+
+def section_registers(records):
+    """Dense registers per sketch from the sparse (sketch, register, rank) rows of one batch"""
+    registers = {name: empty_registers() for name in SKETCHES}
+    for name in SKETCHES:
+        rows = [record for record in records if record['sketch'] == name]
+        if rows:
+            np.maximum.at(registers[name], np.array([int(row['register']) for row in rows], dtype=np.intp),
+                          np.array([int(row['rank']) for row in rows], dtype=np.uint8))
+    return registers
+
+def merge_registers(registers, other):
+    """Union of two sketches; associative, commutative and idempotent"""
+    return np.maximum(registers, other)
+
+def estimate_distinct(registers):
+    """Estimated number of distinct keys behind a set of registers"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * m and zeros:
+        # Linear counting is more accurate while many registers are still empty
+        return m * math.log(m / zeros)
+    return float(raw)
+
+def standard_error():
+    """Relative standard error of an estimate"""
+    return 1.04 / math.sqrt(REGISTERS)
+
+def window_registers(cache_dir, start_block=None, end_block=None):
+    """Merged registers per sketch of the batches starting inside a block window
+
+    Returns the registers and the number of selected batches without cached sketches.
+    """
+    ranges = batch_cache.range_index(batch_cache.validate_cache(cache_dir))
+    merged = {name: empty_registers() for name in SKETCHES}
+    missing = 0
+    for batch_range in batch_cache.select_ranges(ranges, start_block, end_block):
+        info = ranges[batch_range].get(SECTION)
+        if info is None:
+            missing += 1
+            continue
+        batch_data = batch_cache.load_batch(cache_dir, *batch_range, {SECTION: info})
+        for name, registers in section_registers(batch_data.get(SECTION) or []).items():
+            merged[name] = merge_registers(merged[name], registers)
+    batch_cache.flush_access(cache_dir)
+    return merged, missing
+
+def window_estimates(cache_dir, start_block=None, end_block=None):
+    """Estimated distinct counts per sketch of a block window, or None if a selected batch has no sketches"""
+    merged, missing = window_registers(cache_dir, start_block, end_block)
+    if missing:
+        return None
+    return {name: estimate_distinct(registers) for name, registers in merged.items()}
+
+def main():
+    """Print distinct address estimates for a block window"""
+    parser = argparse.ArgumentParser(description='Distinct address counts of the cached batches from HyperLogLog sketches')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--start', type=int, default=None, help='First block (default: start of the cache)')
+    parser.add_argument('--end', type=int, default=None, help='End block, exclusive (default: end of the cache)')
+    args = parser.parse_args()
+
+    merged, missing = window_registers(args.cache_dir, args.start, args.end)
+    if missing:
+        print(f"{missing} batches have no cached sketches; their addresses are not counted")
+    for name, registers in merged.items():
+        print(f"{name}: ~{estimate_distinct(registers):,.0f} (±{standard_error():.1%})")
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,9 @@ import json
 import os
 import argparse
 from datetime import datetime
+import cache_store
+import batch_cache
+import compression
 
 # Configuration
 PROPOSED_GAS_CAP = 16_777_216  # 2^24
@@ -24,10 +27,23 @@ BATCH_SIZE_PARTITIONS = 20
 parser = argparse.ArgumentParser(description='Generate gas limit CDF data')
 parser.add_argument('-o', '--output', type=str, default='outputs', 
                     help='Output directory (default: outputs)')
+parser.add_argument('-s', '--store', type=str, default=None,
+                    help='Keep batch results in a single-file SQLite store instead of JSON cache files')
+parser.add_argument('--verify-cache', action='store_true',
+                    help='Verify cache file checksums on startup instead of only sizes')
+parser.add_argument('--cache-compression', choices=compression.available_codecs(),
+                    default=compression.default_codec(),
+                    help=f'Compression for new cache files (default: {compression.default_codec()})')
+parser.add_argument('--cache-budget', type=str, default=None,
+                    help='Evict least recently used cache files beyond this size after the run (e.g. 2GB)')
 args = parser.parse_args()
 
 OUTPUT_DIR = args.output
 CACHE_DIR = os.path.join(OUTPUT_DIR, "cdf_analysis/cache")
+STORE_PATH = args.store
+VERIFY_CACHE = args.verify_cache
+CACHE_COMPRESSION = args.cache_compression
+CACHE_BUDGET = batch_cache.parse_size(args.cache_budget) if args.cache_budget else None
 
 def initialize_xatu():
     """Initialize the PyXatu client"""
@@ -55,10 +71,15 @@ def get_latest_block(xatu):
     
     return 22678052
 
-def process_gas_distribution_batch(xatu, start_block, end_block, batch_id):
-    """Process a batch to get gas limit distribution"""
+def partition_range(start_block, end_block):
+    """Align a block range to partition boundaries"""
     start_partition = (start_block // PARTITION_SIZE) * PARTITION_SIZE
     end_partition = ((end_block - 1) // PARTITION_SIZE + 1) * PARTITION_SIZE
+    return start_partition, end_partition
+
+def process_gas_distribution_batch(xatu, start_block, end_block, batch_id, store=None):
+    """Process a batch to get gas limit distribution"""
+    start_partition, end_partition = partition_range(start_block, end_block)
     
     print(f"\nProcessing batch {batch_id}: blocks {start_partition:,} to {end_partition:,}")
     
@@ -103,16 +124,17 @@ def process_gas_distribution_batch(xatu, start_block, end_block, batch_id):
             print(f"  Found {len(result)} gas buckets with {result['transaction_count'].sum():,} transactions")
             
             # Save to cache
-            cache_file = os.path.join(CACHE_DIR, f"batch_{batch_id:05d}.json")
-            result_dict = result.to_dict('records')
+            batch_data = {
+                'batch_id': batch_id,
+                'start_block': start_partition,
+                'end_block': end_partition,
+                'distribution': result.to_dict('records')
+            }
             
-            with open(cache_file, 'w') as f:
-                json.dump({
-                    'batch_id': batch_id,
-                    'start_block': start_partition,
-                    'end_block': end_partition,
-                    'distribution': result_dict
-                }, f)
+            if store is not None:
+                cache_store.write_distribution_batch(store, batch_data)
+            else:
+                batch_cache.write_batch_file(CACHE_DIR, f"batch_{batch_id:05d}.json", batch_data, CACHE_COMPRESSION)
             
             return result
         else:
@@ -123,20 +145,24 @@ def process_gas_distribution_batch(xatu, start_block, end_block, batch_id):
         print(f"  Error getting distribution: {e}")
         return None
 
-def aggregate_distributions():
+def aggregate_distributions(store=None):
     """Aggregate all batch distributions"""
     print("\nAggregating distribution data...")
     
     # Initialize buckets
     bucket_totals = {}
     
-    # Process each batch file
-    batch_files = sorted([f for f in os.listdir(CACHE_DIR) if f.startswith('batch_')])
-    print(f"Found {len(batch_files)} batch files to aggregate")
+    if store is not None:
+        bucket_totals = cache_store.aggregate_distribution(store)
+        batch_files = []
+    else:
+        # Process each batch file
+        batch_files = batch_cache.list_batch_files(batch_cache.validate_cache(CACHE_DIR))
+        print(f"Found {len(batch_files)} batch files to aggregate")
     
     for batch_file in batch_files:
-        with open(os.path.join(CACHE_DIR, batch_file), 'r') as f:
-            batch_data = json.load(f)
+        batch_data = batch_cache.read_cached(os.path.join(CACHE_DIR, batch_file))
+        batch_cache.note_access(CACHE_DIR, batch_file)
         
         for item in batch_data.get('distribution', []):
             bucket = item['gas_bucket']
@@ -153,6 +179,8 @@ def aggregate_distributions():
             bucket_totals[bucket]['max_gas'] = max(bucket_totals[bucket]['max_gas'], item['max_gas'])
             bucket_totals[bucket]['sum_gas'] += item['avg_gas'] * item['transaction_count']
     
+    batch_cache.flush_access(CACHE_DIR)
+    
     # Convert to sorted list
     distribution_data = []
     for bucket, data in sorted(bucket_totals.items()):
@@ -259,6 +287,8 @@ def main():
     """Main function"""
     try:
         ensure_cache_dir()
+        store = cache_store.open_store(STORE_PATH) if STORE_PATH else None
+        manifest = batch_cache.validate_cache(CACHE_DIR, verify_checksums=VERIFY_CACHE)
         print("Initializing PyXatu client...")
         xatu = initialize_xatu()
         
@@ -285,20 +315,23 @@ def main():
             batch_end = min(batch_start + batch_size, latest_block)
             
             # Check if already processed
-            cache_file = os.path.join(CACHE_DIR, f"batch_{batch_id:05d}.json")
-            if os.path.exists(cache_file):
+            if store is not None:
+                already_processed = cache_store.has_distribution_batch(store, *partition_range(batch_start, batch_end))
+            else:
+                already_processed = batch_cache.find_batch_file(manifest, f"batch_{batch_id:05d}.json") is not None
+            if already_processed:
                 print(f"\nBatch {batch_id} already processed, skipping...")
                 continue
             
             # Process batch
-            process_gas_distribution_batch(xatu, batch_start, batch_end, batch_id)
+            process_gas_distribution_batch(xatu, batch_start, batch_end, batch_id, store)
             
             # Progress
             progress = (batch_id + 1) / num_batches * 100
             print(f"Progress: {progress:.1f}%")
         
         # Aggregate results
-        distribution_data = aggregate_distributions()
+        distribution_data = aggregate_distributions(store)
         
         # Calculate CDF
         print("\nCalculating CDF...")
@@ -317,6 +350,9 @@ def main():
         print(f"  {cap_percentage:.2f}% of transactions have gas limit ≤ {PROPOSED_GAS_CAP:,}")
         print(f"  {100 - cap_percentage:.2f}% of transactions would be affected")
         
+        if CACHE_BUDGET is not None and store is None:
+            batch_cache.enforce_budget(CACHE_DIR, CACHE_BUDGET, partition_range(start_block, latest_block))
+        
         print("\nAnalysis completed successfully!")
         
     except Exception as e:
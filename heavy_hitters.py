@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Heavy-Hitter Sketches
+
+Per-batch Misra-Gries summaries of transaction counts by sender and recipient, merged into bounded-memory top lists.
+They answer top-list queries over any window without aggregating it; the report, which aggregates its window
+exactly anyway, lists exact counts instead.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import address_dict
+import batch_cache
+import compression
+
+SKETCH_DIR = "heavy_hitters"
+# Counters per summary; a merged count is at most total / (capacity + 1) below the true count
+SKETCH_CAPACITY = 1024
+
+# Cached sections that get a summary: section -> address field
+SKETCHED_SECTIONS = {
+    'affected_addresses': 'from_address',
+    'to_addresses': 'to_address',
+}
+
+def empty_sketch(capacity=SKETCH_CAPACITY):
+    """Summary of no transactions"""
+    return {'capacity': capacity, 'total': 0, 'error': 0,
+            'keys': np.zeros(0, dtype='U42'), 'counts': np.zeros(0, dtype=np.int64)}
+
+def trim_sketch(keys, counts, capacity):
+    """Reduce weighted keys to at most capacity counters
+
+    Returns the kept keys and counts, sorted by count descending, and the amount subtracted from each counter.
+    """
+    keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+    decrement = 0
+    if len(keys) > capacity:
+        # Subtract the (capacity + 1)-th largest count; at most capacity counters stay positive
+        decrement = int(np.partition(counts, len(counts) - capacity - 1)[len(counts) - capacity - 1])
+        counts = counts - decrement
+        keys, counts = keys[counts > 0], counts[counts > 0]
+    order = np.argsort(-counts, kind='stable')
+    return keys[order], counts[order], decrement
+
+def build_sketch(keys, counts, capacity=SKETCH_CAPACITY):
+    """Summary of hex addresses weighted by transaction counts"""
+    keys = np.array([key.lower() for key in keys], dtype='U42')
+    counts = np.asarray(counts, dtype=np.int64)
+    kept, kept_counts, decrement = trim_sketch(keys, counts, capacity)
+    return {'capacity': capacity, 'total': int(counts.sum()), 'error': decrement,
+            'keys': kept, 'counts': kept_counts}
+
+def merge_sketches(sketch, other):
+    """Merge two summaries; associative and commutative, with the error bounds adding up"""
+    capacity = min(sketch['capacity'], other['capacity'])
+    keys, counts, decrement = trim_sketch(np.concatenate((sketch['keys'], other['keys'])),
+                                          np.concatenate((sketch['counts'], other['counts'])), capacity)
+    return {'capacity': capacity, 'total': sketch['total'] + other['total'],
+            'error': sketch['error'] + other['error'] + decrement, 'keys': keys, 'counts': counts}
+
+def top_entries(sketch, top):
+    """The top keys of a summary with count bounds; guaranteed when no key outside the list can outrank it"""
+    # Any key not listed has a true count of at most the error
+    cutoff = max(int(sketch['counts'][top]) if len(sketch['counts']) > top else 0, 0) + sketch['error']
+    return [
+        {'address': key, 'lower_bound': int(count), 'upper_bound': int(count) + sketch['error'],
+         'guaranteed': int(count) > cutoff}
+        for key, count in zip(sketch['keys'][:top].tolist(), sketch['counts'][:top].tolist())
+    ]
+
+def sketch_path(cache_dir, start_block, end_block, section):
+    """Path of the summary file for one cached section"""
+    return os.path.join(cache_dir, SKETCH_DIR, batch_cache.section_filename(start_block, end_block, section))
+
+def section_sketch(cache_dir, section, records):
+    """Summary of the records of one cached section"""
+    field = SKETCHED_SECTIONS[section]
+    values = [record[field] for record in records]
+    if values and not isinstance(values[0], str):
+        values = address_dict.decode_column(address_dict.open_dictionary(cache_dir), values)
+    return build_sketch(values, [int(record['transaction_count']) for record in records])
+
+def write_sketch(cache_dir, start_block, end_block, section, records, source_sha256):
+    """Build and store the summary of one cached section"""
+    sketch = section_sketch(cache_dir, section, records)
+    path = sketch_path(cache_dir, start_block, end_block, section)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    batch_cache.write_batch_file(os.path.dirname(path), os.path.basename(path), {
+        'start_block': start_block,
+        'end_block': end_block,
+        'source_section': section,
+        'source_sha256': source_sha256,
+        'capacity': sketch['capacity'],
+        'total': sketch['total'],
+        'error': sketch['error'],
+        'keys': sketch['keys'].tolist(),
+        'counts': sketch['counts'].tolist()
+    }, sections={})
+    return sketch
+
+def sketch_section(cache_dir, section, start_block, end_block, records, entry):
+    """Store the summary of a freshly written section; entry is its manifest entry"""
+    if section in SKETCHED_SECTIONS and records is not None:
+        write_sketch(cache_dir, start_block, end_block, section, records, entry['sha256'])
+
+def load_sketch(cache_dir, start_block, end_block, section, source_sha256):
+    """Load a summary if it was built from the given section file content"""
+    path = sketch_path(cache_dir, start_block, end_block, section)
+    if not os.path.exists(path):
+        return None
+    try:
+        sketch = batch_cache.read_cached(path, decode_sketch)
+    except compression.DECODE_ERRORS:
+        return None
+    if sketch['source_sha256'] != source_sha256:
+        return None
+    batch_cache.note_access(os.path.dirname(path), os.path.basename(path))
+    return sketch
+
+def decode_sketch(stored):
+    """Turn a stored summary into its arrays"""
+    return {
+        'source_sha256': stored['source_sha256'],
+        'capacity': stored['capacity'],
+        'total': stored['total'],
+        'error': stored['error'],
+        'keys': np.array(stored['keys'], dtype='U42'),
+        'counts': np.array(stored['counts'], dtype=np.int64)
+    }
+
+def window_sketches(cache_dir, start_block=None, end_block=None, capacity=SKETCH_CAPACITY):
+    """Merged summary per section of the batches starting inside a block window
+
+    Sections without a current summary are summarized from the batch and the summary is stored.
+    """
+    manifest = batch_cache.validate_cache(cache_dir)
+    ranges = batch_cache.range_index(manifest)
+    merged = {section: empty_sketch(capacity) for section in SKETCHED_SECTIONS}
+    built = 0
+    for batch_range in batch_cache.select_ranges(ranges, start_block, end_block):
+        for section in SKETCHED_SECTIONS:
+            info = ranges[batch_range].get(section)
+            if info is None:
+                continue
+            source_sha256 = manifest['entries'][info['file']]['sha256']
+            sketch = load_sketch(cache_dir, *batch_range, section, source_sha256)
+            if sketch is None:
+                batch_data = batch_cache.load_batch(cache_dir, *batch_range, {section: info})
+                sketch = write_sketch(cache_dir, *batch_range, section, batch_data.get(section) or [], source_sha256)
+                built += 1
+            merged[section] = merge_sketches(merged[section], sketch)
+
+    batch_cache.flush_access(cache_dir)
+    batch_cache.flush_access(os.path.join(cache_dir, SKETCH_DIR))
+    if built:
+        print(f"Built {built} heavy-hitter summaries")
+    return merged
+
+def main():
+    """Print the top senders and recipients of a block window"""
+    parser = argparse.ArgumentParser(description='Bounded-memory top senders and recipients of the cached batches')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--top', type=int, default=50, help='Number of addresses to list per section')
+    parser.add_argument('--start', type=int, default=None, help='First block (default: start of the cache)')
+    parser.add_argument('--end', type=int, default=None, help='End block, exclusive (default: end of the cache)')
+    parser.add_argument('--capacity', type=int, default=SKETCH_CAPACITY,
+                        help='Counters kept per merged summary; must not exceed the stored summaries\' capacity')
+    args = parser.parse_args()
+
+    sketches = window_sketches(args.cache_dir, args.start, args.end, args.capacity)
+    for section, sketch in sketches.items():
+        print(f"{section}: {sketch['total']:,} transactions, counts at most {sketch['error']:,} low")
+        for i, entry in enumerate(top_entries(sketch, args.top), 1):
+            mark = '' if entry['guaranteed'] else ' (not guaranteed)'
+            print(f"  {i}. {entry['address']}: {entry['lower_bound']:,}-{entry['upper_bound']:,}{mark}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Bulk Importer
+
+Discover legacy caches and archived outputs, parse them in a process pool and load them into the store.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import address_dict
+import address_index
+import batch_cache
+import bloom_filters
+import cache_store
+import compression
+import heavy_hitters
+import rollups
+
+TIMESTAMP_PATTERN = re.compile(r'(?<!\d)(20\d{6})_(\d{6})(?!\d)')
+SECTION_FILE_PATTERN = re.compile(r'^batch_(\d+)_(\d+)\.(\w+)\.json$')
+ADDRESS_COLUMNS = ('address', 'from_address', 'to_address')
+
+# Derived data kept next to the caches; rebuilt from the batches, never imported
+SKIP_DIRS = {rollups.ROLLUP_DIR, bloom_filters.BLOOM_DIR, address_index.INDEX_DIR, heavy_hitters.SKETCH_DIR}
+SKIP_FILES = {batch_cache.MANIFEST_FILE}
+
+def classify(path):
+    """Kind of artifact a file holds, or None if it is not imported"""
+    name = compression.strip_suffix(os.path.basename(path))
+    if name in SKIP_FILES or name.endswith('.tmp'):
+        return None
+    if name.startswith('batch_') and name.endswith('.json'):
+        return 'section' if SECTION_FILE_PATTERN.match(name) else 'batch'
+    if name.startswith('chunk_') and name.endswith('.json'):
+        return 'chunk'
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith('.json'):
+        return 'output_json'
+    return None
+
+def discover(paths):
+    """Find importable files under paths, oldest first so newer results win"""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            candidates = [path]
+        else:
+            candidates = []
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+                candidates.extend(os.path.join(root, f) for f in files)
+        for candidate in candidates:
+            kind = classify(candidate)
+            if kind is not None:
+                found.append((os.path.abspath(candidate), kind))
+    return sorted(set(found), key=lambda item: (os.path.getmtime(item[0]), item[0]))
+
+def run_timestamp(path):
+    """Run time encoded in an output file name, else the file's modification time"""
+    match = TIMESTAMP_PATTERN.search(os.path.basename(path))
+    if match:
+        return datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M%S').isoformat(sep=' ')
+    return datetime.fromtimestamp(os.path.getmtime(path)).isoformat(sep=' ', timespec='seconds')
+
+def parse_number(value):
+    """Convert a CSV cell to int or float where it holds a number"""
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+def parse_csv_rows(path):
+    """Rows of a CSV output with numeric cells converted"""
+    rows = []
+    with compression.open_text(path, 'r', newline='') as f:
+        for record in csv.DictReader(f):
+            data = {key: parse_number(value) for key, value in record.items()}
+            address = next((data[c] for c in ADDRESS_COLUMNS if isinstance(data.get(c), str)), None)
+            count = data.get('transaction_count')
+            rows.append({
+                'address': address.lower() if address else None,
+                'transaction_count': count if isinstance(count, int) else None,
+                'data': data
+            })
+    return rows
+
+def decode_section(path, payload):
+    """Records of a section file, with dictionary ids turned back into hex addresses"""
+    data = payload['data']
+    if payload.get('encoding') != 'columns':
+        return data
+    if data.get('address_columns'):
+        addresses = address_dict.open_dictionary(os.path.dirname(path))
+        for name in data['address_columns']:
+            data['columns'][name] = address_dict.decode_column(addresses, data['columns'][name])
+    return batch_cache.columns_to_records(data)
+
+def parse_artifact(item):
+    """Parse one file in a worker process"""
+    path, kind = item
+    with open(path, 'rb') as f:
+        raw = f.read()
+    parsed = {
+        'path': path,
+        'kind': kind,
+        'sha256': hashlib.sha256(raw).hexdigest(),
+        'size': len(raw),
+        'run_timestamp': run_timestamp(path)
+    }
+
+    try:
+        if kind == 'csv':
+            parsed['rows'] = parse_csv_rows(path)
+            return parsed
+
+        content = json.loads(compression.decompress_bytes(raw, compression.codec_for_path(path)))
+        if kind == 'section':
+            parsed['section'] = content['section']
+            parsed['range'] = (content['start_block'], content['end_block'])
+            parsed['records'] = decode_section(path, content)
+        elif kind == 'batch':
+            parsed['batch'] = content
+        elif kind == 'chunk':
+            parsed['range'] = (content.get('start_block'), content.get('end_block'))
+            parsed['summary'] = {key: value for key, value in content.items() if key != 'affected_addresses'}
+            parsed['rows'] = [
+                {'address': record.get('from_address'), 'transaction_count': record.get('transaction_count'),
+                 'data': record}
+                for record in content.get('affected_addresses', [])
+            ]
+        else:
+            parsed['summary'] = content
+    except compression.DECODE_ERRORS + (KeyError,) as e:
+        parsed['error'] = str(e)
+    return parsed
+
+def store_batch(conn, parsed):
+    """Load a whole-batch cache file and record where each of its datasets came from"""
+    batch_data = parsed['batch']
+    start_block, end_block = batch_data['start_block'], batch_data['end_block']
+    source_id = cache_store.record_source(conn, parsed['path'], parsed['kind'], parsed['sha256'], parsed['size'],
+                                          parsed['run_timestamp'], start_block, end_block)
+    if 'distribution' in batch_data:
+        cache_store.write_distribution_batch(conn, batch_data)
+        datasets = ['distribution']
+    else:
+        cache_store.write_batch(conn, batch_data)
+        datasets = [key for key in batch_data if key in cache_store.BATCH_DATASETS]
+    cache_store.record_provenance(conn, datasets, start_block, end_block, source_id)
+
+def store_sections(conn, start_block, end_block, sections):
+    """Overlay section files onto the stored batch of a range
+
+    Sections the store does not keep are only recorded as sources, so a range holding none of the stored
+    sections never gets a batch row that would mark it as fetched.
+    """
+    if any(section in cache_store.BATCH_DATASETS for section in sections):
+        batch_data = cache_store.load_batch(conn, start_block, end_block) or {
+            'batch_id': None, 'start_block': start_block, 'end_block': end_block
+        }
+        for section, parsed in sections.items():
+            if section in cache_store.BATCH_DATASETS:
+                batch_data[section] = parsed['records']
+        cache_store.write_batch(conn, batch_data)
+
+    for section, parsed in sections.items():
+        source_id = cache_store.record_source(conn, parsed['path'], parsed['kind'], parsed['sha256'], parsed['size'],
+                                              parsed['run_timestamp'], start_block, end_block)
+        if section in cache_store.BATCH_DATASETS:
+            cache_store.record_provenance(conn, [section], start_block, end_block, source_id)
+
+def import_paths(conn, paths, workers=None):
+    """Import every artifact found under paths; unchanged files are skipped"""
+    artifacts = discover(paths)
+    counts = {}
+    skipped = 0
+    failed = 0
+    # Section files of one range are written together so a batch is never stored half-updated
+    pending_sections = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for parsed in pool.map(parse_artifact, artifacts, chunksize=16):
+            if 'error' in parsed:
+                print(f"  Skipping unreadable {parsed['path']}: {parsed['error']}")
+                failed += 1
+                continue
+            if cache_store.source_imported(conn, parsed['path'], parsed['sha256']):
+                skipped += 1
+                continue
+
+            kind = parsed['kind']
+            if kind == 'section':
+                key = (os.path.dirname(parsed['path']),) + tuple(parsed['range'])
+                pending_sections.setdefault(key, {})[parsed['section']] = parsed
+            elif kind == 'batch':
+                try:
+                    store_batch(conn, parsed)
+                except sqlite3.IntegrityError as e:
+                    print(f"  Skipping inconsistent {parsed['path']}: {e}")
+                    failed += 1
+                    continue
+            else:
+                start_block, end_block = parsed.get('range', (None, None))
+                cache_store.record_source(conn, parsed['path'], kind, parsed['sha256'], parsed['size'],
+                                          parsed['run_timestamp'], start_block, end_block,
+                                          parsed.get('summary'), parsed.get('rows'))
+            counts[kind] = counts.get(kind, 0) + 1
+
+    for (directory, start_block, end_block), sections in sorted(pending_sections.items()):
+        try:
+            store_sections(conn, start_block, end_block, sections)
+        except sqlite3.IntegrityError as e:
+            print(f"  Skipping inconsistent batch {start_block}-{end_block} in {directory}: {e}")
+            failed += 1
+            counts['section'] -= len(sections)
+
+    summary = ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items()) if count) or "nothing new"
+    print(f"Imported {summary}; {skipped} unchanged, {failed} unreadable")
+    return sum(counts.values())
+
+def main():
+    """Import caches and archived outputs into a store"""
+    parser = argparse.ArgumentParser(description='Import batch caches and archived outputs into a single-file store')
+    parser.add_argument('paths', nargs='+', help='Cache directories, output directories or individual files')
+    parser.add_argument('--store', '-s', type=str, required=True, help='Path of the SQLite store')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Parser processes (default: CPU count)')
+    args = parser.parse_args()
+
+    conn = cache_store.open_store(args.store)
+    import_paths(conn, args.paths, args.workers)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
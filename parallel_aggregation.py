@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Parallel Aggregation
+
+Map-reduce folding of cached batches: worker processes pre-reduce shards, partials are merged in a tree.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import address_dict
+import aggregation
+import batch_cache
+
+def fold_shard(cache_dir, shard):
+    """Load and fold one shard of batches in a worker
+
+    Returns the partial state, the first id the worker assigned itself, the addresses behind those ids and
+    the cache files read.
+    """
+    addresses = address_dict.open_dictionary(cache_dir)
+    base = len(addresses['keys'])
+    try:
+        batches = [
+            batch_cache.load_batch(cache_dir, start_block, end_block, cached_sections)
+            for (start_block, end_block), cached_sections in shard
+        ]
+        state = aggregation.fold_batches(aggregation.new_aggregate_state(), batches, addresses)
+        new_keys = addresses['keys'][base:]
+    finally:
+        # Ids above base are only provisional; forget them before this worker takes the next shard
+        for key in addresses['keys'][base:]:
+            del addresses['ids'][key]
+        del addresses['keys'][base:]
+    return state, base, new_keys, batch_cache.take_access(cache_dir)
+
+def adopt_partial(addresses, state, base, new_keys):
+    """Replace a worker's provisional address ids with ids from the shared dictionary"""
+    if not new_keys:
+        return state
+    shared_ids = address_dict.encode_column(addresses, ['0x' + key.hex() for key in new_keys])
+    for name, table in aggregation.MAXIMA_TABLES.items():
+        for field, reduce in ((name, aggregation.reduce_aggregates), (table, aggregation.prune_maxima)):
+            rows = state[field].copy()
+            keys = rows[aggregation.KEY_FIELD]
+            provisional = keys >= base
+            keys[provisional] = shared_ids[keys[provisional] - base]
+            state[field] = reduce(rows)
+    return state
+
+def tree_merge(states):
+    """Merge partial states pairwise, one tree level at a time
+
+    Runs in the calling process: shipping states to workers would cost more pickling than the merges save.
+    """
+    while len(states) > 1:
+        merged = [aggregation.merge_states(states[i], states[i + 1]) for i in range(0, len(states) - 1, 2)]
+        carried = [states[-1]] if len(states) % 2 else []
+        states = merged + carried
+    return states[0]
+
+def parallel_fold(cache_dir, members, workers):
+    """Fold the given batches, as (range, cached sections) pairs, across worker processes"""
+    addresses = address_dict.open_dictionary(cache_dir)
+    # Workers read ids from the dictionary file, so everything assigned so far must be on disk
+    address_dict.flush_dictionary(addresses)
+
+    shard_count = min(workers, len(members))
+    shards = [members[i * len(members) // shard_count:(i + 1) * len(members) // shard_count]
+              for i in range(shard_count)]
+
+    # Spawned rather than forked: the rollup thread may hold a lock at fork time
+    with ProcessPoolExecutor(max_workers=shard_count, mp_context=multiprocessing.get_context('spawn')) as pool:
+        partials = []
+        for state, base, new_keys, accessed in pool.map(fold_shard, [cache_dir] * shard_count, shards):
+            for filename in accessed:
+                batch_cache.note_access(cache_dir, filename)
+            partials.append(adopt_partial(addresses, state, base, new_keys))
+    return tree_merge(partials)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Partition Prefix Sums
+
+Cumulative per-partition totals of the batch cache, for constant-time block-range totals.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import batch_cache
+
+PREFIX_FILE = "partition_prefix.npz"
+PARTITION_SIZE = 1000
+SECTION = 'partition_summary'
+BLOCKS_PER_DAY = 7200
+
+# Summed per partition; 'partitions' counts the partitions with cached data
+FIELDS = ('total_transactions', 'affected_transactions', 'high_gas_transactions', 'total_excess_gas', 'partitions')
+
+def build_prefix_sums(cache_dir, rebuild=False):
+    """Extend the prefix sums with the partition summaries of batches cached since the last build
+
+    Everything is reread when asked, or when a batch left the cache other than by being superseded.
+    """
+    manifest = batch_cache.validate_cache(cache_dir)
+    ranges = batch_cache.range_index(manifest)
+    members = batch_cache.cached_members(manifest, ranges, [SECTION])
+    previous = None if rebuild else load_prefix_sums(cache_dir)
+    added, removed, extend = batch_cache.extension_plan(previous and previous['members'], members)
+    if not extend:
+        previous = None
+    elif not added and not removed:
+        return previous
+
+    rows = []
+    for start_block, end_block in added:
+        info = ranges[(start_block, end_block)][SECTION]
+        batch_data = batch_cache.load_batch(cache_dir, start_block, end_block, {SECTION: info})
+        rows.extend(batch_data.get(SECTION) or [])
+    batch_cache.flush_access(cache_dir)
+
+    if not rows and previous is None:
+        return None
+
+    partitions = np.array([int(row['partition']) for row in rows], dtype=np.int64)
+    if previous is not None:
+        counts = np.diff(previous['cumulative'], axis=0)
+        first = previous['first_partition']
+    else:
+        counts = np.zeros((0, len(FIELDS)), dtype=np.int64)
+        first = int(partitions.min())
+    if len(partitions):
+        # Grow the dense array to the partitions of the new rows
+        lo = min(first, int(partitions.min()))
+        hi = max(first + len(counts), int(partitions.max()) + 1)
+        counts = np.pad(counts, ((first - lo, hi - first - len(counts)), (0, 0)))
+        first = lo
+    offsets = partitions - first
+    for column, field in enumerate(FIELDS[:-1]):
+        # Assignment, not accumulation: a superseding batch reports the partitions of the one it replaces
+        counts[offsets, column] = [int(row[field]) for row in rows]
+    counts[offsets, len(FIELDS) - 1] = 1
+
+    cumulative = np.zeros((len(counts) + 1, len(FIELDS)), dtype=np.int64)
+    np.cumsum(counts, axis=0, out=cumulative[1:])
+    member_ranges, member_fingerprints = batch_cache.members_to_arrays(members)
+
+    path = os.path.join(cache_dir, PREFIX_FILE)
+    batch_cache.atomic_savez(path, first_partition=np.int64(first), cumulative=cumulative,
+                             member_ranges=member_ranges, member_fingerprints=member_fingerprints)
+
+    print(f"Partition prefix sums {'updated' if previous is not None else 'rebuilt'} from {len(added)} batches: "
+          f"{int(counts[:, -1].sum()):,} partitions from block {first * PARTITION_SIZE:,}")
+    return {'first_partition': first, 'cumulative': cumulative, 'members': members}
+
+def load_prefix_sums(cache_dir):
+    """Load the persisted prefix sums, or None if they were never built"""
+    path = os.path.join(cache_dir, PREFIX_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        members = batch_cache.stored_members(data)
+        return {'first_partition': int(data['first_partition']), 'cumulative': data['cumulative'], 'members': members}
+
+def range_totals(prefix, start_block, end_block):
+    """Totals of the partitions overlapping [start_block, end_block), as one prefix difference"""
+    cumulative = prefix['cumulative']
+    last = len(cumulative) - 1
+    lo = min(max(start_block // PARTITION_SIZE - prefix['first_partition'], 0), last)
+    hi = min(max(-(-end_block // PARTITION_SIZE) - prefix['first_partition'], lo), last)
+    diff = cumulative[hi] - cumulative[lo]
+    return {field: int(value) for field, value in zip(FIELDS, diff)}
+
+def covered_blocks(prefix):
+    """First and end block covered by the prefix sums"""
+    first = prefix['first_partition']
+    return first * PARTITION_SIZE, (first + len(prefix['cumulative']) - 1) * PARTITION_SIZE
+
+def main():
+    """Print totals for a block range or the last days of the cache"""
+    parser = argparse.ArgumentParser(description='Block-range totals from the partition prefix sums of a cache')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--start', type=int, default=None, help='First block (default: start of the cache)')
+    parser.add_argument('--end', type=int, default=None, help='End block, exclusive (default: end of the cache)')
+    parser.add_argument('--days', type=int, default=None, help='Last N days before --end instead of --start')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the prefix sums from the cache first')
+    args = parser.parse_args()
+
+    prefix = build_prefix_sums(args.cache_dir, rebuild=True) if args.rebuild else load_prefix_sums(args.cache_dir)
+    if prefix is None:
+        print("No partition summaries cached; run the analysis or pass --rebuild")
+        return
+
+    first_block, end_block = covered_blocks(prefix)
+    end = args.end if args.end is not None else end_block
+    start = end - args.days * BLOCKS_PER_DAY if args.days is not None else (args.start if args.start is not None else first_block)
+    totals = range_totals(prefix, start, end)
+
+    print(f"Blocks {start:,} to {end:,} ({totals['partitions']:,} cached partitions)")
+    print(f"  Transactions: {totals['total_transactions']:,}")
+    affected_pct = totals['affected_transactions'] / totals['total_transactions'] * 100 if totals['total_transactions'] else 0
+    print(f"  Affected: {totals['affected_transactions']:,} ({affected_pct:.4f}%)")
+    print(f"  High gas (>1M): {totals['high_gas_transactions']:,}")
+    print(f"  Excess gas: {totals['total_excess_gas']:,}")
+
+if __name__ == "__main__":
+    main()
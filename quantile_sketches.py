@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Quantile Sketches
+
+DDSketch log-bucket counts per cached batch for gas limit, gas used, gas price and gas efficiency.
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+import batch_cache
+
+SECTION = 'quantile_sketches'
+# Every quantile is within 1% of the true value; the query buckets values by ceil(log(x) / LOG_GAMMA)
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Bucket of values <= 0, which have no logarithm
+ZERO_BUCKET = -(1 << 31)
+
+MEASURES = ('gas_limit', 'gas_used', 'gas_price', 'gas_efficiency')
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+def empty_sketch():
+    """Sketch of no values"""
+    return {'buckets': np.zeros(0, dtype=np.int64), 'counts': np.zeros(0, dtype=np.int64)}
+
+def reduce_buckets(buckets, counts):
+    """Sketch with the counts of equal buckets summed, sorted by bucket"""
+    buckets, inverse = np.unique(buckets, return_inverse=True)
+    return {'buckets': buckets,
+            'counts': np.bincount(inverse, weights=counts, minlength=len(buckets)).astype(np.int64)}
+
+def section_sketches(records):
+    """Sketch per measure from the (measure, bucket, count) rows of one batch"""
+    sketches = {}
+    for measure in MEASURES:
+        rows = [record for record in records if record['measure'] == measure]
+        sketches[measure] = reduce_buckets(np.array([int(row['bucket']) for row in rows], dtype=np.int64),
+                                           np.array([int(row['count']) for row in rows], dtype=np.int64))
+    return sketches
+
+def merge_sketches(sketch, other):
+    """Merge two sketches; associative and commutative, with no loss of accuracy"""
+    return reduce_buckets(np.concatenate((sketch['buckets'], other['buckets'])),
+                          np.concatenate((sketch['counts'], other['counts'])))
+
+def bucket_value(bucket):
+    """Representative value of a bucket, within RELATIVE_ACCURACY of every value in it"""
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+def quantile(sketch, q):
+    """Estimated q-quantile of the values behind a sketch, or None if it is empty"""
+    counts = sketch['counts']
+    total = int(counts.sum())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    idx = int(np.searchsorted(np.cumsum(counts), rank, side='right'))
+    return bucket_value(int(sketch['buckets'][min(idx, len(counts) - 1)]))
+
+def window_sketches(cache_dir, start_block=None, end_block=None):
+    """Merged sketch per measure of the batches starting inside a block window
+
+    Returns the sketches and the number of selected batches without cached sketches.
+    """
+    ranges = batch_cache.range_index(batch_cache.validate_cache(cache_dir))
+    merged = {measure: empty_sketch() for measure in MEASURES}
+    missing = 0
+    for batch_range in batch_cache.select_ranges(ranges, start_block, end_block):
+        info = ranges[batch_range].get(SECTION)
+        if info is None:
+            missing += 1
+            continue
+        batch_data = batch_cache.load_batch(cache_dir, *batch_range, {SECTION: info})
+        for measure, sketch in section_sketches(batch_data.get(SECTION) or []).items():
+            merged[measure] = merge_sketches(merged[measure], sketch)
+    batch_cache.flush_access(cache_dir)
+    return merged, missing
+
+def window_quantiles(cache_dir, start_block=None, end_block=None, quantiles=DEFAULT_QUANTILES):
+    """Quantiles per measure of a block window, or None if a selected batch has no sketches"""
+    merged, missing = window_sketches(cache_dir, start_block, end_block)
+    if missing:
+        return None
+    return {measure: {q: quantile(sketch, q) for q in quantiles} for measure, sketch in merged.items()}
+
+def main():
+    """Print quantiles of the gas measures for a block window"""
+    parser = argparse.ArgumentParser(description='Gas limit, gas used, gas price and efficiency quantiles of the cached batches')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    parser.add_argument('--start', type=int, default=None, help='First block (default: start of the cache)')
+    parser.add_argument('--end', type=int, default=None, help='End block, exclusive (default: end of the cache)')
+    parser.add_argument('--quantiles', type=float, nargs='+', default=list(DEFAULT_QUANTILES),
+                        help='Quantiles to estimate, between 0 and 1')
+    args = parser.parse_args()
+
+    merged, missing = window_sketches(args.cache_dir, args.start, args.end)
+    if missing:
+        print(f"{missing} batches have no cached sketches; their transactions are not included")
+    for measure, sketch in merged.items():
+        values = ", ".join(f"p{q * 100:g}: {quantile(sketch, q):,.4g}" for q in args.quantiles
+                           if quantile(sketch, q) is not None)
+        print(f"{measure} ({int(sketch['counts'].sum()):,} values): {values or 'no data'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Batch Rollups
+
+Hierarchical week, month and year rollups of the cached batch aggregates.
+"""
+
+import argparse
+import bisect
+import hashlib
+import os
+
+import address_dict
+import aggregation
+import batch_cache
+import compression
+import parallel_aggregation
+
+BLOCKS_PER_DAY = 7200
+ROLLUP_DIR = "rollups"
+# Merged state of the last aggregated window, kept with the rollups
+WINDOW_STATE_FILE = "window_state.json"
+# Part of every fingerprint so rollups written in an older layout are rebuilt
+ROLLUP_FORMAT = 5
+
+# Ordered finest first; every level nests exactly inside the next one
+ROLLUP_LEVELS = [
+    ('week', BLOCKS_PER_DAY * 7),
+    ('month', BLOCKS_PER_DAY * 28),
+    ('year', BLOCKS_PER_DAY * 364),
+]
+
+def rollup_path(cache_dir, level, bucket_start, bucket_end):
+    """Path of the rollup file for one bucket"""
+    suffix = compression.CODEC_SUFFIXES[compression.default_codec()]
+    return os.path.join(cache_dir, ROLLUP_DIR, f"{level}_{bucket_start:09d}_{bucket_end:09d}.json{suffix}")
+
+def batch_fingerprint(manifest, cached_sections):
+    """Identify the cached content of one batch by its section hashes"""
+    files = sorted({info['file'] for info in cached_sections.values()})
+    return ",".join(manifest['entries'][f]['sha256'] for f in files)
+
+def members_fingerprint(context, members):
+    """Identify the exact set and content of the batches in a bucket"""
+    digest = hashlib.sha256(f"format{ROLLUP_FORMAT};".encode())
+    for batch_range in members:
+        digest.update(f"{batch_range[0]}_{batch_range[1]}:".encode())
+        digest.update(batch_fingerprint(context['manifest'], context['ranges'][batch_range]).encode())
+    return digest.hexdigest()
+
+def bucket_members(context, bucket_start, bucket_end):
+    """Selected batch ranges whose start block falls inside a bucket"""
+    selected = context['selected']
+    lo = bisect.bisect_left(selected, (bucket_start,))
+    hi = bisect.bisect_left(selected, (bucket_end,))
+    return selected[lo:hi]
+
+def load_rollup(cache_dir, level, bucket_start, bucket_end):
+    """Load a rollup file if it exists"""
+    path = rollup_path(cache_dir, level, bucket_start, bucket_end)
+    if not os.path.exists(path):
+        return None
+    try:
+        rollup = batch_cache.read_cached(path, decode_rollup)
+    except compression.DECODE_ERRORS:
+        return None
+    if rollup.get('format') != ROLLUP_FORMAT:
+        # Written in an older layout; rebuilt by the next compaction
+        return None
+    batch_cache.note_access(os.path.dirname(path), os.path.basename(path))
+    return rollup
+
+def decode_rollup(rollup):
+    """Restore the aggregate arrays of a rollup read back from JSON"""
+    if rollup.get('format') == ROLLUP_FORMAT:
+        rollup['state'] = aggregation.load_state(rollup['state'])
+    return rollup
+
+def fold_batches(context, state, members):
+    """Fold raw batches into a state"""
+    batches = [
+        batch_cache.load_batch(context['cache_dir'], start_block, end_block, context['ranges'][(start_block, end_block)])
+        for start_block, end_block in members
+    ]
+    return aggregation.fold_batches(state, batches, context['addresses'])
+
+def fresh_rollup(context, level_idx, bucket_start, bucket_end):
+    """Return the rollup of a bucket if it matches the batches currently selected"""
+    members = bucket_members(context, bucket_start, bucket_end)
+    if not members:
+        return None, members
+
+    level = ROLLUP_LEVELS[level_idx][0]
+    rollup = load_rollup(context['cache_dir'], level, bucket_start, bucket_end)
+    if rollup is None or rollup['fingerprint'] != members_fingerprint(context, members):
+        return None, members
+    return rollup, members
+
+def ensure_rollup(context, level_idx, bucket_start, bucket_end):
+    """Build (or reuse) the rollup of one bucket from the level below"""
+    rollup, members = fresh_rollup(context, level_idx, bucket_start, bucket_end)
+    if rollup is not None or not members:
+        return rollup
+
+    state = aggregation.new_aggregate_state()
+    if level_idx == 0:
+        fold_batches(context, state, members)
+    else:
+        child_size = ROLLUP_LEVELS[level_idx - 1][1]
+        for child_start in range(bucket_start, bucket_end, child_size):
+            child = ensure_rollup(context, level_idx - 1, child_start, child_start + child_size)
+            if child is not None:
+                aggregation.merge_states(state, child['state'])
+
+    level = ROLLUP_LEVELS[level_idx][0]
+    rollup = {
+        'level': level,
+        'format': ROLLUP_FORMAT,
+        'start_block': bucket_start,
+        'end_block': bucket_end,
+        'fingerprint': members_fingerprint(context, members),
+        'batches': len(members),
+        'state': state
+    }
+    address_dict.flush_dictionary(context['addresses'])
+    path = rollup_path(context['cache_dir'], level, bucket_start, bucket_end)
+    batch_cache.write_batch_file(os.path.dirname(path), os.path.basename(compression.strip_suffix(path)),
+                                 dict(rollup, state=aggregation.dump_state(state)), compression.default_codec(),
+                                 sections={})
+    context['built'] += 1
+    return rollup
+
+def make_context(cache_dir, manifest, start_block=None, end_block=None):
+    """Collect what rollup lookups need about the cache"""
+    ranges = batch_cache.range_index(manifest)
+    return {
+        'cache_dir': cache_dir,
+        'manifest': manifest,
+        'addresses': address_dict.open_dictionary(cache_dir),
+        'ranges': ranges,
+        'selected': batch_cache.select_ranges(ranges, start_block, end_block),
+        'built': 0,
+        'reads': 0,
+        'pending': []
+    }
+
+def compact_rollups(cache_dir):
+    """Merge cached batches into week, month and year rollups"""
+    os.makedirs(os.path.join(cache_dir, ROLLUP_DIR), exist_ok=True)
+    context = make_context(cache_dir, batch_cache.load_manifest(cache_dir))
+    if not context['selected']:
+        return 0
+
+    top_idx = len(ROLLUP_LEVELS) - 1
+    top_size = ROLLUP_LEVELS[top_idx][1]
+    first = (context['selected'][0][0] // top_size) * top_size
+    last = context['selected'][-1][0]
+    for bucket_start in range(first, last + 1, top_size):
+        ensure_rollup(context, top_idx, bucket_start, bucket_start + top_size)
+    batch_cache.flush_access(cache_dir)
+    batch_cache.flush_access(os.path.join(cache_dir, ROLLUP_DIR))
+
+    print(f"Rollup compaction finished: {context['built']} rollups rebuilt")
+    return context['built']
+
+def cover_window(context, state, start_block, end_block, level_idx):
+    """Fold a block window into state using the coarsest fresh rollups available"""
+    size = ROLLUP_LEVELS[level_idx][1]
+    bucket_start = (start_block // size) * size
+
+    while bucket_start < end_block:
+        bucket_end = bucket_start + size
+        sub_start = max(start_block, bucket_start)
+        sub_end = min(end_block, bucket_end)
+
+        if sub_start == bucket_start and sub_end == bucket_end:
+            rollup, members = fresh_rollup(context, level_idx, bucket_start, bucket_end)
+            if rollup is not None:
+                aggregation.merge_states(state, rollup['state'])
+                context['reads'] += 1
+                bucket_start = bucket_end
+                continue
+        else:
+            members = bucket_members(context, sub_start, sub_end)
+
+        if members:
+            if level_idx > 0:
+                cover_window(context, state, sub_start, sub_end, level_idx - 1)
+            else:
+                # Raw batches are folded together at the end, in one grouped reduction
+                context['pending'].extend(members)
+                context['reads'] += len(members)
+        bucket_start = bucket_end
+
+    return state
+
+def fold_pending(context, state, members, workers=None):
+    """Fold raw batches into state, across worker processes if several are given"""
+    if workers and workers > 1 and len(members) > 1:
+        shards = [(batch_range, context['ranges'][batch_range]) for batch_range in members]
+        return aggregation.merge_states(state, parallel_aggregation.parallel_fold(context['cache_dir'], shards, workers))
+    return fold_batches(context, state, members)
+
+def window_state_path(cache_dir):
+    """Path of the persisted window state"""
+    suffix = compression.CODEC_SUFFIXES[compression.default_codec()]
+    return os.path.join(cache_dir, ROLLUP_DIR, WINDOW_STATE_FILE + suffix)
+
+def load_window_state(cache_dir):
+    """Load the state persisted by the last incremental aggregation, or None"""
+    path = window_state_path(cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        saved = batch_cache.read_json(path)
+    except compression.DECODE_ERRORS:
+        return None
+    if saved.get('format') != ROLLUP_FORMAT:
+        return None
+    batch_cache.note_access(os.path.dirname(path), os.path.basename(path))
+    saved['state'] = aggregation.load_state(saved['state'])
+    return saved
+
+def save_window_state(context, state, fingerprints):
+    """Persist a window state with the fingerprints of the batches folded into it"""
+    # The state is keyed by address id, so every id it uses must be on disk first
+    address_dict.flush_dictionary(context['addresses'])
+    path = window_state_path(context['cache_dir'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    batch_cache.write_batch_file(os.path.dirname(path), WINDOW_STATE_FILE, {
+        'format': ROLLUP_FORMAT,
+        'start_block': context['selected'][0][0],
+        'end_block': context['selected'][-1][1],
+        'members': fingerprints,
+        'state': aggregation.dump_state(state)
+    }, compression.default_codec(), sections={})
+
+def range_key(batch_range):
+    """Key of a batch range in the persisted window members"""
+    return f"{batch_range[0]}_{batch_range[1]}"
+
+def retraction_plan(context, members, fingerprints):
+    """Batches to retract from and fold into a saved window state to match the selected batches
+
+    Returns (expired, added), or None when the saved state cannot be turned into the selected window
+    exactly: a kept batch changed, an expired batch is no longer cached as it was, or a batch expired from
+    the middle of the window rather than its front (other than an open batch superseded by a longer range).
+    """
+    kept = [key for key in members if key in fingerprints]
+    if not kept or any(fingerprints[key] != members[key] for key in kept):
+        return None
+
+    added = [batch_range for batch_range in context['selected'] if range_key(batch_range) not in members]
+    added_ends = dict(added)
+    oldest_kept = min(int(key.split('_')[0]) for key in kept)
+    expired = []
+    for key in members:
+        if key in fingerprints:
+            continue
+        batch_range = tuple(int(block) for block in key.split('_'))
+        cached = context['ranges'].get(batch_range)
+        if cached is None or batch_fingerprint(context['manifest'], cached) != members[key]:
+            return None
+        # The maxima tables only stay exact when no kept batch is older than an expired one
+        if batch_range[0] > oldest_kept and added_ends.get(batch_range[0], 0) <= batch_range[1]:
+            return None
+        expired.append(batch_range)
+    return expired, added
+
+def slide_window(context, state, expired, added, workers=None):
+    """Retract expired batches from a saved window state and fold the added ones
+
+    Returns the state, or None (leaving it untouched) when a superseded batch is not covered by the longer
+    range replacing it, so that its pruned maxima could not be restored.
+    """
+    added_starts = {batch_range[0] for batch_range in added}
+    expired_starts = {batch_range[0] for batch_range in expired}
+    superseded = [batch_range for batch_range in expired if batch_range[0] in added_starts]
+    superseding = [batch_range for batch_range in added if batch_range[0] in expired_starts]
+
+    newer = fold_pending(context, aggregation.new_aggregate_state(), superseding, workers)
+    older = fold_pending(context, aggregation.new_aggregate_state(), superseded, workers)
+    if not aggregation.supersedes(newer, older):
+        return None
+
+    if expired:
+        retracted = fold_pending(context, aggregation.new_aggregate_state(),
+                                 [batch_range for batch_range in expired if batch_range not in superseded], workers)
+        aggregation.merge_states(retracted, older)
+        aggregation.retract_states(state, retracted, sorted(expired_starts))
+    aggregation.merge_states(state, newer)
+    return fold_pending(context, state, [batch_range for batch_range in added if batch_range not in superseding],
+                        workers)
+
+def window_state(cache_dir, start_block=None, end_block=None, workers=None, incremental=False):
+    """Aggregate state of the batches starting inside a block window, keyed by address id
+
+    With several workers, the batches no rollup covers are folded in parallel. An incremental
+    aggregation starts from the state persisted by the previous one: batches that left the window are
+    retracted, batches added since are folded, and the result is persisted again. It falls back to a full
+    aggregation when a kept batch changed or the window cannot be slid exactly. There is one saved state,
+    so only the rolling window of the daily run should be aggregated incrementally. Blocks two overlapping
+    batches share are subtracted once where they are cached as a range of their own.
+    """
+    context = make_context(cache_dir, batch_cache.validate_cache(cache_dir), start_block, end_block)
+    state = aggregation.new_aggregate_state()
+    if not context['selected']:
+        return state
+
+    fingerprints = {
+        range_key(batch_range): batch_fingerprint(context['manifest'], context['ranges'][batch_range])
+        for batch_range in context['selected']
+    }
+    previous = load_window_state(cache_dir) if incremental else None
+    plan = retraction_plan(context, previous['members'], fingerprints) if previous is not None else None
+    slid = None
+    if plan is not None:
+        expired, added = plan
+        slid = slide_window(context, previous['state'], expired, added, workers)
+        if slid is None:
+            print("A superseded batch is not covered by its replacement; aggregating the full window")
+        else:
+            context['reads'] += len(expired) + len(added) + 1
+            print(f"Reused the saved window state of {len(previous['members'])} batches, "
+                  f"retracted {len(expired)} expired and folded {len(added)} new batches")
+    if slid is not None:
+        state = slid
+    else:
+        first = context['selected'][0][0]
+        last = context['selected'][-1][0]
+        cover_window(context, state, first, last + 1, len(ROLLUP_LEVELS) - 1)
+        fold_pending(context, state, context['pending'], workers)
+
+    if incremental:
+        save_window_state(context, state, fingerprints)
+    # Saved states and rollups hold plain batch sums; blocks shared by overlapping batches come out last
+    overlaps = batch_cache.cached_overlaps(context['ranges'], context['selected'])
+    if overlaps:
+        shared = fold_pending(context, aggregation.new_aggregate_state(), overlaps, workers)
+        aggregation.subtract_overlap(state, shared)
+        context['reads'] += len(overlaps)
+    batch_cache.flush_access(cache_dir)
+    batch_cache.flush_access(os.path.join(cache_dir, ROLLUP_DIR))
+    print(f"Window aggregated from {context['reads']} rollup and batch reads "
+          f"({len(context['selected'])} batches)")
+    return state
+
+def main():
+    """Compact the rollups of a cache directory"""
+    parser = argparse.ArgumentParser(description='Build week, month and year rollups of a batch cache')
+    parser.add_argument('cache_dir', help='Cache directory containing batch files and manifest.json')
+    args = parser.parse_args()
+
+    compact_rollups(args.cache_dir)
+
+if __name__ == "__main__":
+    main()
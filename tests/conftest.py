@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_cache
+
+CAP = 16_777_216
+
+def affected_rows(transactions):
+    """Sender rows of a batch from {address: [gas limits]}"""
+    return [
+        {'from_address': address, 'transaction_count': len(limits), 'avg_gas_limit': sum(limits) / len(limits),
+         'max_gas_limit': max(limits), 'total_excess_gas': sum(limit - CAP for limit in limits),
+         'avg_gas_price': 1e9}
+        for address, limits in transactions.items()
+    ]
+
+def to_rows(transactions):
+    """Recipient rows of a batch from {address: [gas limits]}"""
+    return [
+        {'to_address': address, 'transaction_count': len(limits), 'avg_gas_limit': sum(limits) / len(limits),
+         'max_gas_limit': max(limits)}
+        for address, limits in transactions.items()
+    ]
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    """Empty cache directory"""
+    path = tmp_path / "cache"
+    path.mkdir()
+    return str(path)
+
+@pytest.fixture
+def write_batch(cache_dir):
+    """Write the summary, address and efficiency sections of one batch from {address: [gas limits]}"""
+    def write(start_block, end_block, senders, recipients=None):
+        recipients = senders if recipients is None else recipients
+        limits = [limit for values in senders.values() for limit in values]
+        sections = {
+            'summary': {'total_transactions': 10 * len(limits), 'affected_transactions': len(limits),
+                        'high_gas_transactions': len(limits)},
+            'affected_addresses': affected_rows(senders),
+            'to_addresses': to_rows(recipients),
+            'gas_efficiency': {'total_overprovision': len(limits), 'unnecessary_high_limit': len(limits),
+                               'avg_gas_limit': sum(limits) / len(limits), 'avg_gas_used': 1e6,
+                               'min_gas_used': start_block + 1, 'max_gas_used': end_block} if limits else {},
+        }
+        for section, data in sections.items():
+            batch_cache.write_section_file(cache_dir, start_block, end_block, section, 1, data)
+    return write
@@ -0,0 +1,60 @@
+import json
+import os
+
+import address_dict
+import aggregation
+import batch_cache
+import rollups
+from conftest import affected_rows, to_rows
+
+SENDER = '0x' + 'ab' * 20
+OTHER = '0x' + 'cd' * 20
+
+def test_encode_column_mixes_ids_and_hex(cache_dir):
+    addresses = address_dict.open_dictionary(cache_dir)
+    known = address_dict.encode(addresses, SENDER)
+    ids = address_dict.encode_column(addresses, [known, SENDER.upper().replace('0X', '0x'), OTHER, known])
+    assert ids.tolist() == [known, known, known + 1, known]
+    assert address_dict.encode_column(addresses, []).tolist() == []
+
+def test_legacy_and_section_batches_fold_together(cache_dir, write_batch):
+    # A legacy whole-batch file holds hex addresses; section files hold dictionary ids
+    legacy = {
+        'batch_id': 0, 'start_block': 0, 'end_block': 10000,
+        'summary': {'total_transactions': 100, 'affected_transactions': 3, 'high_gas_transactions': 3},
+        'affected_addresses': affected_rows({SENDER: [20_000_000, 22_000_000], OTHER: [18_000_000]}),
+        'to_addresses': to_rows({OTHER: [20_000_000, 22_000_000, 18_000_000]}),
+        'gas_efficiency': {},
+    }
+    with open(os.path.join(cache_dir, 'batch_00000.json'), 'w') as f:
+        json.dump(legacy, f)
+    write_batch(10000, 20000, {SENDER: [30_000_000]})
+
+    state = rollups.window_state(cache_dir)
+    addresses = address_dict.open_dictionary(cache_dir)
+    rows = state['address_aggregates']
+    by_address = dict(zip(address_dict.decode_column(addresses, rows[aggregation.KEY_FIELD]), rows.tolist()))
+    assert by_address[SENDER][1:] == (3, 72_000_000.0, 30_000_000.0, 72_000_000.0 - 3 * 16_777_216, 3e9, 2)
+    assert by_address[OTHER][1] == 1
+    assert state['total_transactions'] == 110
+
+    assert rollups.compact_rollups(cache_dir) > 0
+    assert len(batch_cache.select_ranges(batch_cache.range_index(batch_cache.load_manifest(cache_dir)))) == 2
+
+def test_ids_survive_a_reload_and_a_torn_append(cache_dir, monkeypatch):
+    addresses = address_dict.open_dictionary(cache_dir)
+    ids = address_dict.encode_column(addresses, [SENDER, OTHER, SENDER]).tolist()
+    assert address_dict.flush_dictionary(addresses) == 2
+    assert address_dict.flush_dictionary(addresses) == 0
+    with open(os.path.join(cache_dir, address_dict.DICTIONARY_FILE), 'ab') as f:
+        f.write(b'\x01' * 7)
+
+    # A new process sees the flushed ids and ignores the partial record
+    monkeypatch.setattr(address_dict, '_dictionaries', {})
+    reloaded = address_dict.open_dictionary(cache_dir)
+    assert address_dict.decode_column(reloaded, ids) == [SENDER, OTHER, SENDER]
+    third = '0x' + '00' * 19 + '01'
+    assert address_dict.encode(reloaded, third) == 2
+    assert address_dict.flush_dictionary(reloaded) == 1
+    monkeypatch.setattr(address_dict, '_dictionaries', {})
+    assert address_dict.decode_column(address_dict.open_dictionary(cache_dir), [2, 0]) == [third, SENDER]
@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+import address_dict
+import address_graph
+import batch_cache
+
+def test_window_graph_matches_brute_force(cache_dir):
+    rng = np.random.default_rng(6)
+    senders = ['0x' + f"{i:02x}" * 20 for i in range(10)]
+    recipients = ['0x' + f"{i:02x}" * 20 for i in range(100, 110)]
+    counts = defaultdict(int)
+    excess = defaultdict(float)
+    for start in range(0, 40000, 10000):
+        rows = []
+        for sender, recipient in {(senders[s], recipients[r]) for s, r in rng.integers(0, 10, (8, 2))}:
+            count = int(rng.integers(1, 5))
+            rows.append({'from_address': sender, 'to_address': recipient, 'transaction_count': count,
+                         'total_excess_gas': count * 1e6})
+            counts[sender, recipient] += count
+            excess[sender, recipient] += count * 1e6
+        batch_cache.write_section_file(cache_dir, start, start + 10000, address_graph.SECTION, 1, rows)
+
+    graph, missing = address_graph.window_graph(cache_dir)
+    addresses = address_dict.open_dictionary(cache_dir)
+    def id_of(address):
+        return address_dict.encode(addresses, address)
+    assert missing == 0
+    transactions = graph['transactions'].toarray()
+    assert transactions.sum() == sum(counts.values())
+    for (sender, recipient), count in counts.items():
+        assert transactions[id_of(sender), id_of(recipient)] == count
+        assert graph['excess_gas'][id_of(sender), id_of(recipient)] == excess[sender, recipient]
+
+    per_recipient = address_graph.senders_per_recipient(graph)
+    per_sender = address_graph.recipients_per_sender(graph)
+    for address in {r for _, r in counts}:
+        assert per_recipient[id_of(address)] == len({s for s, r in counts if r == address})
+    for address in {s for s, _ in counts}:
+        assert per_sender[id_of(address)] == len({r for s, r in counts if s == address})
+
+    shared = address_graph.shared_recipients(graph).toarray()
+    sent_to = {s: {r for s2, r in counts if s2 == s} for s, _ in counts}
+    for a in sent_to:
+        for b in sent_to:
+            assert shared[id_of(a), id_of(b)] == len(sent_to[a] & sent_to[b])
+
+    # Connected components by union-find over the pairs
+    parent = {}
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            x = parent[x]
+        return x
+    for sender, recipient in counts:
+        parent[find(sender)] = find(recipient)
+    labels = address_graph.clusters(graph)
+    for a in parent:
+        for b in parent:
+            assert (labels[id_of(a)] == labels[id_of(b)]) == (find(a) == find(b))
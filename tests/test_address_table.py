@@ -0,0 +1,33 @@
+import address_table
+
+ADDRESSES = ['0x' + f"{i:02x}" * 19 + '00' for i in range(1, 200, 7)] + ['0x' + 'ab' * 20]
+
+def address_rows(addresses):
+    """Result rows in the layout of the all-addresses CSV, most transactions first"""
+    rows = []
+    for i, address in enumerate(reversed(addresses)):
+        row = {name: float(i) for name in address_table.ADDRESS_DTYPE.names[1:]}
+        row.update(address=address, transaction_count=len(addresses) - i)
+        rows.append(row)
+    return rows
+
+def test_memory_mapped_lookups_match_the_rows(tmp_path):
+    rows = address_rows(ADDRESSES)
+    results = {'all_addresses': rows, 'all_to_addresses': [
+        {'to_address': ADDRESSES[0], 'transaction_count': 3, 'avg_gas_limit': 2e7, 'max_gas_limit': 3e7}]}
+    paths = address_table.write_address_tables(str(tmp_path), results, 'ts')
+    assert [path.rsplit('/', 1)[-1] for path in paths] == [
+        'gas_cap_6month_all_addresses_ts.npy', 'gas_cap_6month_to_addresses_ts.npy']
+
+    table = address_table.open_table(paths[0])
+    assert table['address'].tolist() == sorted(table['address'].tolist())
+    for row in rows:
+        found = address_table.lookup(table, row['address'].upper().replace('0X', '0x'))
+        assert {name: found[name] for name in table.dtype.names[1:]} == {k: v for k, v in row.items() if k != 'address'}
+    assert address_table.lookup(table, '0x' + 'cd' * 20) is None
+    assert address_table.lookup(table, '0x' + '01' * 19 + '02') is None
+
+    # Addresses ending in zero bytes decode whole, in the CSV's order
+    assert address_table.to_dataframe(table).to_dict('records') == rows
+    to_table = address_table.to_dataframe(address_table.open_table(paths[1]), 'to_address')
+    assert to_table.to_dict('records') == results['all_to_addresses']
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import aggregation
+from conftest import affected_rows, to_rows
+from test_rollups import assert_same_state
+
+SENDERS = ['0x' + f"{i:02x}" * 20 for i in range(10)]
+
+def random_batches(count, seed=11):
+    rng = np.random.default_rng(seed)
+    batches = []
+    for i in range(count):
+        senders = {address: rng.integers(17_000_000, 40_000_000, rng.integers(1, 5)).tolist()
+                   for address in rng.choice(SENDERS, rng.integers(1, 6), replace=False)}
+        recipients = {address: rng.integers(17_000_000, 40_000_000, rng.integers(1, 5)).tolist()
+                      for address in rng.choice(SENDERS, rng.integers(1, 6), replace=False)}
+        batches.append({
+            'start_block': i * 10000, 'end_block': (i + 1) * 10000,
+            'summary': {'total_transactions': 1000 + i, 'affected_transactions': 10 + i, 'high_gas_transactions': i},
+            'affected_addresses': affected_rows(senders),
+            'to_addresses': to_rows(recipients),
+            'gas_efficiency': {'total_overprovision': 5 + i, 'unnecessary_high_limit': i, 'avg_gas_limit': 2e7,
+                               'avg_gas_used': 1e6 + i, 'min_gas_used': 1000 - i, 'max_gas_used': 5000 + i},
+        })
+    return batches
+
+def dict_aggregates(batches):
+    """Per-address aggregates the way the dict-based state summed them, one row at a time"""
+    senders, recipients = {}, {}
+    for batch_data in batches:
+        for row in batch_data['affected_addresses']:
+            agg = senders.setdefault(row['from_address'], {
+                'transaction_count': 0, 'total_gas_limit': 0.0, 'max_gas_limit': 0.0, 'total_excess_gas': 0.0,
+                'total_gas_price': 0.0, 'batches_appeared': 0})
+            agg['transaction_count'] += row['transaction_count']
+            agg['total_gas_limit'] += row['avg_gas_limit'] * row['transaction_count']
+            agg['max_gas_limit'] = max(agg['max_gas_limit'], row['max_gas_limit'])
+            agg['total_excess_gas'] += row['total_excess_gas']
+            agg['total_gas_price'] += row['avg_gas_price'] * row['transaction_count']
+            agg['batches_appeared'] += 1
+        for row in batch_data['to_addresses']:
+            agg = recipients.setdefault(row['to_address'], {
+                'transaction_count': 0, 'total_gas_limit': 0.0, 'max_gas_limit': 0.0})
+            agg['transaction_count'] += row['transaction_count']
+            agg['total_gas_limit'] += row['avg_gas_limit'] * row['transaction_count']
+            agg['max_gas_limit'] = max(agg['max_gas_limit'], row['max_gas_limit'])
+    return senders, recipients
+
+def assert_matches_mapping(aggregates, mapping):
+    assert aggregates[aggregation.KEY_FIELD].tolist() == sorted(mapping)
+    for row in aggregates:
+        expected = mapping[row[aggregation.KEY_FIELD]]
+        for field, value in expected.items():
+            assert row[field] == pytest.approx(value, rel=1e-12), field
+
+def test_fold_matches_dict_aggregation():
+    batches = random_batches(12)
+    state = aggregation.fold_batches(aggregation.new_aggregate_state(), batches)
+    senders, recipients = dict_aggregates(batches)
+    assert_matches_mapping(state['address_aggregates'], senders)
+    assert_matches_mapping(state['to_address_aggregates'], recipients)
+    assert state['batch_count'] == 12
+    assert state['total_transactions'] == sum(batch['summary']['total_transactions'] for batch in batches)
+
+    stats = aggregation.efficiency_values(state['gas_efficiency_stats'])
+    assert stats['count'] == sum(batch['gas_efficiency']['total_overprovision'] for batch in batches)
+    assert stats['min_gas_used'] == 1000 - 11
+    assert stats['max_gas_used'] == 5000 + 11
+
+def test_merge_is_associative_and_commutative():
+    batches = random_batches(9, seed=5)
+    expected = aggregation.fold_batches(aggregation.new_aggregate_state(), batches)
+    def parts():
+        # merge_states updates its first argument, so each grouping starts from fresh partials
+        return [aggregation.fold_batches(aggregation.new_aggregate_state(), batches[i:i + 3]) for i in (0, 3, 6)]
+
+    first, second, third = parts()
+    left = aggregation.merge_states(aggregation.merge_states(first, second), third)
+    first, second, third = parts()
+    right = aggregation.merge_states(third, aggregation.merge_states(second, first))
+    assert_same_state(left, expected)
+    assert_same_state(right, expected)
+
+def test_state_survives_dump_and_load():
+    state = aggregation.fold_batches(aggregation.new_aggregate_state(), random_batches(4, seed=2))
+    assert_same_state(aggregation.load_state(aggregation.dump_state(state)), state)
@@ -0,0 +1,165 @@
+import collections
+import os
+
+import batch_cache
+import compression
+
+def covered_blocks(ranges):
+    """Blocks belonging to any of the ranges"""
+    return set().union(*(range(start, end) for start, end in ranges))
+
+def test_superseded_open_range_is_dropped():
+    ranges = {(0, 10000): {}, (10000, 15000): {}, (10000, 20000): {}}
+    assert batch_cache.select_ranges(ranges) == [(0, 10000), (10000, 20000)]
+
+def test_grid_ranges_retire_overlapping_legacy_ranges():
+    legacy = {(start + 2000, start + 13000): {} for start in range(0, 50000, 10000)}
+    grid = {(start, start + 10000): {} for start in range(0, 60000, 10000)}
+    selected = batch_cache.select_ranges({**legacy, **grid})
+    assert selected == sorted(grid)
+    assert batch_cache.select_ranges({**legacy, **grid}, 20000, 40000) == [(20000, 30000), (30000, 40000)]
+
+def test_overlapping_legacy_ranges_are_all_covered():
+    legacy = {(start + 2000, start + 13000): {} for start in range(0, 50000, 10000)}
+    selected = batch_cache.select_ranges(legacy)
+    assert selected == sorted(legacy)
+    assert covered_blocks(selected) == covered_blocks(legacy)
+    assert batch_cache.shared_blocks(selected) == [(start + 2000, start + 3000) for start in range(10000, 50000, 10000)]
+
+    # Cached shared partitions are subtracted, never selected
+    shared = {(start + 2000, start + 3000): {} for start in range(10000, 30000, 10000)}
+    selected = batch_cache.select_ranges({**legacy, **shared})
+    assert selected == sorted(legacy)
+    assert batch_cache.cached_overlaps({**legacy, **shared}, selected) == sorted(shared)
+
+def test_window_plan_reuses_legacy_ranges():
+    legacy = {(start + 2000, start + 13000): {} for start in range(0, 50000, 10000)}
+    gaps, shared = batch_cache.plan_window(legacy, 0, 64000, 10000)
+    assert gaps == [(0, 2000), (53000, 60000), (60000, 64000)]
+    assert shared == [(start + 2000, start + 3000) for start in range(10000, 50000, 10000)]
+    assert covered_blocks(batch_cache.select_ranges({**legacy, **dict.fromkeys(gaps, {})})) == set(range(64000))
+
+    # An open grid batch is fetched again in full rather than followed by a fragment
+    gaps, shared = batch_cache.plan_window({(0, 10000): {}, (10000, 14000): {}}, 0, 27000, 10000)
+    assert (gaps, shared) == ([(10000, 20000), (20000, 27000)], [])
+
+def rewrite_before_manifest(cache_dir, start_block, end_block, section, data, codec='none'):
+    """Replace a section file as a crash between the rename and the manifest update leaves it"""
+    manifest = batch_cache.load_manifest(cache_dir)
+    batch_cache.write_section_file(cache_dir, start_block, end_block, section, 1, data, codec)
+    batch_cache.save_manifest(cache_dir, manifest)
+    return batch_cache.section_filename(start_block, end_block, section, codec)
+
+def test_validation_adopts_replaced_files_and_removes_damaged_ones(cache_dir, capsys):
+    batch_cache.write_section_file(cache_dir, 0, 10000, 'summary', 1, {'total_transactions': 1})
+    filename = rewrite_before_manifest(cache_dir, 0, 10000, 'summary', {'total_transactions': 123456})
+    path = os.path.join(cache_dir, filename)
+    batch_cache.write_section_file(cache_dir, 10000, 20000, 'summary', 1, {'total_transactions': 2})
+    damaged = os.path.join(cache_dir, batch_cache.section_filename(10000, 20000, 'summary'))
+    with open(damaged, 'r+') as f:
+        f.truncate(10)
+    with open(os.path.join(cache_dir, batch_cache.section_filename(20000, 30000, 'summary', 'zstd')), 'wb') as f:
+        f.write(b'{"start_block": 20000')
+    with open(os.path.join(cache_dir, 'batch_x.json.1.tmp'), 'w') as f:
+        f.write('{')
+
+    entries = batch_cache.validate_cache(cache_dir)['entries']
+    assert "adopting it" in capsys.readouterr().out
+    assert list(entries) == [filename]
+    assert entries[filename]['sha256'] == batch_cache.sha256_file(path)
+    assert sorted(os.listdir(cache_dir)) == sorted([filename, batch_cache.MANIFEST_FILE])
+    assert batch_cache.read_json(path)['data'] == {'total_transactions': 123456}
+
+def test_validation_skips_files_of_a_missing_codec(cache_dir, monkeypatch, capsys):
+    batch_cache.write_section_file(cache_dir, 0, 10000, 'summary', 1, {'total_transactions': 1}, 'lz4')
+    filename = rewrite_before_manifest(cache_dir, 0, 10000, 'summary', {'total_transactions': 123456}, 'lz4')
+    path = os.path.join(cache_dir, filename)
+
+    monkeypatch.setattr(compression, 'lz4', None)
+    assert batch_cache.validate_cache(cache_dir)['entries'] == {}
+    assert "cannot be read" in capsys.readouterr().out
+    assert os.path.exists(path)
+    assert batch_cache.validate_cache(cache_dir)['entries'] == {}
+
+    # Once the codec is installed again the file is picked up like any file without an entry
+    monkeypatch.undo()
+    entries = batch_cache.validate_cache(cache_dir)['entries']
+    assert entries[filename]['sha256'] == batch_cache.sha256_file(path)
+
+def test_only_absent_or_outdated_sections_are_missing(cache_dir, write_batch):
+    # A whole-batch file holds every section at version 1; a later section file takes precedence
+    legacy = {'batch_id': 0, 'start_block': 0, 'end_block': 10000, 'summary': {'total_transactions': 1},
+              'affected_addresses': [], 'to_addresses': [], 'gas_efficiency': {}}
+    batch_cache.write_batch_file(cache_dir, 'batch_00000.json', legacy)
+    batch_cache.write_section_file(cache_dir, 0, 10000, 'gas_efficiency', 2, {'total_overprovision': 4})
+    write_batch(10000, 20000, {'0x' + 'ab' * 20: [20_000_000]})
+
+    ranges = batch_cache.range_index(batch_cache.load_manifest(cache_dir))
+    versions = {'summary': 1, 'affected_addresses': 1, 'to_addresses': 1, 'gas_efficiency': 2, 'daily_series': 1}
+    assert batch_cache.missing_sections(ranges[(0, 10000)], versions) == ['daily_series']
+    assert batch_cache.missing_sections(ranges[(10000, 20000)], versions) == ['gas_efficiency', 'daily_series']
+
+    batch_data = batch_cache.load_batch(cache_dir, 0, 10000, ranges[(0, 10000)])
+    assert batch_data['batch_id'] == 0
+    assert batch_data['summary'] == {'total_transactions': 1}
+    assert batch_data['gas_efficiency'] == {'total_overprovision': 4}
+
+def cached_ranges(cache_dir):
+    """Block ranges with files left in the cache"""
+    return sorted(batch_cache.range_index(batch_cache.load_manifest(cache_dir)))
+
+def test_budget_evicts_least_recently_used_ranges_whole(cache_dir, write_batch):
+    for start in range(0, 40000, 10000):
+        write_batch(start, start + 10000, {'0x' + 'ab' * 20: [20_000_000]})
+    def touch(entries):
+        for entry in entries.values():
+            entry['last_access'] = entry['start_block']
+    batch_cache.update_manifest(cache_dir, touch)
+    sizes = {}
+    for entry in batch_cache.load_manifest(cache_dir)['entries'].values():
+        sizes[entry['start_block']] = sizes.get(entry['start_block'], 0) + entry['size']
+
+    # Reading the oldest range makes it the most recently used
+    batch_cache.note_access(cache_dir, batch_cache.section_filename(0, 10000, 'summary'))
+    batch_cache.flush_access(cache_dir)
+    assert batch_cache.enforce_budget(cache_dir, sum(sizes.values()) - 1) == sizes[10000]
+    assert cached_ranges(cache_dir) == [(0, 10000), (20000, 30000), (30000, 40000)]
+    assert len(os.listdir(cache_dir)) == 3 * 4 + 2
+
+    # The pinned window is kept even when it was used longest ago
+    assert batch_cache.enforce_budget(cache_dir, sizes[20000], pinned_window=(20000, 30000)) == sizes[0] + sizes[30000]
+    assert cached_ranges(cache_dir) == [(20000, 30000)]
+    assert batch_cache.enforce_budget(cache_dir, sizes[20000]) == 0
+
+def test_decoded_files_are_kept_until_evicted_or_replaced(cache_dir, monkeypatch):
+    monkeypatch.setattr(batch_cache, '_decoded', collections.OrderedDict())
+    monkeypatch.setattr(batch_cache, '_decoded_stats', {'limit': 0, 'bytes': 0, 'hits': 0, 'misses': 0})
+    paths = []
+    for start in range(0, 30000, 10000):
+        batch_cache.write_section_file(cache_dir, start, start + 10000, 'summary', 1, {'total_transactions': start})
+        paths.append(os.path.join(cache_dir, batch_cache.section_filename(start, start + 10000, 'summary')))
+    decoded = []
+    def decode(content):
+        decoded.append(content['start_block'])
+        return content
+    # Room for two of the three files
+    batch_cache.set_decoded_cache_size(2 * os.path.getsize(paths[2]))
+
+    first = batch_cache.read_cached(paths[0], decode)
+    batch_cache.read_cached(paths[1], decode)
+    assert batch_cache.read_cached(paths[0], decode) is first
+    batch_cache.read_cached(paths[2], decode)
+    batch_cache.read_cached(paths[1], decode)
+    assert decoded == [0, 10000, 20000, 10000]
+    stats = batch_cache.decoded_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['files']) == (1, 4, 2)
+    assert stats['bytes'] <= stats['limit']
+
+    # A rewritten file is read again, under the same path
+    batch_cache.write_section_file(cache_dir, 20000, 30000, 'summary', 1, {'total_transactions': 7})
+    assert batch_cache.read_cached(paths[2], decode)['data'] == {'total_transactions': 7}
+    assert decoded[-1] == 20000
+
+    batch_cache.set_decoded_cache_size(0)
+    assert batch_cache.decoded_cache_stats()['files'] == 0
+    assert batch_cache.read_cached(paths[2]) is not batch_cache.read_cached(paths[2])
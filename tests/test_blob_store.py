@@ -0,0 +1,39 @@
+import os
+
+import blob_store
+
+def write_output(path, text):
+    with blob_store.replacing(path) as tmp_path, open(tmp_path, 'w') as f:
+        f.write(text)
+
+def test_linked_output_can_be_overwritten(tmp_path):
+    blob_dir = str(tmp_path / "blobs")
+    first, second = str(tmp_path / "report_1.md"), str(tmp_path / "report_2.md")
+    write_output(first, "same results")
+    write_output(second, "same results")
+    assert blob_store.store_outputs([first, second], blob_dir) == 1
+    assert os.path.samefile(first, second)
+
+    # Rewriting one name leaves the blob and the other names untouched
+    write_output(second, "new results")
+    with open(first) as f:
+        assert f.read() == "same results"
+    with open(second) as f:
+        assert f.read() == "new results"
+    digest = blob_store.hash_file(first)
+    assert os.path.samefile(first, blob_store.blob_path(blob_dir, digest))
+    assert os.access(first, os.W_OK)
+    assert sorted(os.listdir(tmp_path)) == ["blobs", "report_1.md", "report_2.md"]
+
+def test_failed_write_keeps_the_output(tmp_path):
+    path = str(tmp_path / "report.md")
+    write_output(path, "results")
+    try:
+        with blob_store.replacing(path) as tmp_name, open(tmp_name, 'w') as f:
+            f.write("partial")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    with open(path) as f:
+        assert f.read() == "results"
+    assert os.listdir(tmp_path) == ["report.md"]
@@ -0,0 +1,40 @@
+import numpy as np
+
+import bloom_filters
+
+def addresses(seed, count):
+    """Random addresses, with low and repeated-byte ones mixed in"""
+    rng = np.random.default_rng(seed)
+    random = ['0x' + rng.bytes(20).hex() for _ in range(count)]
+    return random + ['0x' + f"{i:040x}" for i in range(count // 10)] + ['0x' + f"{i:02x}" * 20 for i in range(256)]
+
+def test_filters_have_no_false_negatives():
+    members = addresses(1, 5000)
+    bloom = bloom_filters.build_filter(members)
+    assert sorted(bloom_filters.filter_candidates(bloom, *bloom_filters.address_hashes(members)).tolist()) == \
+        list(range(len(members)))
+
+    rng = np.random.default_rng(2)
+    others = ['0x' + rng.bytes(20).hex() for _ in range(20000)]
+    false_positives = len(bloom_filters.filter_candidates(bloom, *bloom_filters.address_hashes(others)))
+    assert false_positives < 3 * bloom_filters.FALSE_POSITIVE_RATE * len(others)
+
+def test_probe_matches_a_scan_of_the_batches(cache_dir, write_batch):
+    members = addresses(3, 300)
+    batches = {}
+    for i, start in enumerate(range(0, 50000, 10000)):
+        senders = {address: [20_000_000] * (i + 1) for address in members[i * 60:(i + 2) * 60]}
+        write_batch(start, start + 10000, senders, {members[-1]: [20_000_000]})
+        batches[start] = senders
+    assert bloom_filters.rebuild_filters(cache_dir) == 10
+    assert bloom_filters.rebuild_filters(cache_dir) == 0
+
+    probes = members[::3] + addresses(4, 100)[:100]
+    found = bloom_filters.find_affected(cache_dir, [probe.upper().replace('0X', '0x') for probe in probes], 10000, 40000)
+    expected = {}
+    for start in range(10000, 40000, 10000):
+        for address in probes:
+            if address in batches[start]:
+                expected.setdefault(address, []).append((start, len(batches[start][address])))
+    assert found['affected_addresses'] == expected
+    assert found['to_addresses'] == {members[-1]: [(start, 1) for start in range(10000, 40000, 10000)]}
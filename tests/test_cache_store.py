@@ -0,0 +1,35 @@
+import cache_store
+from conftest import affected_rows
+
+SENDER = '0x' + 'ab' * 20
+
+def batch(start_block, end_block, limits):
+    """Gas cap batch of one sender's transactions"""
+    return {
+        'batch_id': None, 'start_block': start_block, 'end_block': end_block,
+        'summary': {'total_transactions': 10 * len(limits), 'affected_transactions': len(limits),
+                    'high_gas_transactions': len(limits)},
+        'affected_addresses': affected_rows({SENDER: limits}),
+        'to_addresses': [],
+        'gas_efficiency': {},
+    }
+
+def test_superseded_and_overlapping_ranges_are_summed_once(tmp_path):
+    store = cache_store.open_store(str(tmp_path / "batches.sqlite"))
+    cache_store.write_batch(store, batch(0, 10000, [20_000_000] * 3))
+    cache_store.write_batch(store, batch(10000, 15000, [20_000_000]))
+    cache_store.write_batch(store, batch(10000, 20000, [20_000_000] * 2))
+    assert [(b['start_block'], b['end_block']) for b in cache_store.list_batches(store)] == [(0, 10000), (10000, 20000)]
+
+    # A range imported from an older batch grid overlaps both
+    cache_store.write_batch(store, batch(2000, 13000, [20_000_000] * 7))
+    summary = cache_store.aggregate_summary(store)
+    assert (summary['batch_count'], summary['total_affected']) == (2, 5)
+    assert cache_store.aggregate_addresses(store)[SENDER]['transaction_count'] == 5
+
+    # Both ranges inside the window are kept; their shared blocks are counted twice until stored on their own
+    assert cache_store.aggregate_summary(store, 0, 15000)['total_affected'] == 10
+    cache_store.write_batch(store, batch(2000, 10000, [20_000_000] * 2))
+    summary = cache_store.aggregate_summary(store, 0, 15000)
+    assert (summary['batch_count'], summary['total_affected']) == (2, 8)
+    assert cache_store.aggregate_addresses(store, 0, 15000)[SENDER]['transaction_count'] == 8
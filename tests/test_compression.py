@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+import address_dict
+import batch_cache
+import compression
+
+SENDER = '0x' + 'ab' * 20
+
+@pytest.mark.parametrize('codec', compression.available_codecs())
+def test_files_round_trip(tmp_path, codec):
+    path = str(tmp_path / f"rows.csv{compression.CODEC_SUFFIXES[codec]}")
+    text = "address,transaction_count\n" + "".join(f"{SENDER},{i}\n" for i in range(1000))
+    with compression.open_text(path, 'w', newline='') as f:
+        f.write(text)
+    assert compression.codec_for_path(path) == codec
+    with compression.open_text(path) as f:
+        assert f.read() == text
+    with open(path, 'rb') as f:
+        assert compression.decompress_bytes(f.read(), codec) == text.encode()
+    assert compression.decompress_bytes(compression.compress_bytes(text.encode(), codec), codec) == text.encode()
+
+def test_recompressed_cache_reads_the_same(cache_dir, write_batch):
+    write_batch(0, 10000, {SENDER: [20_000_000, 30_000_000]})
+    ranges = batch_cache.range_index(batch_cache.load_manifest(cache_dir))
+    before = batch_cache.load_batch(cache_dir, 0, 10000, ranges[(0, 10000)])
+
+    codec = compression.default_codec()
+    assert batch_cache.recompress_cache(cache_dir, codec) == 4
+    manifest = batch_cache.load_manifest(cache_dir)
+    assert all(compression.codec_for_path(filename) == codec for filename in manifest['entries'])
+    assert sorted(os.listdir(cache_dir)) == sorted(list(manifest['entries']) + [address_dict.DICTIONARY_FILE, batch_cache.MANIFEST_FILE])
+    after = batch_cache.load_batch(cache_dir, 0, 10000, batch_cache.range_index(manifest)[(0, 10000)])
+    assert after == before
+
+def test_codecs_fall_back_to_installed_packages(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, 'zstandard', None)
+    assert compression.default_codec() == ('lz4' if compression.lz4 is not None else 'gzip')
+    monkeypatch.setattr(compression, 'lz4', None)
+    assert compression.default_codec() == 'gzip'
+    assert compression.available_codecs() == ['none', 'gzip']
+
+    # Files of a missing codec fail clearly instead of reading as garbage
+    with pytest.raises(ImportError, match='zstandard'):
+        compression.open_text(str(tmp_path / "rows.json.zst"))
@@ -0,0 +1,216 @@
+import hashlib
+import os
+
+import numpy as np
+
+import activity_bitmaps
+import address_index
+import batch_cache
+import daily_series
+import distinct_counts
+import prefix_sums
+from conftest import CAP
+
+def write_transactions(cache_dir, start_block, end_block, transactions):
+    """Cache the partition, daily and address sections of a batch from (block, sender, gas limit) tuples"""
+    inside = [tx for tx in transactions if start_block <= tx[0] < end_block]
+    def grouped(key):
+        groups = {}
+        for tx in inside:
+            groups.setdefault(key(tx), []).append(tx)
+        return sorted(groups.items())
+
+    sections = {
+        'partition_summary': [
+            {'partition': partition, 'total_transactions': len(txs),
+             'affected_transactions': sum(tx[2] > CAP for tx in txs), 'high_gas_transactions': len(txs),
+             'total_excess_gas': sum(max(tx[2] - CAP, 0) for tx in txs)}
+            for partition, txs in grouped(lambda tx: tx[0] // prefix_sums.PARTITION_SIZE)],
+        'daily_summary': [
+            {'day': day, 'total_transactions': len(txs), 'affected_transactions': sum(tx[2] > CAP for tx in txs),
+             'total_excess_gas': sum(max(tx[2] - CAP, 0) for tx in txs), 'additional_gas_cost': 0}
+            for day, txs in grouped(lambda tx: tx[0] // daily_series.BLOCKS_PER_DAY)],
+        'daily_sketches': [
+            {'day': tx[0] // daily_series.BLOCKS_PER_DAY, 'register': sender_hash(tx[1]) % distinct_counts.REGISTERS,
+             'rank': sender_hash(tx[1]) % 5 + 1}
+            for tx in inside if tx[2] > CAP],
+        'affected_addresses': [
+            {'from_address': sender, 'transaction_count': len(txs)}
+            for sender, txs in grouped(lambda tx: tx[1])],
+        'to_addresses': [
+            {'to_address': sender, 'transaction_count': len(txs)}
+            for sender, txs in grouped(lambda tx: tx[1])],
+    }
+    for section, data in sections.items():
+        batch_cache.write_section_file(cache_dir, start_block, end_block, section, 1, data)
+
+def sender_hash(sender):
+    """Stable integer hash of an address"""
+    return int(hashlib.sha256(sender.encode()).hexdigest(), 16)
+
+def random_transactions(seed, start_block, end_block, count=200):
+    """Transactions of 40 senders with gas limits around the cap"""
+    rng = np.random.default_rng(seed)
+    return [(int(block), '0x' + f"{int(sender):040x}", int(limit))
+            for block, sender, limit in zip(rng.integers(start_block, end_block, count),
+                                            rng.integers(0, 40, count),
+                                            rng.integers(CAP - 5_000_000, CAP + 5_000_000, count))]
+
+def build_all(cache_dir, rebuild=False):
+    """Build the prefix sums, daily series and activity bitmaps of a cache"""
+    return (prefix_sums.build_prefix_sums(cache_dir, rebuild),
+            daily_series.build_daily_series(cache_dir, rebuild),
+            activity_bitmaps.build_activity(cache_dir, rebuild))
+
+def test_derived_files_extend_to_match_a_rebuild(cache_dir, capsys):
+    transactions = random_transactions(1, 0, 40000)
+    for start_block, end_block in ((0, 10000), (10000, 20000), (20000, 25000)):
+        write_transactions(cache_dir, start_block, end_block, transactions)
+    build_all(cache_dir)
+    capsys.readouterr()
+
+    # The open batch grows and a new one opens
+    for start_block, end_block in ((20000, 30000), (30000, 33000)):
+        write_transactions(cache_dir, start_block, end_block, transactions)
+    prefix, series, activity = build_all(cache_dir)
+    output = capsys.readouterr().out
+    assert "Partition prefix sums updated from 2 batches" in output
+    assert "Daily series updated from 2 batches" in output
+    assert "Activity bitmaps: 2 of 4 batches read" in output
+
+    full_prefix, full_series, full_activity = build_all(cache_dir, rebuild=True)
+    np.testing.assert_array_equal(prefix['cumulative'], full_prefix['cumulative'])
+    assert prefix['first_partition'] == full_prefix['first_partition']
+    np.testing.assert_array_equal(series['cumulative'], full_series['cumulative'])
+    np.testing.assert_array_equal(series['registers'], full_series['registers'])
+    assert series['first_day'] == full_series['first_day']
+    assert activity['periods'].tolist() == full_activity['periods'].tolist() == [0, 10000, 20000, 30000]
+    for role in activity_bitmaps.ROLES:
+        assert [activity_bitmaps.bitmap_ids(b).tolist() for b in activity[role]] == \
+            [activity_bitmaps.bitmap_ids(b).tolist() for b in full_activity[role]]
+
+    # The daily totals match the transactions themselves
+    affected = daily_series.FIELDS.index('affected_transactions')
+    per_day = daily_series.daily_values(series, 0, len(series['cumulative']) - 1)[:, affected]
+    expected = np.bincount([block // daily_series.BLOCKS_PER_DAY for block, _, limit in transactions
+                            if block < 33000 and limit > CAP])
+    assert per_day.tolist() == expected.tolist()
+
+def test_prefix_sum_windows_match_the_transactions(cache_dir):
+    transactions = random_transactions(5, 3000, 40000, count=500)
+    for start_block, end_block in ((0, 10000), (10000, 20000), (20000, 30000), (30000, 40000)):
+        write_transactions(cache_dir, start_block, end_block, transactions)
+    prefix = prefix_sums.build_prefix_sums(cache_dir)
+    assert prefix_sums.covered_blocks(prefix)[0] == 3000
+
+    # Windows on partition boundaries, including ones reaching past the cached blocks
+    rng = np.random.default_rng(6)
+    windows = [(0, 50000), (3000, 3000), (45000, 60000)]
+    windows += [tuple(sorted(rng.integers(0, 41, 2) * prefix_sums.PARTITION_SIZE)) for _ in range(20)]
+    for start_block, end_block in windows:
+        inside = [tx for tx in transactions if start_block <= tx[0] < end_block]
+        totals = prefix_sums.range_totals(prefix, start_block, end_block)
+        assert totals['total_transactions'] == len(inside)
+        assert totals['affected_transactions'] == sum(tx[2] > CAP for tx in inside)
+        assert totals['total_excess_gas'] == sum(max(tx[2] - CAP, 0) for tx in inside)
+
+def test_unchanged_cache_reads_no_batches(cache_dir, capsys):
+    write_transactions(cache_dir, 0, 10000, random_transactions(2, 0, 10000))
+    build_all(cache_dir)
+    capsys.readouterr()
+    build_all(cache_dir)
+    assert capsys.readouterr().out == ""
+
+def test_address_index_compaction_waits_for_the_log(cache_dir):
+    for start_block in range(0, 50000, 10000):
+        address_index.append_batch(cache_dir, 'from', start_block, start_block + 10000,
+                                   {address_id: 1 for address_id in range(1000)})
+    address_index.compact_index(cache_dir)
+    index_path, log_path = address_index.index_paths(cache_dir, 'from')
+    assert not os.path.exists(log_path)
+
+    # A small log is left for lookups to merge until it is worth folding in
+    address_index.append_batch(cache_dir, 'from', 50000, 60000, {7: 3})
+    address_index.compact_index(cache_dir)
+    assert os.path.exists(log_path)
+    assert len(address_index.read_postings(index_path, 7)) == 5
+    assert address_index.read_log(log_path) == {50: {7: 3}}
+
+    address_index.compact_index(cache_dir, force=True)
+    assert not os.path.exists(log_path)
+    assert address_index.read_postings(index_path, 7)[-1] == (50, 3)
+
+def test_address_history_counts_shared_blocks_once(cache_dir, write_batch):
+    first, second = '0x' + 'ab' * 20, '0x' + 'cd' * 20
+    # Legacy batches overlapping in blocks 12000-13000
+    write_batch(2000, 13000, {first: [20_000_000] * 5, second: [20_000_000] * 2})
+    write_batch(12000, 23000, {first: [20_000_000] * 3, second: [20_000_000]})
+    ranges = batch_cache.range_index(batch_cache.load_manifest(cache_dir))
+    for batch_range in sorted(ranges):
+        address_index.index_batch(cache_dir, ranges, batch_range)
+    assert address_index.address_history(cache_dir, first)['from'] == [(2000, 5), (12000, 3)]
+
+    # Once the shared blocks are cached on their own, the later batch is indexed again without them
+    write_batch(12000, 13000, {first: [20_000_000], second: [20_000_000]})
+    address_index.index_overlaps(cache_dir, [(12000, 13000)])
+    expected = {first: [(2000, 5), (12000, 2)], second: [(2000, 2)]}
+    for address, history in expected.items():
+        assert address_index.address_history(cache_dir, address) == {'from': history, 'to': history}
+
+    address_index.rebuild_index(cache_dir)
+    for address, history in expected.items():
+        assert address_index.address_history(cache_dir, address.upper().replace('0X', '0x'))['to'] == history
+    assert address_index.address_history(cache_dir, '0x' + 'ef' * 20) == {'from': [], 'to': []}
+
+def test_daily_rolling_totals_match_the_transactions(cache_dir):
+    transactions = random_transactions(3, 0, 60000, count=600)
+    for start_block in range(0, 60000, 10000):
+        write_transactions(cache_dir, start_block, start_block + 10000, transactions)
+    series = daily_series.build_daily_series(cache_dir)
+    lo, hi = daily_series.day_range(series)
+
+    days = [[tx for tx in transactions if tx[0] // daily_series.BLOCKS_PER_DAY == day] for day in range(hi)]
+    affected = daily_series.FIELDS.index('affected_transactions')
+    rolling = daily_series.rolling_sums(series, lo, hi, 3)[:, affected]
+    assert rolling.tolist() == [sum(tx[2] > CAP for txs in days[max(day - 2, 0):day + 1] for tx in txs)
+                                for day in range(hi)]
+
+    # Merged day registers equal the registers of the senders of the whole trailing window
+    for day in range(hi):
+        senders = {tx[1] for txs in days[max(day - 2, 0):day + 1] for tx in txs if tx[2] > CAP}
+        registers = distinct_counts.empty_registers()
+        for sender in senders:
+            register = sender_hash(sender) % distinct_counts.REGISTERS
+            registers[register] = max(registers[register], sender_hash(sender) % 5 + 1)
+        assert daily_series.rolling_unique(series, day, day + 1, 3)[0] == \
+            distinct_counts.estimate_distinct(registers)
+
+def test_activity_tables_match_set_operations(cache_dir):
+    transactions = random_transactions(4, 0, 50000, count=150)
+    for start_block in range(0, 50000, 10000):
+        write_transactions(cache_dir, start_block, start_block + 10000, transactions)
+    activity = activity_bitmaps.build_activity(cache_dir)
+    bitmaps = activity['senders']
+    sets = [set(activity_bitmaps.bitmap_ids(bitmap).tolist()) for bitmap in bitmaps]
+    assert [len(ids) for ids in sets] == [len({tx[1] for tx in transactions if start <= tx[0] < start + 10000})
+                                          for start in range(0, 50000, 10000)]
+
+    assert activity_bitmaps.retention(bitmaps, 2) == [len(sets[i] & sets[i + 2]) / len(sets[i]) for i in range(3)]
+    seen = set()
+    for i, row in enumerate(activity_bitmaps.churn(bitmaps)):
+        previous = sets[i - 1] if i else set()
+        assert row == {'new': len(sets[i] - seen), 'returning': len(sets[i] & previous),
+                       'churned': len(previous - sets[i])}
+        seen |= sets[i]
+
+    groups = [sets[0] | sets[1], sets[2] | sets[3], sets[4]]
+    expected, seen = [], set()
+    for c, members in enumerate(groups):
+        expected.append([len((members - seen) & later) for later in groups[c:]])
+        seen |= members
+    assert activity_bitmaps.cohort_table(bitmaps, 2) == expected
+
+    first_last = activity_bitmaps.first_last_seen(bitmaps)
+    for address_id, first, last, active in zip(*(first_last[key].tolist() for key in ('ids', 'first', 'last', 'active'))):
+        periods = [i for i, ids in enumerate(sets) if address_id in ids]
+        assert (first, last, active) == (periods[0], periods[-1], len(periods))
@@ -0,0 +1,44 @@
+import hashlib
+
+import numpy as np
+
+import batch_cache
+import distinct_counts
+
+def sketch_rows(name, addresses):
+    """Register rows of one sketch as the query computes them, from a 64-bit hash per address"""
+    precision = distinct_counts.HLL_PRECISION
+    ranks = {}
+    for address in addresses:
+        h = int.from_bytes(hashlib.blake2b(address.lower().encode(), digest_size=8).digest(), 'little')
+        register, w = h & (distinct_counts.REGISTERS - 1), h >> precision
+        rank = distinct_counts.HASH_BITS - precision + 1 if w == 0 else (w & -w).bit_length()
+        ranks[register] = max(ranks.get(register, 0), rank)
+    return [{'sketch': name, 'register': register, 'rank': rank} for register, rank in ranks.items()]
+
+def test_window_union_estimates_distinct_addresses(cache_dir):
+    rng = np.random.default_rng(9)
+    batches = []
+    for start in range(0, 100000, 10000):
+        # Batches overlap heavily, so summing per-batch counts would overcount
+        addresses = {'0x' + f"{i:040x}" for i in rng.integers(0, 60000, 20000)}
+        batches.append(addresses)
+        batch_cache.write_section_file(cache_dir, start, start + 10000, distinct_counts.SECTION, 1,
+                                       sketch_rows('affected_senders', addresses))
+    seen = set().union(*batches)
+
+    estimates = distinct_counts.window_estimates(cache_dir)
+    assert abs(estimates['affected_senders'] - len(seen)) <= 3 * distinct_counts.standard_error() * len(seen)
+    assert estimates['affected_recipients'] == 0
+
+    # Merged registers of a window are exactly the registers of the union of its batches
+    merged, missing = distinct_counts.window_registers(cache_dir, 0, 50000)
+    expected = distinct_counts.section_registers(sketch_rows('affected_senders', set().union(*batches[:5])))
+    assert missing == 0
+    np.testing.assert_array_equal(merged['affected_senders'], expected['affected_senders'])
+
+def test_small_sets_use_linear_counting():
+    registers = distinct_counts.section_registers(
+        sketch_rows('high_gas_senders', ['0x' + f"{i:040x}" for i in range(200)]))['high_gas_senders']
+    assert abs(distinct_counts.estimate_distinct(registers) - 200) <= 5
+    assert distinct_counts.estimate_distinct(distinct_counts.empty_registers()) == 0
@@ -0,0 +1,45 @@
+from collections import Counter
+
+import numpy as np
+
+import heavy_hitters
+
+def test_merged_sketch_bounds_every_count():
+    rng = np.random.default_rng(4)
+    addresses = ['0x' + f"{i:04x}" * 10 for i in range(300)]
+    truth = Counter()
+    sketch = heavy_hitters.empty_sketch(capacity=16)
+    for _ in range(20):
+        # Few heavy senders and a long tail, split over batches
+        picks = rng.choice(len(addresses), 40, replace=False)
+        counts = (rng.zipf(1.5, 40) * (picks < 5) * 50 + rng.integers(1, 5, 40)).tolist()
+        keys = [addresses[i] for i in picks]
+        truth.update(dict(zip(keys, counts)))
+        sketch = heavy_hitters.merge_sketches(sketch, heavy_hitters.build_sketch(keys, counts, capacity=16))
+
+    total = sum(truth.values())
+    assert sketch['total'] == total
+    assert len(sketch['keys']) <= 16
+    assert sketch['error'] <= total / 17
+    estimates = dict(zip(sketch['keys'].tolist(), sketch['counts'].tolist()))
+    for address, count in truth.items():
+        estimate = estimates.get(address, 0)
+        assert count - sketch['error'] <= estimate <= count
+
+    # Entries marked guaranteed are truly in the top list
+    top = heavy_hitters.top_entries(sketch, 5)
+    true_top = {address for address, _ in truth.most_common(5)}
+    assert any(entry['guaranteed'] for entry in top)
+    for entry in top:
+        assert entry['lower_bound'] <= truth[entry['address']] <= entry['upper_bound']
+        if entry['guaranteed']:
+            assert entry['address'] in true_top
+
+def test_merge_order_does_not_change_exact_sketches():
+    first = heavy_hitters.build_sketch(['0x' + 'aa' * 20, '0x' + 'bb' * 20], [5, 3])
+    second = heavy_hitters.build_sketch(['0x' + 'BB' * 20], [4])
+    merged = heavy_hitters.merge_sketches(first, second)
+    assert merged['error'] == 0
+    assert dict(zip(merged['keys'].tolist(), merged['counts'].tolist())) == {'0x' + 'bb' * 20: 7, '0x' + 'aa' * 20: 5}
+    other = heavy_hitters.merge_sketches(second, first)
+    assert other['keys'].tolist() == merged['keys'].tolist()
@@ -0,0 +1,39 @@
+import os
+
+import batch_cache
+import cache_store
+import importer
+
+SENDER = '0x' + 'ab' * 20
+
+def test_import_records_provenance_and_skips_unchanged_files(tmp_path, cache_dir, write_batch, capsys):
+    write_batch(0, 10000, {SENDER: [20_000_000, 30_000_000]})
+    # A range holding only sections the store does not keep
+    batch_cache.write_section_file(cache_dir, 10000, 20000, 'daily_summary', 1, [{'day': 1, 'total_transactions': 5}])
+    csv_path = str(tmp_path / "gas_cap_6month_all_addresses_20250102_030405.csv")
+    with open(csv_path, 'w') as f:
+        f.write(f"address,transaction_count\n{SENDER.upper().replace('0X', '0x')},2\n")
+
+    store = cache_store.open_store(str(tmp_path / "batches.sqlite"))
+    assert importer.import_paths(store, [cache_dir, csv_path], workers=2) == 6
+    assert [(b['start_block'], b['end_block']) for b in cache_store.list_batches(store)] == [(0, 10000)]
+    assert not cache_store.has_batch(store, 10000, 20000)
+    assert cache_store.aggregate_addresses(store)[SENDER]['transaction_count'] == 2
+
+    provenance = {row['dataset']: os.path.basename(row['path']) for row in store.execute(
+        "SELECT dataset, path FROM provenance JOIN sources USING (source_id) WHERE provenance.start_block = 0")}
+    assert provenance == {section: batch_cache.section_filename(0, 10000, section)
+                          for section in cache_store.BATCH_DATASETS}
+    csv_source, = cache_store.list_sources(store, 'csv')
+    assert csv_source['run_timestamp'] == '2025-01-02 03:04:05'
+    assert tuple(store.execute("SELECT address, transaction_count FROM run_rows").fetchone()) == (SENDER, 2)
+
+    # A second run loads only the file that changed
+    capsys.readouterr()
+    assert importer.import_paths(store, [cache_dir, csv_path], workers=2) == 0
+    assert "6 unchanged" in capsys.readouterr().out
+    with open(csv_path, 'a') as f:
+        f.write(f"{'0x' + 'cd' * 20},1\n")
+    assert importer.import_paths(store, [cache_dir, csv_path], workers=2) == 1
+    assert len(cache_store.list_sources(store, 'csv')) == 1
+    assert store.execute("SELECT COUNT(*) FROM run_rows").fetchone()[0] == 2
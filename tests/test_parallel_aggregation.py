@@ -0,0 +1,24 @@
+import numpy as np
+
+import parallel_aggregation
+import rollups
+from test_rollups import assert_same_state
+
+def test_parallel_fold_matches_sequential_fold(cache_dir, write_batch):
+    senders = ['0x' + f"{i:02x}" * 20 for i in range(8)]
+    rng = np.random.default_rng(3)
+    for start in range(0, 70000, 10000):
+        write_batch(start, start + 10000,
+                    {address: rng.integers(17_000_000, 40_000_000, rng.integers(1, 4)).tolist()
+                     for address in rng.choice(senders, 4, replace=False)})
+
+    # Three shards leave an odd partial to carry up the merge tree
+    state = rollups.window_state(cache_dir, workers=3)
+    expected = rollups.window_state(cache_dir)
+    assert state['total_transactions'] == expected['total_transactions'] > 0
+    assert_same_state(state, expected)
+
+def test_tree_merge_of_one_state_is_that_state(cache_dir, write_batch):
+    write_batch(0, 10000, {'0x' + 'aa' * 20: [20_000_000]})
+    state = rollups.window_state(cache_dir)
+    assert parallel_aggregation.tree_merge([state]) is state
@@ -0,0 +1,43 @@
+import math
+
+import numpy as np
+import pytest
+
+import batch_cache
+import quantile_sketches
+
+def sketch_rows(measure, values):
+    """Bucket rows of one measure as the query computes them"""
+    buckets = [math.ceil(math.log(value) / quantile_sketches.LOG_GAMMA) if value > 0 else quantile_sketches.ZERO_BUCKET
+               for value in values]
+    found, counts = np.unique(buckets, return_counts=True)
+    return [{'measure': measure, 'bucket': int(bucket), 'count': int(count)} for bucket, count in zip(found, counts)]
+
+def test_window_quantiles_within_relative_accuracy(cache_dir):
+    rng = np.random.default_rng(8)
+    values = []
+    for start in range(0, 60000, 10000):
+        batch = np.concatenate((rng.lognormal(15, 1.5, 5000), np.zeros(50)))
+        values.append(batch)
+        batch_cache.write_section_file(cache_dir, start, start + 10000, quantile_sketches.SECTION, 1,
+                                       sketch_rows('gas_limit', batch))
+
+    sketches, missing = quantile_sketches.window_sketches(cache_dir)
+    ordered = np.sort(np.concatenate(values))
+    assert missing == 0
+    assert int(sketches['gas_limit']['counts'].sum()) == len(ordered)
+    assert quantile_sketches.quantile(sketches['gas_used'], 0.5) is None
+    for q in (0.001, 0.25, 0.5, 0.9, 0.99, 0.999, 1.0):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert quantile_sketches.quantile(sketches['gas_limit'], q) == \
+            pytest.approx(exact, rel=quantile_sketches.RELATIVE_ACCURACY, abs=0)
+
+def test_merge_is_exact():
+    rng = np.random.default_rng(1)
+    first, second = rng.lognormal(10, 2, 1000), rng.lognormal(12, 1, 700)
+    merged = quantile_sketches.merge_sketches(
+        quantile_sketches.section_sketches(sketch_rows('gas_price', first))['gas_price'],
+        quantile_sketches.section_sketches(sketch_rows('gas_price', second))['gas_price'])
+    whole = quantile_sketches.section_sketches(sketch_rows('gas_price', np.concatenate((first, second))))['gas_price']
+    np.testing.assert_array_equal(merged['buckets'], whole['buckets'])
+    np.testing.assert_array_equal(merged['counts'], whole['counts'])
@@ -0,0 +1,116 @@
+import numpy as np
+
+import aggregation
+import rollups
+from conftest import affected_rows
+
+def assert_same_state(state, expected):
+    """Compare two aggregate states field by field"""
+    for key in aggregation.SCALAR_KEYS:
+        assert state[key] == expected[key], key
+    for name in aggregation.AGGREGATE_FIELDS:
+        assert state[name].dtype == expected[name].dtype
+        np.testing.assert_array_equal(state[name][aggregation.KEY_FIELD], expected[name][aggregation.KEY_FIELD])
+        for field in state[name].dtype.names[1:]:
+            np.testing.assert_allclose(state[name][field], expected[name][field], err_msg=f"{name}.{field}")
+    assert aggregation.efficiency_values(state['gas_efficiency_stats']) == \
+        aggregation.efficiency_values(expected['gas_efficiency_stats'])
+
+def test_superseded_open_batch_keeps_earlier_sums(cache_dir, write_batch):
+    write_batch(0, 10000, {'0x' + 'aa' * 20: [20_000_000] * 3})
+    write_batch(10000, 15000, {'0x' + 'aa' * 20: [30_000_000]})
+    rollups.window_state(cache_dir, incremental=True)
+
+    # The open batch grows; its row was the only maxima row left for the address
+    write_batch(10000, 20000, {'0x' + 'aa' * 20: [30_000_000, 25_000_000]})
+    state = rollups.window_state(cache_dir, incremental=True)
+    expected = rollups.window_state(cache_dir)
+
+    assert state['address_aggregates']['transaction_count'].tolist() == [5]
+    assert state['address_aggregates']['max_gas_limit'].tolist() == [30_000_000]
+    assert_same_state(state, expected)
+
+def test_sliding_window_matches_full_aggregation(cache_dir, write_batch):
+    senders = ['0x' + f"{i:02x}" * 20 for i in range(6)]
+    rng = np.random.default_rng(7)
+    def random_batch():
+        return {address: rng.integers(17_000_000, 40_000_000, rng.integers(1, 4)).tolist()
+                for address in rng.choice(senders, 3, replace=False)}
+
+    for start in range(0, 50000, 10000):
+        write_batch(start, start + 10000, random_batch())
+    write_batch(50000, 53000, random_batch())
+    rollups.window_state(cache_dir, 0, 60000, incremental=True)
+
+    # Next day: the oldest batches leave the window and the open batch is superseded
+    write_batch(50000, 60000, {**random_batch(), **{address: [39_999_999] * 3 for address in senders}})
+    write_batch(60000, 64000, random_batch())
+    for start_block, end_block in ((20000, 70000), (30000, 70000)):
+        state = rollups.window_state(cache_dir, start_block, end_block, incremental=True)
+        assert_same_state(state, rollups.window_state(cache_dir, start_block, end_block))
+
+def test_uncovered_superseded_batch_falls_back_to_full_aggregation(cache_dir, write_batch, capsys):
+    write_batch(0, 10000, {'0x' + 'aa' * 20: [20_000_000]})
+    write_batch(10000, 15000, {'0x' + 'bb' * 20: [30_000_000]})
+    rollups.window_state(cache_dir, incremental=True)
+
+    # Rewritten rather than extended: the replacement lacks an address of the superseded range
+    write_batch(10000, 20000, {'0x' + 'cc' * 20: [18_000_000]})
+    state = rollups.window_state(cache_dir, incremental=True)
+
+    assert "aggregating the full window" in capsys.readouterr().out
+    assert_same_state(state, rollups.window_state(cache_dir))
+
+def test_shared_partitions_of_legacy_batches_are_counted_once(cache_dir, write_batch, capsys):
+    # Two 11k-block batches of an older grid share the partition 10000-11000
+    first = {'0x' + 'aa' * 20: [20_000_000] * 2}
+    shared = {'0x' + 'aa' * 20: [30_000_000], '0x' + 'bb' * 20: [18_000_000]}
+    last = {'0x' + 'bb' * 20: [17_000_000]}
+    write_batch(0, 11000, {'0x' + 'aa' * 20: [20_000_000] * 2 + [30_000_000], '0x' + 'bb' * 20: [18_000_000]})
+    write_batch(10000, 21000, {'0x' + 'aa' * 20: [30_000_000], '0x' + 'bb' * 20: [18_000_000, 17_000_000]})
+    doubled = rollups.window_state(cache_dir)
+    assert "counted twice" in capsys.readouterr().out
+    assert doubled['address_aggregates']['transaction_count'].tolist() == [4, 3]
+
+    write_batch(10000, 11000, shared)
+    state = rollups.window_state(cache_dir, incremental=True)
+    expected = aggregation.fold_batches(aggregation.new_aggregate_state(), [
+        {'start_block': 0, 'affected_addresses': affected_rows(first)},
+        {'start_block': 10000, 'affected_addresses': affected_rows(shared)},
+        {'start_block': 11000, 'affected_addresses': affected_rows(last)},
+    ])
+    assert state['batch_count'] == 2
+    assert state['total_affected'] == 5
+    assert state['address_aggregates']['transaction_count'].tolist() == [3, 2]
+    np.testing.assert_allclose(state['address_aggregates']['total_excess_gas'],
+                               expected['address_aggregates']['total_excess_gas'])
+    assert state['address_aggregates']['max_gas_limit'].tolist() == [30_000_000, 18_000_000]
+    # The saved state keeps plain batch sums, so the next run subtracts the shared blocks again
+    assert_same_state(rollups.window_state(cache_dir, incremental=True), state)
+
+def test_saved_state_folds_only_new_batches(cache_dir, write_batch, capsys):
+    for start in range(0, 40000, 10000):
+        write_batch(start, start + 10000, {'0x' + f"{start // 10000:02x}" * 20: [20_000_000]})
+    rollups.window_state(cache_dir, incremental=True)
+    saved = rollups.load_window_state(cache_dir)
+    assert sorted(saved['members']) == [rollups.range_key((start, start + 10000)) for start in range(0, 40000, 10000)]
+    capsys.readouterr()
+
+    write_batch(40000, 50000, {'0x' + 'aa' * 20: [30_000_000]})
+    state = rollups.window_state(cache_dir, incremental=True)
+    assert "retracted 0 expired and folded 1 new batches" in capsys.readouterr().out
+    assert_same_state(state, rollups.window_state(cache_dir))
+
+    # A kept batch that changed cannot be retracted exactly, so the window is aggregated again
+    write_batch(10000, 20000, {'0x' + 'bb' * 20: [25_000_000] * 2})
+    capsys.readouterr()
+    state = rollups.window_state(cache_dir, incremental=True)
+    assert "Reused the saved window state" not in capsys.readouterr().out
+    assert state['address_aggregates']['transaction_count'].sum() == 6
+    assert_same_state(state, rollups.window_state(cache_dir))
+
+    # An unreadable saved state is ignored
+    with open(rollups.window_state_path(cache_dir), 'wb') as f:
+        f.write(b'\0' * 10)
+    assert rollups.load_window_state(cache_dir) is None
+    assert_same_state(rollups.window_state(cache_dir, incremental=True), state)